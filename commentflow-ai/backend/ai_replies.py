@@ -0,0 +1,146 @@
+import json
+import os
+import re
+
+import google.generativeai as genai
+
+from log import get_logger
+from model_router import ModelRouter, NoModelAvailable
+from prompt_templates import DEFAULT_TEMPLATE
+
+# Gemini reply generation, one comment at a time or many comments per prompt.
+#
+# The sweep batches pending comments (per video page, split by an estimated token
+# budget) into a single structured prompt that returns a JSON array of replies keyed
+# by comment ID. Replies are validated and matched back to their comments; anything
+# missing or malformed falls back to single-comment calls. Prompts come from the
+# channel's compiled PromptTemplate: its fixed instructions go out as the model's
+# system instruction and only the comments are sent with each call.
+#
+# `model_factory` builds a model from its name and system instruction; point it at a local fake to run the
+# sweep without Gemini. Calls go through `model_router`, which caches model instances
+# and routes around slow or failing models.
+
+AI_BATCH_MAX_COMMENTS = int(os.getenv("AI_BATCH_MAX_COMMENTS", "25"))
+AI_BATCH_MAX_TOKENS = int(os.getenv("AI_BATCH_MAX_TOKENS", "6000"))
+
+log = get_logger("ai")
+
+# Try a list of models (prefer flash/latest variants which are commonly available).
+CANDIDATE_MODELS = [
+    'models/gemini-flash-latest',
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-pro-latest',
+]
+
+model_factory = genai.GenerativeModel
+
+model_router = ModelRouter(
+    CANDIDATE_MODELS,
+    lambda model_name, system_instruction: model_factory(model_name, system_instruction=system_instruction),
+)
+
+
+class AIGenerationError(Exception):
+    pass
+
+
+def estimate_tokens(text):
+    # Rough heuristic (about four characters per token); only used to size batches.
+    return len(text) // 4 + 1
+
+
+def split_batches(comments, max_comments=AI_BATCH_MAX_COMMENTS, max_tokens=AI_BATCH_MAX_TOKENS):
+    batch, batch_tokens = [], 0
+    for comment in comments:
+        tokens = estimate_tokens(comment["text"])
+        if batch and (len(batch) >= max_comments or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(comment)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def response_text(response):
+    # response typically exposes `.text` on success
+    text = getattr(response, 'text', None)
+    if not text:
+        # try common response shapes
+        if hasattr(response, 'candidates') and response.candidates:
+            try:
+                text = response.candidates[0].get('content') or response.candidates[0].get('text')
+            except Exception:
+                text = str(response)
+        else:
+            text = str(response)
+    return text.strip()
+
+
+async def generate_text(prompt, system_instruction=None, **kwargs):
+    try:
+        response, model_name = await model_router.generate(prompt, system_instruction=system_instruction, **kwargs)
+    except NoModelAvailable as e:
+        raise AIGenerationError(str(e))
+    except Exception as e:
+        # none of the available candidates worked
+        raise AIGenerationError(f"AI generation failed: {e}")
+    return response_text(response), model_name
+
+
+async def generate_reply(comment_text, template=DEFAULT_TEMPLATE):
+    reply_text, model_name = await generate_text(
+        template.single_prompt(comment_text), system_instruction=template.single_instruction
+    )
+    log.debug("ai.reply", model=model_name)
+    return {"reply": reply_text, "model": model_name}
+
+
+def parse_batch_replies(text, expected_ids):
+    # Accepts a bare JSON array or one wrapped in a ```json fence; keeps only
+    # non-empty string replies for ids that were actually asked for.
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    items = json.loads(text)
+    if not isinstance(items, list):
+        raise ValueError("Batch reply is not a JSON array")
+    replies = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        comment_id, reply = item.get("id"), item.get("reply")
+        if comment_id in expected_ids and isinstance(reply, str) and reply.strip():
+            replies.setdefault(comment_id, reply.strip())
+    return replies
+
+
+async def generate_replies(comments, template=DEFAULT_TEMPLATE):
+    # `comments` is a list of {"id", "text"}. Returns {comment id: reply text}; ids that
+    # could not be answered even by a single-comment call are left out.
+    replies = {}
+    for batch in split_batches(comments):
+        expected_ids = {comment["id"] for comment in batch}
+        if len(batch) > 1:
+            try:
+                text, model_name = await generate_text(
+                    template.batch_prompt(batch),
+                    system_instruction=template.batch_instruction,
+                    generation_config={"response_mime_type": "application/json"},
+                )
+                batch_replies = parse_batch_replies(text, expected_ids)
+                log.debug("ai.batch", model=model_name, comments=len(batch), replies=len(batch_replies))
+                replies.update(batch_replies)
+            except Exception as e:
+                log.warning("ai.batch_failed", comments=len(batch), error=str(e))
+
+        for comment in batch:
+            if comment["id"] in replies:
+                continue
+            try:
+                replies[comment["id"]] = (await generate_reply(comment["text"], template))["reply"]
+            except AIGenerationError as e:
+                log.warning("ai.reply_failed", comment_id=comment["id"], error=str(e))
+    return replies
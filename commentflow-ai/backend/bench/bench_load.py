@@ -0,0 +1,280 @@
+"""Load test: sweep and reply for a fake YouTube world, then hammer the HTTP API.
+
+Everything runs in one process against in-process fakes (bench/fakes.py): YouTube
+is served at the HTTP transport, Gemini by a fake model and MongoDB by mongomock,
+so runs are reproducible and need no Google account. The sweep phase runs
+`auto_reply_task` with the reply workers until every generated comment is stored
+and replied to or skipped by triage; the endpoint phase then calls the dashboard
+endpoints as random users. Install requirements-dev.txt first (it adds mongomock).
+
+    pip install -r requirements-dev.txt
+    python bench/bench_load.py
+    python bench/bench_load.py --channels 200 --videos 50 --comments 300 --youtube-latency 0.05
+    python bench/bench_load.py --quota-error-rate 0.02 --gemini-latency 0.5 --json
+    python bench/bench_load.py --channels 1000 --videos 500 --comments 1000 --mongo-url mongodb://localhost:27017
+    YOUTUBE_HTTP_TRANSPORT=httplib2 python bench/bench_load.py    # threadpool transport, for comparison
+
+mongomock keeps everything in memory and ignores indexes (every query is a scan), so
+its numbers are pessimistic for database-bound paths and very large worlds need
+--mongo-url (the run uses and first drops its own `commentflow_bench` database).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = [
+    "/me",
+    "/youtube/stats",
+    "/youtube/weekly-stats",
+    "/youtube/videos",
+    "/youtube/video-stats?ids={video_ids}",
+    "/youtube/comments/{video_id}",
+    "/replies/queue",
+    "/youtube/quota",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=20, help="connected users, one channel each")
+    parser.add_argument("--videos", type=int, default=10, help="uploads per channel")
+    parser.add_argument("--comments", type=int, default=200, help="comment threads per video")
+    parser.add_argument("--youtube-latency", type=float, default=0.01, help="mean seconds per YouTube call")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="share of YouTube calls failing with 403")
+    parser.add_argument("--quota-error-reason", default="rateLimitExceeded",
+                        help="reason on injected 403s (quotaExceeded blocks the project until the daily reset)")
+    parser.add_argument("--gemini-latency", type=float, default=0.05, help="seconds per Gemini call")
+    parser.add_argument("--gemini-per-comment-latency", type=float, default=0.002,
+                        help="extra seconds per comment in a Gemini prompt")
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="share of Gemini calls that fail")
+    parser.add_argument("--concurrent-users", type=int, default=8, help="users swept at once")
+    parser.add_argument("--reply-workers", type=int, default=8, help="reply queue workers")
+    parser.add_argument("--endpoint-requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--endpoint-concurrency", type=int, default=10, help="in-flight endpoint requests")
+    parser.add_argument("--timeout", type=float, default=600, help="give up on the sweep phase after this many seconds")
+    parser.add_argument("--mongo-url", help="use this MongoDB instead of mongomock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # Must run before the app is imported: configuration is read at import time.
+    os.environ.setdefault("SESSION_SECRET", "bench-session-secret")
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "bench-client")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench-secret")
+    os.environ.setdefault("GOOGLE_API_KEY", "bench-key")
+    os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["EMBEDDED_SWEEPER"] = "false"
+    os.environ["SWEEP_MAX_CONCURRENT_USERS"] = str(args.concurrent_users)
+    os.environ.setdefault("SWEEP_INTERVAL_SECONDS", "1")
+    os.environ.setdefault("SWEEP_MAX_BACKOFF_SECONDS", "10")
+    os.environ.setdefault("SYNC_MAX_PAGES_PER_VIDEO", str(10 ** 6))
+    os.environ.setdefault("REPLY_POLL_SECONDS", "0.2")
+    os.environ.setdefault("REPLY_RETRY_BASE_SECONDS", "1")
+    # Jobs whose batched generation failed go to the workers after this long.
+    os.environ.setdefault("REPLY_HOLD_SECONDS", "2")
+    os.environ.setdefault("REPLY_QUOTA_RETRY_SECONDS", "1")
+    os.environ.setdefault("QUOTA_BACKOFF_SECONDS", "1")
+    os.environ.setdefault("QUOTA_MAX_BACKOFF_SECONDS", "10")
+    # Measure the app, not the quota limiter; injected 403s still exercise its backoff.
+    os.environ.setdefault("YOUTUBE_PROJECT_DAILY_QUOTA", str(10 ** 12))
+    os.environ.setdefault("YOUTUBE_USER_DAILY_QUOTA", str(10 ** 12))
+    os.environ.setdefault("WEBSUB_CALLBACK_URL", "")
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def session_cookie(user_id, secret):
+    # Same encoding as starlette's SessionMiddleware.
+    from itsdangerous import TimestampSigner
+    data = base64.b64encode(json.dumps({"user_id": user_id}).encode("utf-8"))
+    return TimestampSigner(secret).sign(data).decode("utf-8")
+
+
+async def seed_users(db, fakes, channels):
+    await db.users.insert_many([
+        {"email": f"bench{index}@example.com", "name": f"Bench {index}",
+         "google_credentials": fakes.bench_credentials(index)}
+        for index in range(channels)
+    ])
+    return [str(user["_id"]) for user in await db.users.find({}, {"_id": 1}).sort("email", 1).to_list(length=None)]
+
+
+async def run_sweep(main, db, youtube, expected, timeout):
+    await main.ensure_indexes()
+    started = time.perf_counter()
+    main.reply_workers.start()
+    sweep_task = asyncio.create_task(main.auto_reply_task())
+    progress = {}
+    try:
+        while time.perf_counter() - started < timeout:
+            await asyncio.sleep(0.5)
+            stored = await db.comments.count_documents({})
+            pending = await db.comments.count_documents({"status": "pending"})
+            waiting = await db.reply_jobs.count_documents({"status": {"$in": ["queued", "leased"]}})
+            progress = {"stored": stored, "pending": pending, "jobs_waiting": waiting}
+            if stored >= expected and pending == 0 and waiting == 0:
+                break
+        else:
+            progress["timed_out"] = True
+    finally:
+        elapsed = time.perf_counter() - started
+        sweep_task.cancel()
+        await asyncio.gather(sweep_task, return_exceptions=True)
+        await main.sweep_scheduler.shutdown()
+        await main.reply_workers.shutdown()
+    progress["elapsed"] = elapsed
+    progress["replied"] = await db.comments.count_documents({"status": "replied"})
+    progress["failed"] = await db.comments.count_documents({"status": "failed"})
+    progress["skipped"] = await db.comments.count_documents({"status": "skipped"})
+    # API calls, each batched sub-request counted; HTTP requests count a batch once.
+    progress["youtube_calls"] = sum(youtube.calls.values()) - youtube.calls["batch.POST"]
+    progress["youtube_http_requests"] = progress["youtube_calls"] - youtube.batched_calls + youtube.calls["batch.POST"]
+    progress["youtube_calls_by_method"] = dict(youtube.calls)
+    return progress
+
+
+async def run_endpoints(main, youtube, user_ids, requests_per_endpoint, concurrency, rng):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    cookies = {user_id: session_cookie(user_id, main.SESSION_SECRET) for user_id in user_ids}
+    slots = asyncio.Semaphore(concurrency)
+    results = {}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def call(template):
+            index = rng.randrange(len(user_ids))
+            user_id = user_ids[index]
+            videos = [youtube.video_id(index, rng.randrange(youtube.videos_per_channel)) for _ in range(5)]
+            path = template.format(video_id=videos[0], video_ids=",".join(videos))
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(path, cookies={"session": cookies[user_id]})
+                results[template]["latencies"].append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    results[template]["errors"] += 1
+
+        for template in ENDPOINTS:
+            results[template] = {"latencies": [], "errors": 0}
+            await asyncio.gather(*(call(template) for _ in range(requests_per_endpoint)))
+
+    return {
+        template: {
+            "requests": len(result["latencies"]),
+            "errors": result["errors"],
+            "p50_ms": round(statistics.median(result["latencies"]) * 1000, 2) if result["latencies"] else 0.0,
+            "p95_ms": round(percentile(result["latencies"], 0.95) * 1000, 2),
+        }
+        for template, result in results.items()
+    }
+
+
+async def bench(args):
+    configure_environment(args)
+    import fakes
+
+    database = fakes.memory_database(args.mongo_url)
+    sys.modules["database"] = database
+    if args.mongo_url:
+        await database.client.drop_database(database.db.name)
+
+    youtube = fakes.FakeYouTube(args.channels, args.videos, args.comments, latency=args.youtube_latency,
+                                quota_error_rate=args.quota_error_rate,
+                                quota_error_reason=args.quota_error_reason, seed=args.seed)
+    gemini = fakes.FakeGemini(args.gemini_latency, args.gemini_per_comment_latency, args.gemini_failure_rate, seed=args.seed)
+
+    import httpx
+    import youtube_client
+    youtube_client.build_async_http = lambda: httpx.AsyncClient(transport=fakes.FakeYouTubeTransport(youtube))
+    youtube_client.build_http = lambda: fakes.FakeYouTubeHttp(youtube)
+    import ai_replies
+    ai_replies.model_factory = gemini
+    import main
+    main.reply_workers.workers = args.reply_workers
+
+    user_ids = await seed_users(database.db, fakes, args.channels)
+    expected = youtube.total_comments()
+    sweep = await run_sweep(main, database.db, youtube, expected, args.timeout)
+    endpoints = await run_endpoints(main, youtube, user_ids, args.endpoint_requests, args.endpoint_concurrency,
+                                    random.Random(args.seed))
+
+    stored = max(sweep["stored"], 1)
+    return {
+        "scale": {"channels": args.channels, "videos": args.videos, "comments_per_video": args.comments,
+                  "comments": expected},
+        "sweep": {
+            "seconds": round(sweep["elapsed"], 2),
+            "timed_out": sweep.get("timed_out", False),
+            "comments_stored": sweep["stored"],
+            "comments_replied": sweep["replied"],
+            "comments_failed": sweep["failed"],
+            "comments_skipped": sweep["skipped"],
+            "comments_per_second": round((sweep["replied"] + sweep["skipped"]) / sweep["elapsed"], 1),
+            "youtube_calls": sweep["youtube_calls"],
+            "youtube_calls_per_comment": round(sweep["youtube_calls"] / stored, 3),
+            "youtube_http_requests": sweep["youtube_http_requests"],
+            "youtube_calls_by_method": sweep["youtube_calls_by_method"],
+            "youtube_quota_errors": youtube.quota_errors,
+            "gemini_calls": dict(gemini.calls),
+            "gemini_calls_per_comment": round(sum(gemini.calls.values()) / stored, 3),
+        },
+        "endpoints": endpoints,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_report(report):
+    scale, sweep = report["scale"], report["sweep"]
+    print(f"world: {scale['channels']} channels x {scale['videos']} videos x {scale['comments_per_video']} comments"
+          f" = {scale['comments']} comments")
+    print(f"sweep: {sweep['seconds']}s{' (TIMED OUT)' if sweep['timed_out'] else ''}  "
+          f"stored={sweep['comments_stored']} replied={sweep['comments_replied']} failed={sweep['comments_failed']} "
+          f"skipped={sweep['comments_skipped']}")
+    print(f"       {sweep['comments_per_second']} comments/s  "
+          f"{sweep['youtube_calls_per_comment']} YouTube calls/comment ({sweep['youtube_calls']} calls in "
+          f"{sweep['youtube_http_requests']} HTTP requests, "
+          f"{sweep['youtube_quota_errors']} quota errors)  "
+          f"{sweep['gemini_calls_per_comment']} Gemini calls/comment")
+    for method, calls in sorted(sweep["youtube_calls_by_method"].items()):
+        print(f"       {method:<24} {calls}")
+    print("endpoints:")
+    for template, result in report["endpoints"].items():
+        print(f"  {template:<40} p50={result['p50_ms']:8.2f}ms  p95={result['p95_ms']:8.2f}ms  "
+              f"errors={result['errors']}/{result['requests']}")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
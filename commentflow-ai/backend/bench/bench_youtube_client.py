@@ -0,0 +1,93 @@
+"""Micro-benchmark: per-call build() versus the cached YouTube client factory.
+
+Runs offline against an in-memory transport, so the numbers isolate client-side
+overhead (discovery parsing, transport and credential setup) from network time.
+
+    python bench/bench_youtube_client.py --requests 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the quota limiter out of the measurement.
+os.environ.setdefault("YOUTUBE_PROJECT_DAILY_QUOTA", str(10 ** 9))
+os.environ.setdefault("YOUTUBE_USER_DAILY_QUOTA", str(10 ** 9))
+# Both sides of the comparison use httplib2 transports.
+os.environ.setdefault("YOUTUBE_HTTP_TRANSPORT", "httplib2")
+# The Mongo client connects lazily; this benchmark never refreshes a token.
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost")
+
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMock
+
+import youtube_client
+
+RESPONSE_BODY = b'{"items": [{"id": "UC_bench"}]}'
+
+
+class MemoryHttp(HttpMock):
+    def __init__(self, *args, **kwargs):
+        super().__init__(headers={"status": "200"})
+        self.data = RESPONSE_BODY
+
+    def close(self):
+        pass
+
+
+def bench_creds_json():
+    return {
+        "token": "bench-token",
+        "refresh_token": "bench-refresh",
+        "client_id": "bench-client",
+        "client_secret": "bench-secret",
+        "expiry": "2099-01-01T00:00:00Z",
+    }
+
+
+def time_build_per_call(count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        credentials = Credentials.from_authorized_user_info(info=bench_creds_json())
+        youtube = build("youtube", "v3", http=AuthorizedHttp(credentials, http=MemoryHttp()), static_discovery=True)
+        youtube.channels().list(part="id", mine=True).execute()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def time_cached_factory(count):
+    youtube_client.build_http = MemoryHttp
+    factory = youtube_client.YouTubeClientFactory()
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        client = factory.get("bench-user", bench_creds_json())
+        await client.execute(client.service.channels().list(part="id", mine=True))
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    print(f"{label:<24} mean={statistics.mean(latencies) * 1000:8.2f}ms  "
+          f"p50={statistics.median(latencies) * 1000:8.2f}ms  p95={p95 * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    report("build() per call", time_build_per_call(args.requests))
+    report("cached client factory", asyncio.run(time_cached_factory(args.requests)))
+
+
+if __name__ == "__main__":
+    main()
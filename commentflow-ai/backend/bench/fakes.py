@@ -0,0 +1,345 @@
+"""In-process fakes of YouTube, Gemini and MongoDB for benchmarks and load tests.
+
+FakeYouTube answers YouTube Data API v3 requests from a generated world of channels,
+uploads and comment threads. It is plugged in at the HTTP transport
+(`youtube_client.build_async_http`, or `build_http` for the httplib2 transport), so
+request building and signing, the quota limiter and response parsing all run as in
+production. Each channel belongs to the user whose access token is `bench-token-<n>`.
+"""
+import email
+import json
+import random
+import re
+import threading
+import time
+import types
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import asyncio
+
+import httplib2
+import httpx
+
+BASE_TIME = datetime(2026, 1, 1)
+
+COMMENT_TEXTS = [
+    "Great video, thanks for sharing!",
+    "Can you make a follow-up on this topic?",
+    "I didn't understand the part at {minute}:00, could you explain?",
+    "This helped me a lot with my project.",
+    "Audio is a bit low in this one.",
+    "Chala bagundi! Next video eppudu?",
+    "Which camera do you use?",
+    "First time here, subscribed.",
+    "First!",
+    "Free giveaway on my channel, message me on telegram www.example.xyz",
+    "नमस्ते 🔥 great explanation, thank you!",
+    "చాలా బాగుంది 👏 next part eppudu?",
+]
+
+
+def bench_token(index):
+    return f"bench-token-{index}"
+
+
+def bench_credentials(index, client_id="bench-client"):
+    # Far-future expiry, so google-auth never tries to refresh the token.
+    return {
+        "token": bench_token(index),
+        "refresh_token": f"bench-refresh-{index}",
+        "client_id": client_id,
+        "client_secret": "bench-secret",
+        "expiry": "2099-01-01T00:00:00Z",
+    }
+
+
+def _iso(moment):
+    return moment.isoformat() + "Z"
+
+
+def _error(status, reason, message):
+    return status, {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+
+class FakeYouTube:
+    def __init__(self, channels, videos_per_channel, comments_per_video, latency=0.0,
+                 quota_error_rate=0.0, quota_error_reason="rateLimitExceeded", seed=0):
+        # `latency` is the mean seconds per call (uniform 0.5x-1.5x). `quota_error_rate`
+        # is the share of calls answered with a 403 carrying `quota_error_reason`.
+        self.channels = channels
+        self.videos_per_channel = videos_per_channel
+        self.comments_per_video = comments_per_video
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.quota_error_reason = quota_error_reason
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.quota_errors = 0
+        self.batched_calls = 0
+        self.replies = {}
+        self._lock = threading.Lock()
+
+    # --- Generated world ---
+
+    def channel_id(self, channel):
+        return f"UCbench{channel:06d}"
+
+    def video_id(self, channel, video):
+        return f"c{channel}v{video}"
+
+    def video_published_at(self, video):
+        return BASE_TIME + timedelta(hours=video)
+
+    def parse_video_id(self, video_id):
+        match = re.fullmatch(r"c(\d+)v(\d+)", video_id or "")
+        if not match:
+            return None
+        channel, video = int(match.group(1)), int(match.group(2))
+        if channel >= self.channels or video >= self.videos_per_channel:
+            return None
+        return channel, video
+
+    def total_comments(self):
+        return self.channels * self.videos_per_channel * self.comments_per_video
+
+    def _channel_item(self, channel):
+        channel_id = self.channel_id(channel)
+        return {
+            "kind": "youtube#channel",
+            "id": channel_id,
+            "snippet": {"title": f"Bench channel {channel}", "thumbnails": {"default": {"url": "https://example.com/a.png"}}},
+            "contentDetails": {"relatedPlaylists": {"uploads": "UU" + channel_id[2:]}},
+        }
+
+    def _playlist_item(self, channel, video):
+        video_id = self.video_id(channel, video)
+        return {
+            "kind": "youtube#playlistItem",
+            "snippet": {"title": f"Video {video}", "publishedAt": _iso(self.video_published_at(video)),
+                        "resourceId": {"videoId": video_id}},
+            "contentDetails": {"videoId": video_id, "videoPublishedAt": _iso(self.video_published_at(video))},
+        }
+
+    def _thread_item(self, channel, video, comment):
+        video_id = self.video_id(channel, video)
+        comment_id = f"{video_id}c{comment}"
+        text = COMMENT_TEXTS[comment % len(COMMENT_TEXTS)].format(minute=comment % 10)
+        return {
+            "kind": "youtube#commentThread",
+            "id": comment_id,
+            "snippet": {
+                "videoId": video_id,
+                "totalReplyCount": 1 if comment_id in self.replies else 0,
+                "topLevelComment": {
+                    "id": comment_id,
+                    "snippet": {
+                        "textDisplay": text,
+                        "textOriginal": text,
+                        "authorDisplayName": f"viewer{comment}",
+                        "authorChannelId": {"value": f"UCviewer{comment}"},
+                        "publishedAt": _iso(self.video_published_at(video) + timedelta(minutes=comment)),
+                        "likeCount": comment % 7,
+                    },
+                },
+            },
+        }
+
+    # --- API ---
+
+    def _page(self, total, params, limit, make_item):
+        # Page tokens are plain offsets; items are generated on demand, newest first.
+        start = int(params.get("pageToken") or 0)
+        size = min(int(params.get("maxResults") or 5), limit)
+        end = min(start + size, total)
+        response = {"items": [make_item(total - 1 - index) for index in range(start, end)],
+                    "pageInfo": {"totalResults": total, "resultsPerPage": size}}
+        if end < total:
+            response["nextPageToken"] = str(end)
+        return response
+
+    def handle(self, channel, method, resource, params, body):
+        if resource == "channels" and method == "GET":
+            return 200, {"items": [self._channel_item(channel)]}
+        if resource == "playlistItems" and method == "GET":
+            if params.get("playlistId") != "UU" + self.channel_id(channel)[2:]:
+                return _error(404, "playlistNotFound", "Playlist not found")
+            return 200, self._page(self.videos_per_channel, params, 50,
+                                   lambda video: self._playlist_item(channel, video))
+        if resource == "commentThreads" and method == "GET":
+            parsed = self.parse_video_id(params.get("videoId"))
+            if parsed is None:
+                return _error(404, "videoNotFound", "Video not found")
+            return 200, self._page(self.comments_per_video, params, 100,
+                                   lambda comment: self._thread_item(parsed[0], parsed[1], comment))
+        if resource == "comments" and method == "POST":
+            snippet = json.loads(body)["snippet"]
+            with self._lock:
+                self.replies[snippet["parentId"]] = snippet["textOriginal"]
+            return 200, {"id": snippet["parentId"] + ".r", "snippet": snippet}
+        if resource == "comments" and method == "GET":
+            reply = self.replies.get(params.get("parentId"))
+            items = [] if reply is None else [{"id": params["parentId"] + ".r", "snippet": {
+                "textOriginal": reply, "authorChannelId": {"value": self.channel_id(channel)}}}]
+            return 200, {"items": items}
+        if resource == "comments" and method == "DELETE":
+            return 204, None
+        if resource == "videos" and method == "GET":
+            items = []
+            for video_id in (params.get("id") or "").split(","):
+                parsed = self.parse_video_id(video_id)
+                if parsed is not None:
+                    items.append({"id": video_id, "snippet": {"title": f"Video {parsed[1]}"},
+                                  "statistics": {"viewCount": str(1000 + parsed[1]), "likeCount": "10",
+                                                 "commentCount": str(self.comments_per_video)}})
+            return 200, {"items": items}
+        return _error(404, "notFound", f"{method} {resource} is not faked")
+
+    def delay(self):
+        with self._lock:
+            return self.latency * self.random.uniform(0.5, 1.5)
+
+    def request(self, token, method, uri, body):
+        parts = urlsplit(uri)
+        resource = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        with self._lock:
+            self.calls[f"{resource}.{method}"] += 1
+            fail = self.quota_error_rate and self.random.random() < self.quota_error_rate
+        match = re.fullmatch(r"bench-token-(\d+)", token or "")
+        if not match or int(match.group(1)) >= self.channels:
+            return _error(401, "authError", "Invalid credentials")
+        if fail:
+            with self._lock:
+                self.quota_errors += 1
+            return _error(403, self.quota_error_reason, "The request cannot be completed because of quota.")
+        return self.handle(int(match.group(1)), method, resource, params, body)
+
+
+def _bearer_token(authorization):
+    return authorization[len("Bearer "):] if authorization and authorization.startswith("Bearer ") else None
+
+
+def _http_part(status, payload):
+    # Raw UTF-8, like the real API: non-ASCII text must survive the batch parser.
+    body = "" if payload is None else json.dumps(payload, ensure_ascii=False)
+    return f"HTTP/1.1 {status} X\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{body}"
+
+
+class FakeYouTubeTransport(httpx.AsyncBaseTransport):
+    # httpx transport for `youtube_client.build_async_http`; latency is awaited. A
+    # multipart batch call is answered part by part, with one call's latency.
+    def __init__(self, youtube):
+        self.youtube = youtube
+
+    async def handle_async_request(self, request):
+        body = (await request.aread()).decode("utf-8") or None
+        delay = self.youtube.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        token = _bearer_token(request.headers.get("authorization"))
+        if request.url.path == "/batch":
+            with self.youtube._lock:
+                self.youtube.calls["batch.POST"] += 1
+                self.youtube.batched_calls += body.count("Content-ID:")
+            return self._batch(token, request.headers["content-type"], body)
+        status, payload = self.youtube.request(token, request.method, str(request.url), body)
+        return httpx.Response(status, json=payload) if payload is not None else httpx.Response(status)
+
+    def _batch(self, token, content_type, body):
+        message = email.message_from_string(f"Content-Type: {content_type}\r\n\r\n{body}")
+        boundary = "batch_bench"
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition("\r\n")
+            method, target, _ = request_line.split(" ", 2)
+            head, _, sub_body = rest.partition("\r\n\r\n")
+            host = re.search(r"^Host: (.*)$", head, re.MULTILINE).group(1).strip()
+            status, payload = self.youtube.request(token, method, f"https://{host}{target}", sub_body or None)
+            content_id = part["Content-ID"].strip("<>")
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>"
+                         f"\r\n\r\n{_http_part(status, payload)}\r\n")
+        return httpx.Response(200, headers={"content-type": f"multipart/mixed; boundary={boundary}"},
+                              content=("".join(parts) + f"--{boundary}--\r\n").encode("utf-8"))
+
+
+class FakeYouTubeHttp:
+    # Stands in for httplib2.Http under google_auth_httplib2.AuthorizedHttp.
+    def __init__(self, youtube):
+        self.youtube = youtube
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        delay = self.youtube.delay()
+        if delay:
+            # Runs on a threadpool thread, like a real blocking httplib2 call.
+            time.sleep(delay)
+        status, payload = self.youtube.request(_bearer_token(headers.get("authorization")), method, uri, body)
+        content = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        return httplib2.Response({"status": str(status), "content-type": "application/json; charset=UTF-8"}), content
+
+    def close(self):
+        pass
+
+
+class FakeGemini:
+    # Model factory for `ai_replies.model_factory`. Answers batch prompts with one reply
+    # per comment and single prompts with one reply, after `latency` seconds plus
+    # `per_comment_latency` for every comment in the prompt.
+    def __init__(self, latency=0.0, per_comment_latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_comment_latency = per_comment_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model_name, system_instruction=None):
+        return FakeGeminiModel(self, model_name)
+
+
+class FakeGeminiModel:
+    BATCH_PAYLOAD = re.compile(r'Comments \(JSON array of objects with "id" and "text"\):\s*(\[.*?\])\n', re.DOTALL)
+
+    def __init__(self, gemini, model_name):
+        self.gemini = gemini
+        self.model_name = model_name
+
+    def generate_content(self, prompt, **kwargs):
+        gemini = self.gemini
+        match = self.BATCH_PAYLOAD.search(prompt)
+        comments = json.loads(match.group(1)) if match else None
+        with gemini._lock:
+            gemini.calls["batch" if comments is not None else "single"] += 1
+            fail = gemini.failure_rate and gemini.random.random() < gemini.failure_rate
+            if fail:
+                gemini.failures += 1
+        time.sleep(gemini.latency + gemini.per_comment_latency * (len(comments) if comments else 1))
+        if fail:
+            raise RuntimeError("503 The model is overloaded. Please try again later.")
+        if comments is None:
+            return types.SimpleNamespace(text="Thanks for watching!")
+        replies = [{"id": comment["id"], "reply": f"Thanks for the comment! ({len(comment['text'])})"} for comment in comments]
+        return types.SimpleNamespace(text=json.dumps(replies))
+
+
+def memory_database(mongo_url=None, database_name="commentflow_bench"):
+    # Returns a module to install as `database` before importing the app: mongomock
+    # (in memory) by default, or a real MongoDB for runs too large for memory.
+    if mongo_url:
+        import motor.motor_asyncio
+
+        import metrics
+        client = motor.motor_asyncio.AsyncIOMotorClient(mongo_url, event_listeners=[metrics.MongoCommandListener()])
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("The in-memory database needs mongomock-motor (pip install mongomock-motor), or pass --mongo-url")
+        client = AsyncMongoMockClient()
+    module = types.ModuleType("database")
+    module.client = client
+    module.db = client.get_database(database_name)
+    return module
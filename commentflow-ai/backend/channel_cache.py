@@ -0,0 +1,47 @@
+import os
+from datetime import datetime, timedelta
+
+from database import db
+
+# Channel metadata (ID, title, avatar, uploads playlist) cached on the user document.
+#
+# It almost never changes, so it is filled at OAuth callback time and refreshed by the
+# sweeper once it goes stale; request handlers read it from the user document they
+# already load and only fall back to `channels().list` on a miss.
+
+CHANNEL_CACHE_TTL_SECONDS = float(os.getenv("CHANNEL_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+
+def channel_from_item(item):
+    snippet = item.get("snippet", {})
+    return {
+        "id": item["id"],
+        "title": snippet.get("title"),
+        "avatar": snippet.get("thumbnails", {}).get("default", {}).get("url"),
+        "uploads_playlist_id": item.get("contentDetails", {}).get("relatedPlaylists", {}).get("uploads"),
+        "fetched_at": datetime.utcnow(),
+    }
+
+
+def cached_channel(user):
+    channel = user.get("youtube_channel")
+    if not channel or not channel.get("fetched_at"):
+        return None
+    if datetime.utcnow() - channel["fetched_at"] > timedelta(seconds=CHANNEL_CACHE_TTL_SECONDS):
+        return None
+    return channel
+
+
+async def fetch_channel(user, client, limiter=None):
+    channel_request = client.service.channels().list(part="contentDetails,snippet", mine=True)
+    channel_response = await client.execute(channel_request, limiter)
+    if not channel_response.get("items"):
+        return None
+    channel = channel_from_item(channel_response["items"][0])
+    await db.users.update_one({"_id": user["_id"]}, {"$set": {"youtube_channel": channel}})
+    user["youtube_channel"] = channel
+    return channel
+
+
+async def get_channel(user, client, limiter=None):
+    return cached_channel(user) or await fetch_channel(user, client, limiter)
@@ -0,0 +1,113 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+from database import db
+
+# Comment listing served from db.comments, which the sweeper keeps in sync.
+#
+# Pages are ordered newest first and paginated by keyset on (published_at, _id): the
+# cursor is the sort key of the last comment returned, so every page is an index
+# range scan however deep the client scrolls, and comments inserted meanwhile do not
+# shift later pages. Only the fields the dashboard shows are read.
+
+COMMENTS_PAGE_DEFAULT_LIMIT = int(os.getenv("COMMENTS_PAGE_DEFAULT_LIMIT", "50"))
+COMMENTS_PAGE_MAX_LIMIT = int(os.getenv("COMMENTS_PAGE_MAX_LIMIT", "200"))
+
+SORT = [("published_at", -1), ("_id", -1)]
+
+PROJECTION = {
+    "video_id": 1,
+    "video_title": 1,
+    "author_name": 1,
+    "author_avatar": 1,
+    "text": 1,
+    "published_at": 1,
+    "like_count": 1,
+    "status": 1,
+    "ai_reply": 1,
+    "skip_reason": 1,
+    "replied_at": 1,
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(comment):
+    key = {"p": comment["published_at"].isoformat(), "id": comment["_id"]}
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(key["p"]), str(key["id"])
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def build_query(user_id, channel_id, video_id=None, statuses=None, author=None, cursor=None):
+    query = {"user_id": user_id, "channel_id": channel_id}
+    if video_id:
+        query["video_id"] = video_id
+    if statuses:
+        query["status"] = statuses[0] if len(statuses) == 1 else {"$in": list(statuses)}
+    if author:
+        query["author_name"] = author
+    if cursor:
+        published_at, comment_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"published_at": {"$lt": published_at}},
+            {"published_at": published_at, "_id": {"$lt": comment_id}},
+        ]
+    return query
+
+
+def to_api(comment):
+    return {
+        "id": comment["_id"],
+        "videoId": comment.get("video_id"),
+        "videoTitle": comment.get("video_title"),
+        "authorName": comment.get("author_name"),
+        "authorAvatar": comment.get("author_avatar"),
+        "text": comment.get("text"),
+        "publishedAt": comment.get("published_at"),
+        "likeCount": comment.get("like_count", 0),
+        "status": comment.get("status"),
+        "aiReply": comment.get("ai_reply"),
+        "skipReason": comment.get("skip_reason"),
+        "repliedAt": comment.get("replied_at"),
+    }
+
+
+async def list_comments(user_id, channel_id, video_id=None, statuses=None, author=None, cursor=None,
+                        limit=COMMENTS_PAGE_DEFAULT_LIMIT):
+    limit = max(1, min(limit, COMMENTS_PAGE_MAX_LIMIT))
+    query = build_query(user_id, channel_id, video_id, statuses, author, cursor)
+    # One extra document tells whether there is a next page without a count query.
+    comments = await db.comments.find(query, PROJECTION).sort(SORT).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(comments[limit - 1]) if len(comments) > limit else None
+    return {"items": [to_api(comment) for comment in comments[:limit]], "nextCursor": next_cursor}
+
+
+async def ensure_indexes():
+    # Equality filters first, then the sort key, so each filter combination is a
+    # bounded range scan.
+    await db.comments.create_index(
+        [("user_id", 1), ("channel_id", 1), ("published_at", -1), ("_id", -1)], name="user_channel_feed_idx"
+    )
+    await db.comments.create_index(
+        [("user_id", 1), ("channel_id", 1), ("video_id", 1), ("published_at", -1), ("_id", -1)],
+        name="user_channel_video_feed_idx",
+    )
+    await db.comments.create_index(
+        [("user_id", 1), ("channel_id", 1), ("status", 1), ("published_at", -1), ("_id", -1)],
+        name="user_channel_status_feed_idx",
+    )
+    await db.comments.create_index(
+        [("user_id", 1), ("channel_id", 1), ("author_name", 1), ("published_at", -1), ("_id", -1)],
+        name="user_channel_author_feed_idx",
+    )
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import google.auth.transport.requests
+from bson import ObjectId
+from fastapi.concurrency import run_in_threadpool
+from google.oauth2.credentials import Credentials
+
+from database import db
+from log import get_logger
+
+# Live Google credentials, one Credentials object per user.
+#
+# Every request and sweep for a user shares the same object, so an access token is
+# refreshed once instead of once per newly built client. Concurrent refreshes for a
+# user collapse into one, and a token expiring within CREDENTIAL_REFRESH_MARGIN_SECONDS
+# is renewed in the background before any request has to wait for it. Refreshed
+# tokens are written back to db.users, guarded on the refresh token so a reconnect in
+# the meantime is never overwritten; before refreshing, a process first adopts a
+# fresh token another process (API or sweeper) already stored.
+
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "1000"))
+CREDENTIAL_REFRESH_MARGIN_SECONDS = float(os.getenv("CREDENTIAL_REFRESH_MARGIN_SECONDS", "600"))
+
+log = get_logger("credentials")
+
+
+def _fingerprint(creds_json):
+    # A reconnect stores a new refresh token; the cached credentials must not outlive it.
+    return (creds_json.get("client_id"), creds_json.get("refresh_token"))
+
+
+def _expiry(creds_json):
+    # Same format Credentials.to_json() writes: naive UTC, ISO 8601 with a "Z".
+    expiry = creds_json.get("expiry")
+    if not expiry:
+        return None
+    try:
+        return datetime.strptime(expiry.rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
+
+
+class CredentialManager:
+    def __init__(self, max_entries=CREDENTIAL_CACHE_SIZE, margin=CREDENTIAL_REFRESH_MARGIN_SECONDS):
+        self.max_entries = max_entries
+        self.margin = timedelta(seconds=margin)
+        self._entries = OrderedDict()
+        self._locks = {}
+        self._background = set()
+
+    def get(self, user_id, creds_json):
+        # `creds_json` is the user's stored google_credentials.
+        fingerprint = _fingerprint(creds_json)
+        entry = self._entries.get(user_id)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            entry = {"credentials": Credentials.from_authorized_user_info(info=creds_json), "fingerprint": fingerprint}
+            self._entries[user_id] = entry
+            while len(self._entries) > self.max_entries:
+                evicted_user_id, _ = self._entries.popitem(last=False)
+                self._drop_lock(evicted_user_id)
+        else:
+            self._adopt(entry["credentials"], creds_json)
+        self._entries.move_to_end(user_id)
+        return entry["credentials"]
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+        self._drop_lock(user_id)
+
+    def _drop_lock(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    def _lock(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _adopt(credentials, creds_json):
+        # Takes over a stored access token that outlives ours, e.g. written back by another process.
+        expiry = _expiry(creds_json)
+        token = creds_json.get("token")
+        if token and token != credentials.token and expiry and (credentials.expiry is None or expiry > credentials.expiry):
+            credentials.token = token
+            credentials.expiry = expiry
+
+    def expires_soon(self, credentials):
+        return credentials.expiry is not None and credentials.expiry - datetime.utcnow() < self.margin
+
+    async def ensure_fresh(self, user_id, credentials):
+        # Blocks only when the token is no longer usable; a token about to expire is
+        # renewed in the background.
+        if not credentials.valid:
+            await self.refresh(user_id, credentials)
+        elif self.expires_soon(credentials) and not self._lock(user_id).locked():
+            task = asyncio.create_task(self._refresh_in_background(user_id, credentials))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _refresh_in_background(self, user_id, credentials):
+        try:
+            await self.refresh(user_id, credentials)
+        except Exception as e:
+            # The next request refreshes in the foreground and reports the error.
+            log.warning("credentials.background_refresh_failed", user_id=user_id, error=str(e))
+
+    async def refresh(self, user_id, credentials, stale_token=None):
+        # `stale_token` is the token a caller saw rejected; callers that queued behind
+        # another refresh of the same token return without refreshing again.
+        stale_token = credentials.token if stale_token is None else stale_token
+        async with self._lock(user_id):
+            if credentials.token != stale_token and credentials.valid:
+                return
+            doc = await db.users.find_one({"_id": ObjectId(user_id)}, {"google_credentials": 1})
+            stored = (doc or {}).get("google_credentials") or {}
+            if stored.get("refresh_token") == credentials.refresh_token:
+                self._adopt(credentials, stored)
+                if credentials.token != stale_token and credentials.valid and not self.expires_soon(credentials):
+                    return
+
+            refresh_token = credentials.refresh_token
+            await run_in_threadpool(credentials.refresh, google.auth.transport.requests.Request())
+            log.info("credentials.refreshed", user_id=user_id, expiry=str(credentials.expiry))
+            entry = self._entries.get(user_id)
+            if entry is not None and entry["credentials"] is credentials:
+                entry["fingerprint"] = (credentials.client_id, credentials.refresh_token)
+            await self._write_back(user_id, credentials, refresh_token)
+
+    async def _write_back(self, user_id, credentials, refresh_token):
+        # One guarded update: skipped if the user reconnected (new refresh token) meanwhile.
+        info = json.loads(credentials.to_json())
+        fields = {f"google_credentials.{key}": info[key] for key in ("token", "expiry", "refresh_token") if key in info}
+        try:
+            result = await db.users.update_one(
+                {"_id": ObjectId(user_id), "google_credentials.refresh_token": refresh_token}, {"$set": fields}
+            )
+        except Exception as e:
+            log.warning("credentials.write_back_failed", user_id=user_id, error=str(e))
+            return
+        if not result.matched_count:
+            log.info("credentials.write_back_skipped", user_id=user_id)
+
+
+credential_manager = CredentialManager()
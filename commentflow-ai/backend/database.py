@@ -2,6 +2,8 @@ import os
 import motor.motor_asyncio
 from dotenv import load_dotenv
 
+import metrics
+
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
@@ -9,7 +11,8 @@ MONGODB_URL = os.getenv("MONGODB_URL")
 if not MONGODB_URL:
     raise Exception("MONGODB_URL environment variable not set")
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+# Command latencies are reported to /metrics.
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL, event_listeners=[metrics.MongoCommandListener()])
 db = client.get_database("Youtubereview") # You can change this to your desired db name
 
 # You can add helper functions here to interact with your collections, e.g.:
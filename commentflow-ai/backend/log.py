@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# Structured, leveled, rate-limited logging.
+#
+#     log = get_logger("sweep")
+#     log.info("sweep.summary", user_id=user_id, pages=3, inserted=120)
+#
+# Each record is an event name plus key/value fields, written as one JSON object per
+# line (LOG_FORMAT=json) or as "event key=value ..." text. Fields are only formatted
+# when the level is enabled. Debug and info records of each event may be emitted at
+# most LOG_RATE_PER_MINUTE times a minute per user (the user_id field), and the number
+# of dropped records is reported on the next one that gets through; warnings and
+# errors are never dropped.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_RATE_PER_MINUTE = float(os.getenv("LOG_RATE_PER_MINUTE", "120"))
+
+_ROOT = "commentflow"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_minute=LOG_RATE_PER_MINUTE, max_keys=10000):
+        super().__init__()
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def filter(self, record):
+        if self.capacity <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg, getattr(record, "fields", {}).get("user_id"))
+        now = time.monotonic()
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            self._prune(now)
+        tokens, updated, suppressed = self._buckets.get(key, (self.capacity, now, 0))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, suppressed + 1)
+            return False
+        self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.fields = {**getattr(record, "fields", {}), "suppressed": suppressed}
+        return True
+
+    def _prune(self, now):
+        # Buckets that have refilled completely and dropped nothing are the same as new ones.
+        full_after = self.capacity / self.rate
+        for key, (tokens, updated, suppressed) in list(self._buckets.items()):
+            if not suppressed and now - updated >= full_after:
+                del self._buckets[key]
+
+
+def _record_fields(record):
+    fields = {
+        "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+        "level": record.levelname.lower(),
+        "logger": record.name[len(_ROOT) + 1:] or record.name,
+        "event": record.getMessage(),
+        **getattr(record, "fields", {}),
+    }
+    if record.exc_info:
+        fields["exc"] = logging.Formatter().formatException(record.exc_info)
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(_record_fields(record), default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = _record_fields(record)
+        head = f"{fields.pop('ts')} {fields.pop('level').upper():<7} {fields.pop('logger')} {fields.pop('event')}"
+        exc = fields.pop("exc", None)
+        line = " ".join([head] + [f"{key}={value}" for key, value in fields.items()])
+        return f"{line}\n{exc}" if exc else line
+
+
+def _configure():
+    root = logging.getLogger(_ROOT)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    handler.addFilter(RateLimitFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+class StructuredLogger:
+    def __init__(self, name):
+        _configure()
+        self._logger = logging.getLogger(f"{_ROOT}.{name}")
+
+    def _log(self, level, event, fields, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name):
+    return StructuredLogger(name)
@@ -1,29 +1,52 @@
-print("Running latest version of main.py")
-from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, BackgroundTasks
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, Query, status, BackgroundTasks
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel, EmailStr, Field
 from typing import Literal, Optional
 from enum import Enum
-from datetime import datetime, timedelta
+from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from database import db
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import json
 from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
 import google.auth.transport.requests
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from fastapi.concurrency import run_in_threadpool
 import asyncio
+import time
+from collections import Counter
+from scheduler import SweepScheduler
+from sweeper_shard import SweeperMembership
+import sync_state
+from pipeline import run_pipeline
+from youtube_client import YouTubeClient, close_async_http, error_reasons, is_quota_error, youtube_clients
+from credential_manager import credential_manager
+import quota
+from quota import youtube_quota
+from channel_cache import fetch_channel, get_channel
+import rollups
+import comment_pages
+import triage
+import prompt_templates
+import reply_queue
+import websub
+from log import get_logger
+import metrics
+import anyio.to_thread
+from sync_state import SCAN_INCREMENTAL, SYNC_MAX_PAGES_PER_VIDEO, parse_youtube_time
 
 # Background auto-reply task and startup event are defined later after `app` is created.
 
 
 import google.generativeai as genai
+import ai_replies
+from reply_cache import reply_cache
+from response_cache import response_cache
+from youtube_batch import YOUTUBE_BATCH_SIZE, execute_batch, video_statistics
 from google.oauth2 import id_token
 
 # Load environment variables
@@ -53,6 +76,25 @@ app.add_middleware(
 )
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
 
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Labelled by route template so /youtube/comments/{video_id} is one series.
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code,
+        )
+
 # --- Google OAuth Config ---
 SCOPES = [
     "https://www.googleapis.com/auth/youtube.force-ssl",
@@ -74,219 +116,624 @@ client_config = {
 }
 
 # --- Background Task ---
-async def auto_reply_task():
+log = get_logger("sweep")
+api_log = get_logger("api")
+# Set to false when sweepers run on their own (`python sweeper.py`).
+EMBEDDED_SWEEPER = os.getenv("EMBEDDED_SWEEPER", "true").lower() in ("1", "true", "yes")
+REPLY_QUOTA_RETRY_SECONDS = float(os.getenv("REPLY_QUOTA_RETRY_SECONDS", "300"))
+# Prometheus metrics are served on their own listener, never on the API port; unset
+# METRICS_PORT serves none from the API process.
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+
+def comment_threads_request(client, video_id, page_token=None, order="time"):
+    return client.service.commentThreads().list(
+        part="snippet,replies",
+        videoId=video_id,
+        maxResults=100,
+        order=order,
+        pageToken=page_token
+    )
+
+
+async def iter_comment_thread_pages(client, video_id, limiter=None, page_token=None, order="time", first_response=None):
+    # Follows nextPageToken until the last page, yielding (items, next_page_token).
+    # `first_response` is the first page (or the error fetching it) when it was
+    # already fetched as part of a batch.
     while True:
-        print("Running auto-reply background task...")
-        all_existing_comments = await db.comments.find().to_list(length=None)
-        print(f"DEBUG: All existing comments in DB before processing: {len(all_existing_comments)} documents. Sample: {all_existing_comments[:2]}")
-
-        users = await db.users.find().to_list(length=None)
-        if not users:
-            print("No users found to process in auto-reply task.")
-        for user in users:
-            user_id = str(user["_id"])
-            print(f"Processing user: {user['email']} (ID: {user_id})")
-            creds_json = user.get("google_credentials")
-            if not creds_json:
-                print(f"User {user['email']} has no Google credentials.")
-                continue
+        if first_response is not None:
+            comment_threads_response, first_response = first_response, None
+            if isinstance(comment_threads_response, Exception):
+                raise comment_threads_response
+        else:
+            comment_threads_response = await client.execute(
+                comment_threads_request(client, video_id, page_token, order), limiter
+            )
+        page_token = comment_threads_response.get("nextPageToken")
+        yield comment_threads_response.get("items", []), page_token
+        if not page_token:
+            return
+
+
+def classify_comment_thread(item, existing_comment_doc, video_id, video_title, channel_id):
+    # Turns a raw comment thread into the fields to upsert and decides whether it
+    # still needs an AI reply. Returns None for the creator's own comments.
+    top_level_comment = item["snippet"]["topLevelComment"]
+    comment_id = top_level_comment["id"]
+
+    comment_text = top_level_comment["snippet"]["textDisplay"]
+    author_name = top_level_comment["snippet"]["authorDisplayName"]
+    author_avatar = top_level_comment["snippet"].get("authorProfileImageUrl")
+    published_at = parse_youtube_time(top_level_comment["snippet"]["publishedAt"])
+    like_count = top_level_comment["snippet"]["likeCount"]
+
+    has_replies_from_youtube = item["snippet"]["totalReplyCount"] > 0
+    is_self_comment = top_level_comment["snippet"].get("authorChannelId", {}).get("value") == channel_id
+
+    if is_self_comment:
+        log.debug("comment.self_skipped", comment_id=comment_id, video_id=video_id)
+        return None
+
+    # Determine initial status for new comments or status to update
+    initial_status_for_new = CommentStatus.REPLIED if has_replies_from_youtube else CommentStatus.PENDING
+
+    # Prepare fields for the $set operation in upsert
+    set_fields = {
+        "video_id": video_id,
+        "video_title": video_title,
+        "author_name": author_name,
+        "author_avatar": author_avatar,
+        "text": comment_text,
+        "published_at": published_at,
+        "like_count": like_count,
+    }
+
+    # Logic for status and replied_at
+    current_db_status = existing_comment_doc["status"] if existing_comment_doc else None
+
+    # If existing, and was PENDING, but now has YouTube replies -> update to REPLIED
+    if current_db_status == CommentStatus.PENDING.value and has_replies_from_youtube:
+        set_fields["status"] = CommentStatus.REPLIED.value
+        set_fields["replied_at"] = datetime.utcnow()
+        log.debug("comment.replied_on_youtube", comment_id=comment_id)
+    elif current_db_status is None: # Newly inserted comment
+        set_fields["status"] = initial_status_for_new.value
+        if initial_status_for_new == CommentStatus.REPLIED:
+            set_fields["replied_at"] = datetime.utcnow()
+        log.debug("comment.new", comment_id=comment_id, status=set_fields["status"])
+    # Otherwise the stored status stands (e.g., already REPLIED by AI, FAILED, or still
+    # PENDING without YouTube replies) and is left out of the update, so a reply
+    # worker's concurrent PENDING -> REPLIED is never written back.
+
+    # Only new comments that are PENDING and have no replies from YouTube get an AI reply
+    needs_reply = (
+        current_db_status is None
+        and set_fields["status"] == CommentStatus.PENDING.value
+        and not has_replies_from_youtube
+    )
+    # Unchanged comments are left out of the page's bulk write entirely
+    changed = existing_comment_doc is None or any(
+        existing_comment_doc.get(key) != value for key, value in set_fields.items()
+    )
+    return {
+        "comment_id": comment_id,
+        "set_fields": set_fields,
+        "previous_status": current_db_status,
+        "needs_reply": needs_reply,
+        "changed": changed,
+    }
+
+
+async def set_comment_status(filter_query, published_at, old_status, new_status, **fields):
+    # Moves a comment from `old_status` to `new_status` and keeps the rollups in step.
+    comment_id = filter_query["_id"]
+    update_result = await db.comments.update_one(
+        {**filter_query, "status": old_status},
+        {"$set": {"status": new_status, **fields}}
+    )
+    log.debug("comment.status", comment_id=comment_id, status=new_status, modified=update_result.modified_count)
+    if update_result.modified_count:
+        await rollups.record_status_change(
+            filter_query["user_id"], filter_query["channel_id"], published_at, old_status, new_status
+        )
+    return update_result.modified_count == 1
+
+
+async def find_channel_reply(client, limiter, comment_id, channel_id):
+    # Returns the text of the channel's own reply under `comment_id`, if there is one.
+    replies_request = client.service.comments().list(part="snippet", parentId=comment_id, maxResults=100)
+    replies_response = await client.execute(replies_request, limiter)
+    for item in replies_response.get("items", []):
+        snippet = item["snippet"]
+        if snippet.get("authorChannelId", {}).get("value") == channel_id:
+            return snippet.get("textOriginal") or snippet.get("textDisplay")
+    return None
+
+
+async def deliver_reply(job):
+    # Reply queue handler: posts one AI reply and marks the comment REPLIED.
+    user_id, channel_id, comment_id = job["user_id"], job["channel_id"], job["comment_id"]
+    filter_query = {"_id": comment_id, "user_id": user_id, "channel_id": channel_id}
+    comment = await db.comments.find_one(filter_query, {"status": 1})
+    if not comment or comment["status"] != CommentStatus.PENDING.value:
+        # Replied by hand on YouTube (or deleted) since it was queued.
+        log.debug("reply.dropped", comment_id=comment_id, reason="not_pending")
+        return
+
+    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    if not user or not user.get("google_credentials"):
+        raise reply_queue.PermanentFailure("User has no Google credentials")
+    client = youtube_clients.get(user_id, user["google_credentials"])
+    limiter = sweep_scheduler.limiter_for(user_id)
+
+    try:
+        if job["attempts"] > 1:
+            # An earlier attempt may have posted the reply and died before recording it.
+            posted_reply = await find_channel_reply(client, limiter, comment_id, channel_id)
+            if posted_reply:
+                if await set_comment_status(
+                    filter_query, job["published_at"], CommentStatus.PENDING.value, CommentStatus.REPLIED.value,
+                    ai_reply=posted_reply, replied_at=datetime.utcnow()
+                ):
+                    metrics.COMMENTS.inc(event="replied")
+                return
+
+        reply_text = job.get("reply_text")
+        if not reply_text:
+            # The sweep's batched generation missed this comment; generate it on its own.
+            # The sweep already looked the comment up in the reply cache.
+            reply_template = await prompt_templates.get_template(user_id, channel_id)
+            reply_text = (await ai_replies.generate_reply(job["text"], reply_template))["reply"]
+            reply_cache.store(channel_id, job["text"], reply_text)
+
+        reply_request_body = {
+            "snippet": {
+                "parentId": comment_id,
+                "textOriginal": reply_text
+            }
+        }
+        reply_insert_request = client.service.comments().insert(part="snippet", body=reply_request_body)
+        await client.execute(reply_insert_request, limiter)
+    except Exception as e:
+        if is_quota_error(e):
+            # Running out of quota is not the comment's fault; wait for quota without using up an attempt.
+            raise reply_queue.RetryLater(str(e), getattr(e, "retry_after", REPLY_QUOTA_RETRY_SECONDS))
+        if isinstance(e, HttpError) and getattr(e.resp, "status", None) in (400, 403, 404):
+            raise reply_queue.PermanentFailure(f"Google API error: {e}")
+        raise
 
+    if await set_comment_status(
+        filter_query, job["published_at"], CommentStatus.PENDING.value, CommentStatus.REPLIED.value,
+        ai_reply=reply_text, replied_at=datetime.utcnow()
+    ):
+        metrics.COMMENTS.inc(event="replied")
+
+
+async def reply_job_dead(job, error):
+    # A dead-lettered job is what the dashboard reports as a failed reply.
+    filter_query = {"_id": job["comment_id"], "user_id": job["user_id"], "channel_id": job["channel_id"]}
+    if await set_comment_status(filter_query, job["published_at"], CommentStatus.PENDING.value, CommentStatus.FAILED.value):
+        metrics.COMMENTS.inc(event="failed")
+
+
+async def process_video_comments(client, limiter, user_id, channel_id, video_state, mode, stats=None, first_response=None):
+    # `stats` (a Counter) collects page/comment counts for the sweep summary.
+    # `first_response` is the video's first page when scan_due_videos prefetched it.
+    stats = stats if stats is not None else Counter()
+    video_id = video_state["video_id"]
+    video_title = video_state.get("video_title")
+    log.debug("video.scan", video_id=video_id, mode=mode)
+
+    # Threads come newest first (order=time). An incremental scan stops at the
+    # video's high-water mark; a deep scan walks every page to refresh statuses.
+    high_water = video_state.get("newest_comment_published_at")
+    triage_policy = await triage.get_policy(user_id, channel_id) if triage.TRIAGE_ENABLED else None
+    triage_seen = Counter()
+    reply_template = await prompt_templates.get_template(user_id, channel_id)
+    scan = {
+        "page_token": video_state.get("page_token"),
+        "newest": video_state.get("scan_newest_published_at"),
+        "new_threads": 0,
+    }
+
+    async def fetch_pages():
+        resume_token = scan["page_token"]
+        pages = 0
+        try:
+            async for items, next_page_token in iter_comment_thread_pages(
+                client, video_id, limiter, page_token=resume_token, first_response=first_response
+            ):
+                pages += 1
+                stats["pages"] += 1
+                stats["threads"] += len(items)
+                page = []
+                reached_high_water = False
+                for item in items:
+                    published_at = parse_youtube_time(item["snippet"]["topLevelComment"]["snippet"]["publishedAt"])
+                    if high_water is not None and published_at <= high_water:
+                        if mode == SCAN_INCREMENTAL:
+                            reached_high_water = True
+                            break
+                    else:
+                        scan["new_threads"] += 1
+                    if scan["newest"] is None or published_at > scan["newest"]:
+                        scan["newest"] = published_at
+                    page.append(item)
+                if page:
+                    yield page
+
+                scan["page_token"] = None if reached_high_water else next_page_token
+                if reached_high_water:
+                    return
+                if SYNC_MAX_PAGES_PER_VIDEO and pages >= SYNC_MAX_PAGES_PER_VIDEO and next_page_token:
+                    log.info("video.page_budget_reached", video_id=video_id, pages=pages)
+                    return
+        except HttpError as e:
+            if 'commentsDisabled' in error_reasons(e):
+                log.info("video.comments_disabled", video_id=video_id)
+                scan["page_token"] = None
+                return
+            if resume_token and not pages and getattr(e.resp, 'status', None) == 400:
+                # Stale resume token; the next sweep restarts this scan from the newest thread.
+                log.warning("video.resume_token_expired", video_id=video_id)
+                scan["page_token"] = None
+                scan["newest"] = None
+                return
+            raise
+
+    # Pipeline stages, one page at a time: classify decides the new status of each
+    # thread, persist upserts it and queues a held reply job for each new comment, and
+    # generate writes AI replies for the page's new comments in one batch and releases
+    # their jobs to the reply workers.
+    async def classify(page, emit):
+        # One $in query loads the stored state of the whole page.
+        comment_ids = [item["snippet"]["topLevelComment"]["id"] for item in page]
+        existing_docs = await db.comments.find(
+            {"_id": {"$in": comment_ids}, "user_id": user_id, "channel_id": channel_id},
+            {"status": 1, "video_title": 1, "author_name": 1, "author_avatar": 1, "text": 1,
+             "published_at": 1, "like_count": 1, "video_id": 1, "replied_at": 1}
+        ).to_list(length=None)
+        existing_by_id = {doc["_id"]: doc for doc in existing_docs}
+
+        records = []
+        for item in page:
             try:
-                credentials = Credentials.from_authorized_user_info(info=creds_json)
-                youtube = build("youtube", "v3", credentials=credentials)
-
-                print(f"Fetching channel info for user {user['email']}")
-                channel_request = youtube.channels().list(part="contentDetails,snippet", mine=True)
-                channel_response = await run_in_threadpool(channel_request.execute)
-                print(f"Finished fetching channel info for user {user['email']}. Response items: {len(channel_response.get('items', []))}")
-
-                if not channel_response.get("items"):
-                    print(f"No channel found for user {user['email']}")
-                    continue
-
-                channel_id = channel_response["items"][0]["id"]
-                channel_name = channel_response["items"][0]["snippet"]["title"]
-                uploads_playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
-                print(f"Channel ID: {channel_id}, Channel Name: {channel_name}, Uploads Playlist ID: {uploads_playlist_id}")
-
-                print(f"Fetching videos for uploads playlist {uploads_playlist_id}")
-                videos = []
-                next_page_token = None
-                while True:
-                    playlist_request = youtube.playlistItems().list(
-                        part="contentDetails,snippet",
-                        playlistId=uploads_playlist_id,
-                        maxResults=50,
-                        pageToken=next_page_token
-                    )
-                    playlist_response = await run_in_threadpool(playlist_request.execute)
-                    print(f"Fetched {len(playlist_response.get('items', []))} videos. Next page token: {next_page_token}")
-                    videos.extend(playlist_response.get("items", []))
-                    next_page_token = playlist_response.get("nextPageToken")
-                    if not next_page_token:
+                comment_id = item["snippet"]["topLevelComment"]["id"]
+                record = classify_comment_thread(item, existing_by_id.get(comment_id), video_id, video_title, channel_id)
+            except Exception as e:
+                stats["errors"] += 1
+                log.warning("comment.classify_failed", video_id=video_id, error=str(e))
+                continue
+            if record:
+                records.append(record)
+
+        # Local triage scores the page's new comments before any of them reach Gemini.
+        candidates = [record for record in records if record["needs_reply"]]
+        if candidates and triage_policy and triage_policy["enabled"]:
+            verdicts = triage.score_page(
+                [record["set_fields"]["text"] for record in candidates], triage_policy, triage_seen
+            )
+            for record, verdict in zip(candidates, verdicts):
+                skip_reason = verdict.pop("skip")
+                record["set_fields"]["triage"] = verdict
+                if skip_reason:
+                    record["needs_reply"] = False
+                    record["set_fields"].update(status=CommentStatus.SKIPPED.value, skip_reason=skip_reason)
+                    stats["skipped"] += 1
+                    metrics.COMMENTS.inc(event="skipped")
+        await emit(records)
+
+    def comment_update(record):
+        key = {"_id": record["comment_id"], "user_id": user_id, "channel_id": channel_id}
+        if record["previous_status"] is None:
+            # A comment stored meanwhile by another sweep or the API keeps its state.
+            return UpdateOne(key, {"$setOnInsert": record["set_fields"]}, upsert=True)
+        # Only while the status is still the one classify saw.
+        return UpdateOne({**key, "status": record["previous_status"]}, {"$set": record["set_fields"]})
+
+    async def persist(records, emit):
+        # One unordered bulk write per page; unchanged comments are not written at all.
+        # Status transitions of stored comments go through set_comment_status, which
+        # checks the previous status and moves the rollups with it.
+        changed_records = [
+            record for record in records
+            if record["changed"] and (record["previous_status"] is None or "status" not in record["set_fields"])
+        ]
+        transitions = [
+            record for record in records
+            if record["changed"] and record["previous_status"] is not None and "status" in record["set_fields"]
+        ]
+        operations = [comment_update(record) for record in changed_records]
+        inserted = modified = 0
+        upserted_indexes = set()
+        failed_indexes = set()
+        if operations:
+            try:
+                result = await db.comments.bulk_write(operations, ordered=False)
+                inserted, modified = result.upserted_count, result.modified_count
+                upserted_indexes = set(result.upserted_ids)
+            except BulkWriteError as e:
+                # Unordered writes carry on past failures; keep what did succeed.
+                details = e.details
+                inserted, modified = details.get("nUpserted", 0), details.get("nModified", 0)
+                upserted_indexes = {upsert["index"] for upsert in details.get("upserted", [])}
+                failed_indexes = {error["index"] for error in details.get("writeErrors", [])}
+                stats["errors"] += len(failed_indexes)
+                log.warning("comments.bulk_write_errors", video_id=video_id, errors=len(failed_indexes))
+        for record in transitions:
+            fields = {key: value for key, value in record["set_fields"].items() if key != "status"}
+            if await set_comment_status(
+                {"_id": record["comment_id"], "user_id": user_id, "channel_id": channel_id},
+                record["set_fields"]["published_at"], record["previous_status"], record["set_fields"]["status"],
+                **fields,
+            ):
+                modified += 1
+        unchanged = len(records) - inserted - modified
+        stats["inserted"] += inserted
+        metrics.COMMENTS.inc(inserted, event="ingested")
+        stats["modified"] += modified
+        stats["unchanged"] += unchanged
+
+        rollup = rollups.RollupBatch(user_id, channel_id)
+        for index, record in enumerate(changed_records):
+            # Comments inserted concurrently by someone else are theirs to count; the
+            # other writes here leave the status alone.
+            if index in upserted_indexes:
+                rollup.record(record["set_fields"]["published_at"], None, record["set_fields"]["status"])
+        await rollup.flush()
+
+        # Only reply when this sweep actually inserted the comment. The job is stored
+        # with the pending comment, so a reply survives a failed generate stage or a
+        # crash; it is held until generate releases it.
+        pending = [
+            record for index, record in enumerate(changed_records)
+            if record["needs_reply"] and index in upserted_indexes
+        ]
+        if pending:
+            stats["replies_queued"] += await reply_queue.enqueue([
+                {
+                    "user_id": user_id,
+                    "channel_id": channel_id,
+                    "comment_id": record["comment_id"],
+                    "video_id": video_id,
+                    "text": record["set_fields"]["text"],
+                    "published_at": record["set_fields"]["published_at"],
+                }
+                for record in pending
+            ], hold_seconds=reply_queue.REPLY_HOLD_SECONDS)
+            await emit(pending)
+        if failed_indexes:
+            # Fails the run, so the high-water mark stays behind the comments not stored.
+            raise RuntimeError(f"{len(failed_indexes)} comments were not stored")
+
+    async def generate(records, emit):
+        # Near-duplicate comments reuse a cached reply; the rest share one batched
+        # Gemini prompt per page (split by token budget) instead of one per comment.
+        replies = {}
+        uncached = []
+        for record in records:
+            cached_reply = reply_cache.lookup(channel_id, record["set_fields"]["text"])
+            if cached_reply:
+                replies[record["comment_id"]] = cached_reply
+            else:
+                uncached.append(record)
+        if uncached:
+            try:
+                generated = await ai_replies.generate_replies(
+                    [{"id": record["comment_id"], "text": record["set_fields"]["text"]} for record in uncached],
+                    reply_template,
+                )
+            except Exception as e:
+                # The jobs are already queued; once their hold runs out the workers
+                # generate the replies one by one.
+                log.warning("reply.batch_generation_failed", video_id=video_id, comments=len(uncached), error=str(e))
+                return
+            for record in uncached:
+                if record["comment_id"] in generated:
+                    reply_cache.store(channel_id, record["set_fields"]["text"], generated[record["comment_id"]])
+            replies.update(generated)
+        # Reply workers post the replies; a missing reply is generated by the worker.
+        await reply_queue.release(
+            user_id, channel_id, {record["comment_id"]: replies.get(record["comment_id"]) for record in records}
+        )
+
+    await run_pipeline(
+        fetch_pages(),
+        [(classify, 1), (persist, 1), (generate, 1)]
+    )
+
+    # Reached only when every stage handled every page (run_pipeline raises otherwise):
+    # a partly stored scan leaves the high-water mark where it was, and the next sweep
+    # walks those threads again.
+    await sync_state.record_video_scan(
+        video_state, mode, scan["newest"], scan["page_token"], scan["new_threads"]
+    )
+
+
+async def scan_due_videos(client, limiter, user_id, channel_id, video_states, stats):
+    now = datetime.utcnow()
+    due_videos = []
+    for video_state in video_states:
+        mode = sync_state.scan_mode(video_state, now)
+        if mode:
+            due_videos.append((video_state, mode))
+    stats["videos"] += len(video_states)
+    stats["videos_scanned"] += len(due_videos)
+
+    # Videos are processed concurrently; `limiter` caps how many YouTube requests
+    # this user has in flight at once.
+    async def process_video(video_state, mode, first_response):
+        try:
+            await process_video_comments(client, limiter, user_id, channel_id, video_state, mode, stats, first_response)
+        except Exception as e:
+            stats["video_errors"] += 1
+            log.warning("video.scan_failed", video_id=video_state.get("video_id"), error=str(e))
+
+    # The first page of every video in a group is fetched in one batch call; most
+    # incremental scans need nothing more. The next group's batch is fetched while
+    # this group is processed, so at most two groups' pages are held at once.
+    def prefetch(group):
+        requests = [
+            comment_threads_request(client, video_state["video_id"], video_state.get("page_token"))
+            for video_state, _ in group
+        ]
+        return asyncio.create_task(execute_batch(client, requests, limiter))
+
+    groups = [due_videos[start:start + YOUTUBE_BATCH_SIZE] for start in range(0, len(due_videos), YOUTUBE_BATCH_SIZE)]
+    next_pages = prefetch(groups[0]) if groups else None
+    try:
+        for index, group in enumerate(groups):
+            first_pages = await next_pages
+            next_pages = prefetch(groups[index + 1]) if index + 1 < len(groups) else None
+            await asyncio.gather(*(
+                process_video(video_state, mode, first_response)
+                for (video_state, mode), first_response in zip(group, first_pages)
+            ))
+    finally:
+        if next_pages is not None and not next_pages.done():
+            next_pages.cancel()
+
+
+async def sweep_user(user, limiter):
+    user_id = str(user["_id"])
+    creds_json = user.get("google_credentials")
+    if not creds_json:
+        log.warning("sweep.no_credentials", user_id=user_id)
+        return
+
+    # One summary record per sweep instead of a line per page and comment.
+    stats = Counter()
+    started = time.monotonic()
+    try:
+        client = youtube_clients.get(user_id, creds_json)
+
+        # Channel metadata comes from the user document and is refreshed once stale.
+        with metrics.span("sweep.channel"):
+            channel = await get_channel(user, client, limiter)
+        if not channel:
+            log.warning("sweep.no_channel", user_id=user_id)
+            return
+
+        channel_id = channel["id"]
+        uploads_playlist_id = channel["uploads_playlist_id"]
+
+        # Only page through uploads newer than the last sweep's high-water mark;
+        # the playlist is ordered newest first.
+        channel_state = await sync_state.load_channel_state(user_id, channel_id)
+        if not channel_state.get("rollups_rebuilt_at"):
+            # Backfill dashboard rollups once for history ingested before they existed.
+            await rollups.rebuild(user_id, channel_id)
+            await sync_state.save_channel_state(user_id, channel_id, rollups_rebuilt_at=datetime.utcnow())
+        newest_known_upload = channel_state.get("newest_video_published_at")
+        new_videos = []
+        newest_upload = None
+        next_page_token = None
+        with metrics.span("sweep.playlist"):
+            while True:
+                playlist_request = client.service.playlistItems().list(
+                    part="contentDetails,snippet",
+                    playlistId=uploads_playlist_id,
+                    maxResults=50,
+                    pageToken=next_page_token
+                )
+                playlist_response = await client.execute(playlist_request, limiter)
+                stats["playlist_pages"] += 1
+                reached_known = False
+                for video in playlist_response.get("items", []):
+                    video_published_at = parse_youtube_time(video["snippet"]["publishedAt"])
+                    if newest_known_upload is not None and video_published_at <= newest_known_upload:
+                        reached_known = True
                         break
-                print(f"Finished fetching {len(videos)} videos in total.")
-
-                print(f"Finished fetching {len(videos)} videos in total. Starting to process comments for each video.")
-                for video in videos:
-                    video_id = video["contentDetails"]["videoId"]
-                    video_title = video["snippet"]["title"]
-                    print(f"Processing video: {video_title} (ID: {video_id})")
-
-                    comment_threads_request = youtube.commentThreads().list(
-                        part="snippet,replies",
-                        videoId=video_id,
-                        maxResults=10
-                    )
-                    comment_threads_response = await run_in_threadpool(comment_threads_request.execute)
-                    print(f"Fetched {len(comment_threads_response.get('items', []))} comment threads for video {video_id}.")
-                    
-                    if not comment_threads_response.get("items"):
-                        print(f"No comment threads found for video {video_id}.")
-                        continue
-
-                    for item in comment_threads_response.get("items", []):
-                        print(f"DEBUG: Processing item: {item}")
-                        try:
-                            top_level_comment = item["snippet"]["topLevelComment"]
-                            comment_id = top_level_comment["id"]
-                            print(f"Processing comment ID: {comment_id} for video: {video_id}")
-                            
-                            comment_text = top_level_comment["snippet"]["textDisplay"]
-                            author_name = top_level_comment["snippet"]["authorDisplayName"]
-                            author_avatar = top_level_comment["snippet"].get("authorProfileImageUrl")
-                            published_at_str = top_level_comment["snippet"]["publishedAt"]
-                            published_at = datetime.fromisoformat(published_at_str.replace('Z', '+00:00'))
-                            like_count = top_level_comment["snippet"]["likeCount"]
-
-                            has_replies_from_youtube = item["snippet"]["totalReplyCount"] > 0
-                            is_self_comment = top_level_comment["snippet"].get("authorChannelId", {}).get("value") == channel_id
-
-                            top_level_comment = item["snippet"]["topLevelComment"]
-                            comment_id = top_level_comment["id"]
-                            print(f"Processing comment ID: {comment_id} for video: {video_id}")
-                            
-                            comment_text = top_level_comment["snippet"]["textDisplay"]
-                            author_name = top_level_comment["snippet"]["authorDisplayName"]
-                            author_avatar = top_level_comment["snippet"].get("authorProfileImageUrl")
-                            published_at_str = top_level_comment["snippet"]["publishedAt"]
-                            published_at = datetime.fromisoformat(published_at_str.replace('Z', '+00:00'))
-                            like_count = top_level_comment["snippet"]["likeCount"]
-
-                            has_replies_from_youtube = item["snippet"]["totalReplyCount"] > 0
-                            is_self_comment = top_level_comment["snippet"].get("authorChannelId", {}).get("value") == channel_id
-
-                            if is_self_comment:
-                                print(f"Skipping self-comment {comment_id} for video {video_id}.")
-                                continue
-
-                            # Define the filter for the upsert operation
-                            filter_query = {
-                                "_id": comment_id,
-                                "user_id": user_id,
-                                "channel_id": channel_id,
-                            }
-
-                            # Fetch existing document to determine current status and whether an AI reply already exists
-                            existing_comment_doc = await db.comments.find_one(filter_query)
-
-                            # Determine initial status for new comments or status to update
-                            initial_status_for_new = CommentStatus.REPLIED if has_replies_from_youtube else CommentStatus.PENDING
-                            
-                            # Prepare fields for the $set operation in upsert
-                            set_fields = {
-                                "video_id": video_id,
-                                "video_title": video_title,
-                                "author_name": author_name,
-                                "author_avatar": author_avatar,
-                                "text": comment_text,
-                                "published_at": published_at,
-                                "like_count": like_count,
-                            }
-                            
-                            # Logic for status and replied_at
-                            current_db_status = existing_comment_doc["status"] if existing_comment_doc else None
-                            
-                            # If existing, and was PENDING, but now has YouTube replies -> update to REPLIED
-                            if current_db_status == CommentStatus.PENDING.value and has_replies_from_youtube:
-                                set_fields["status"] = CommentStatus.REPLIED.value
-                                set_fields["replied_at"] = datetime.utcnow()
-                                print(f"Comment {comment_id} for user {user_id} was manually replied to on YouTube. Setting status to REPLIED.")
-                            elif current_db_status is None: # Newly inserted comment
-                                set_fields["status"] = initial_status_for_new.value
-                                if initial_status_for_new == CommentStatus.REPLIED:
-                                    set_fields["replied_at"] = datetime.utcnow()
-                                print(f"New comment {comment_id} for user {user_id}. Initial status: {set_fields['status']}.")
-                            else: # Keep existing status for other cases (e.g., already REPLIED by AI, FAILED, or still PENDING without YouTube replies)
-                                set_fields["status"] = current_db_status
-
-                            # Perform the upsert operation
-                            update_result = await db.comments.update_one(
-                                filter_query,
-                                {"$set": set_fields},
-                                upsert=True
-                            )
-                            
-                            # If a new document was actually inserted (upserted) and it's pending, trigger AI reply
-                            # Or if an existing document's status changed to PENDING (shouldn't happen with current logic, but for robustness)
-                            if update_result.upserted_id or (existing_comment_doc and set_fields["status"] == CommentStatus.PENDING.value and current_db_status != CommentStatus.PENDING.value):
-                                print(f"Comment {comment_id} was {'inserted' if update_result.upserted_id else 'updated'} to {set_fields['status']} status.")
-                                
-                                # Only attempt AI reply if the comment is now PENDING and has no replies from YouTube
-                                if set_fields["status"] == CommentStatus.PENDING.value and not has_replies_from_youtube:
-                                    comment_status_to_update = CommentStatus.FAILED
-                                    try:
-                                        ai_response = await ai_generate_reply(AIRequest(comment_text=comment_text))
-                                        reply_text = ai_response.get("reply", "Thanks for your comment!")
-
-                                        reply_request_body = {
-                                            "snippet": {
-                                                "parentId": comment_id,
-                                                "textOriginal": reply_text
-                                            }
-                                        }
-                                        reply_insert_request = youtube.comments().insert(part="snippet", body=reply_request_body)
-                                        await run_in_threadpool(reply_insert_request.execute)
-                                        
-                                        comment_status_to_update = CommentStatus.REPLIED
-                                        print(f"Attempting to update comment {comment_id} to status: {comment_status_to_update.value}")
-                                        update_result = await db.comments.update_one(
-                                            filter_query,
-                                            {"$set": {"status": comment_status_to_update.value, "ai_reply": reply_text, "replied_at": datetime.utcnow()}}
-                                        )
-                                        print(f"Update result for replied comment {comment_id}: Matched={update_result.matched_count}, Modified={update_result.modified_count}")
-
-                                    except Exception as e:
-                                        print(f"Failed to reply to comment {comment_id}: {e}")
-                                        print(f"Attempting to update comment {comment_id} to status: {CommentStatus.FAILED.value}")
-                                        update_result = await db.comments.update_one(
-                                            filter_query,
-                                            {"$set": {"status": CommentStatus.FAILED.value}}
-                                        )
-                                        print(f"Update result for failed comment {comment_id}: Matched={update_result.matched_count}, Modified={update_result.modified_count}")
-                            else:
-                                print(f"Comment {comment_id} already exists with status {set_fields['status']} and no action needed.")
-                        except Exception as e:
-                            print(f"An error occurred while processing comment item in video {video_id}: {e}") # Removed comment_id from print as it might not be available
-                            continue
+                    new_videos.append(video)
+                    if newest_upload is None or video_published_at > newest_upload:
+                        newest_upload = video_published_at
+                next_page_token = playlist_response.get("nextPageToken")
+                if reached_known or not next_page_token:
+                    break
+
+        await sync_state.register_videos(user_id, channel_id, new_videos)
+        await sync_state.save_channel_state(
+            user_id, channel_id, newest_video_published_at=newest_upload, uploads_playlist_id=uploads_playlist_id
+        )
 
-            except HttpError as e:
-                print(f"HttpError for user {user['email']}: {e}")
-            except Exception as e:
-                print(f"An error occurred for user {user['email']}: {e}")
+        if websub.WEBSUB_ENABLED:
+            await websub.ensure_subscription(user_id, channel_id, channel_state)
 
-        await asyncio.sleep(10)
+        video_states = await sync_state.load_video_states(user_id, channel_id)
+        stats["new_videos"] += len(new_videos)
+        with metrics.span("sweep.scan_videos"):
+            await scan_due_videos(client, limiter, user_id, channel_id, video_states, stats)
 
-@app.on_event("startup")
-async def startup_event():
+    except HttpError as e:
+        stats["errors"] += 1
+        log.error("sweep.google_api_error", user_id=user_id, status=getattr(e.resp, "status", None), error=str(e))
+        raise
+    finally:
+        duration = time.monotonic() - started
+        metrics.SWEEP_DURATION.observe(duration, kind="full")
+        log.info("sweep.summary", user_id=user_id, duration_ms=round(duration * 1000), **stats)
+
+
+async def sweep_videos(user, limiter, video_ids):
+    # Targeted sweep after an upload notification: only the notified videos, without
+    # paging through the uploads playlist.
+    user_id = str(user["_id"])
+    stats = Counter()
+    started = time.monotonic()
+    client = youtube_clients.get(user_id, user["google_credentials"])
+    channel = await get_channel(user, client, limiter)
+    if not channel:
+        return
+    video_states = await sync_state.load_video_states(user_id, channel["id"], video_ids)
+    await scan_due_videos(client, limiter, user_id, channel["id"], video_states, stats)
+    duration = time.monotonic() - started
+    metrics.SWEEP_DURATION.observe(duration, kind="targeted")
+    log.info("sweep.summary", user_id=user_id, targeted=len(video_ids), duration_ms=round(duration * 1000), **stats)
+
+
+sweep_scheduler = SweepScheduler(sweep_user, membership=SweeperMembership(), sweep_videos=sweep_videos)
+reply_workers = reply_queue.ReplyWorkerPool(deliver_reply, on_dead=reply_job_dead)
+
+
+async def auto_reply_task():
+    log.info("sweeper.start")
+    await sweep_scheduler.run_forever()
+
+async def ensure_indexes():
     # Create MongoDB indexes for performance
-    print("Creating MongoDB indexes...")
     await db.comments.create_index([("user_id", 1), ("channel_id", 1), ("status", 1)], name="user_channel_status_idx")
     await db.comments.create_index([("user_id", 1), ("channel_id", 1), ("published_at", 1), ("status", 1)], name="user_channel_published_status_idx")
-    print("MongoDB indexes created.")
-
-    asyncio.create_task(auto_reply_task())
+    await db.comments.create_index([("user_id", 1), ("channel_id", 1), ("video_id", 1), ("status", 1)], name="user_channel_video_status_idx")
+    await sync_state.ensure_indexes()
+    await rollups.ensure_indexes()
+    await comment_pages.ensure_indexes()
+    await reply_queue.ensure_indexes()
+    await quota.ensure_indexes()
+    await db.users.create_index([("youtube_channel.id", 1)], name="youtube_channel_idx")
+    log.info("mongo.indexes_ready")
 
+@app.on_event("startup")
+async def startup_event():
+    await ensure_indexes()
+    if METRICS_PORT:
+        app.state.metrics_server = await start_metrics_server(int(METRICS_PORT))
+    if EMBEDDED_SWEEPER:
+        app.state.auto_reply_task = asyncio.create_task(auto_reply_task())
+        reply_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    task = getattr(app.state, "auto_reply_task", None)
+    if task:
+        task.cancel()
+    await sweep_scheduler.shutdown()
+    await reply_workers.shutdown()
+    await youtube_quota.close()
+    await close_async_http()
+    metrics_server = getattr(app.state, "metrics_server", None)
+    if metrics_server:
+        metrics_server.close()
 
 
 # --- Pydantic Models ---
@@ -305,10 +752,51 @@ class AIRequest(BaseModel):
 class DeleteRequest(BaseModel):
     commentId: str
 
+TRIAGE_POLICY_FIELDS = {
+    "enabled": "enabled",
+    "spamFilterEnabled": "spam_filter_enabled",
+    "spamThreshold": "spam_threshold",
+    "toxicityThreshold": "toxicity_threshold",
+    "skipLowValue": "skip_low_value",
+    "blacklistWords": "blacklist_words",
+    "allowedScripts": "allowed_scripts",
+}
+
+def triage_policy_to_api(policy):
+    return {name: policy[field] for name, field in TRIAGE_POLICY_FIELDS.items()}
+
+PERSONA_FIELDS = {
+    "tone": "tone",
+    "description": "description",
+    "rules": "rules",
+    "maxReplyLength": "max_reply_length",
+}
+
+def persona_to_api(persona):
+    return {name: persona[field] for name, field in PERSONA_FIELDS.items()}
+
+class PersonaRequest(BaseModel):
+    # Fields left out keep their current value.
+    tone: Optional[Literal['friendly', 'professional', 'casual']] = None
+    description: Optional[str] = Field(None, max_length=1000)
+    rules: Optional[list[str]] = Field(None, max_length=20)
+    maxReplyLength: Optional[int] = Field(None, ge=20, le=10000)
+
+class TriagePolicyRequest(BaseModel):
+    # Fields left out keep their current value.
+    enabled: Optional[bool] = None
+    spamFilterEnabled: Optional[bool] = None
+    spamThreshold: Optional[float] = Field(None, ge=0, le=1)
+    toxicityThreshold: Optional[float] = Field(None, ge=0, le=1)
+    skipLowValue: Optional[bool] = None
+    blacklistWords: Optional[list[str]] = None
+    allowedScripts: Optional[list[str]] = None
+
 class CommentStatus(str, Enum):
     PENDING = "pending"
     REPLIED = "replied"
     FAILED = "failed"
+    SKIPPED = "skipped"
 
 class Comment(BaseModel):
     _id: str
@@ -345,35 +833,42 @@ async def get_current_user_credentials(user: dict = Depends(get_current_user_db)
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="YouTube account not connected. Please connect your account in settings."
         )
-    return Credentials.from_authorized_user_info(info=creds_json)
+    return credential_manager.get(str(user["_id"]), creds_json)
+
+async def get_youtube_client(user: dict = Depends(get_current_user_db)):
+    creds_json = user.get("google_credentials")
+    if not creds_json:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="YouTube account not connected. Please connect your account in settings."
+        )
+    return youtube_clients.get(str(user["_id"]), creds_json)
 
-async def get_current_channel_id(credentials: Credentials = Depends(get_current_user_credentials)):
+async def get_current_channel(user: dict = Depends(get_current_user_db), client: YouTubeClient = Depends(get_youtube_client)):
+    # Served from the user document; Google is only asked on a cache miss.
     try:
-        def fetch_channel_id():
-            youtube = build("youtube", "v3", credentials=credentials)
-            channel_request = youtube.channels().list(part="id", mine=True)
-            channel_response = channel_request.execute()
-            if channel_response.get("items"):
-                return channel_response["items"][0]["id"]
-            return None
-        
-        channel_id = await run_in_threadpool(fetch_channel_id)
-        if not channel_id:
+        channel = await get_channel(user, client)
+        if not channel:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="YouTube channel ID not found for the authenticated user."
             )
-        return channel_id
+        return channel
+    except HTTPException:
+        raise
     except HttpError as e:
         try:
             error_details = json.loads(e.content.decode('utf-8'))['error']
         except Exception:
             error_details = {"message": str(e)}
-        print(f"Google API HttpError (get_current_channel_id): status={getattr(e.resp, 'status', 'unknown')} details={error_details}")
+        api_log.warning("google_api.error", context="get_current_channel", status=getattr(e.resp, "status", None), details=error_details)
         raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to fetch channel ID: {e}")
 
+async def get_current_channel_id(channel: dict = Depends(get_current_channel)):
+    return channel["id"]
+
 
 # --- Core Endpoints ---
 @app.get("/")
@@ -387,41 +882,32 @@ async def logout_user(request: Request):
     return {"message": "Logout successful"}
 
 @app.get("/me")
-async def get_me(user: dict = Depends(get_current_user_db), credentials: Credentials = Depends(get_current_user_credentials)):
-    channel_name = None
-    channel_picture = None
+async def get_me(request: Request, user: dict = Depends(get_current_user_db), client: YouTubeClient = Depends(get_youtube_client)):
+    async def fetch():
+        channel_name = None
+        channel_picture = None
 
-    if credentials:
-        try:
-            def get_channel_info():
-                youtube = build("youtube", "v3", credentials=credentials)
-                channel_request = youtube.channels().list(part="snippet", mine=True)
-                channel_response = channel_request.execute()
-                if channel_response.get("items"):
-                    snippet = channel_response["items"][0]["snippet"]
-                    return {
-                        "name": snippet.get("title"),
-                        "picture": snippet.get("thumbnails", {}).get("default", {}).get("url")
-                    }
-                return None
-            
-            channel_info = await run_in_threadpool(get_channel_info)
-            if channel_info:
-                channel_name = channel_info["name"]
-                channel_picture = channel_info["picture"]
+        if client:
+            try:
+                channel = await get_channel(user, client)
+                if channel:
+                    channel_name = channel["title"]
+                    channel_picture = channel["avatar"]
 
-        except HttpError as e:
-            print(f"Error fetching channel info for user {user['email']}: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred while fetching channel info: {e}")
+            except HttpError as e:
+                api_log.warning("channel.fetch_failed", user_id=str(user["_id"]), error=str(e))
+            except Exception:
+                api_log.exception("channel.fetch_failed", user_id=str(user["_id"]))
 
-    return {
-        "id": str(user["_id"]),
-        "email": user["email"],
-        "is_google_connected": True,
-        "name": channel_name,
-        "picture": channel_picture
-    }
+        return {
+            "id": str(user["_id"]),
+            "email": user["email"],
+            "is_google_connected": True,
+            "name": channel_name,
+            "picture": channel_picture
+        }
+
+    return await response_cache.respond(request, (str(user["_id"]), "me"), fetch)
 
 # --- Google OAuth Endpoints ---
 @app.get("/auth/google")
@@ -470,6 +956,14 @@ async def google_callback(request: Request, state: str, code: str, error: str |
                 {"$set": {"google_credentials": json.loads(credentials.to_json())}}
             )
             user_id = user["_id"]
+            youtube_clients.invalidate(str(user_id))
+            response_cache.invalidate(str(user_id))
+
+        # Prime the channel metadata cache so the dashboard never has to ask Google.
+        try:
+            await fetch_channel({"_id": user_id}, youtube_clients.get(str(user_id), json.loads(credentials.to_json())))
+        except Exception as e:
+            api_log.warning("channel.cache_failed", email=email, error=str(e))
 
         request.session["user_id"] = str(user_id)
         
@@ -482,58 +976,72 @@ async def google_callback(request: Request, state: str, code: str, error: str |
 
 @app.get("/youtube/videos")
 async def get_youtube_videos(
-    credentials: Credentials = Depends(get_current_user_credentials),
+    request: Request,
+    client: YouTubeClient = Depends(get_youtube_client),
+    channel: dict = Depends(get_current_channel),
     max_results: int = 10 # Default to 10 videos for dashboard
 ):
-    try:
-        def get_videos():
-            youtube = build("youtube", "v3", credentials=credentials)
-            
-            # Get the user's channel
-            channel_request = youtube.channels().list(part="contentDetails", mine=True)
-            channel_response = channel_request.execute()
-            
-            if not channel_response.get("items"):
-                raise HTTPException(status_code=404, detail="YouTube channel not found.")
-                
-            uploads_playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
-            
-            videos = []
-            
+    async def fetch():
+        try:
+            uploads_playlist_id = channel["uploads_playlist_id"]
+
             # Fetch only the first batch of videos, up to the requested max_results,
             # respecting YouTube API's maxResults limit of 50.
-            playlist_request = youtube.playlistItems().list(
+            playlist_request = client.service.playlistItems().list(
                 part="snippet,contentDetails",
                 playlistId=uploads_playlist_id,
                 maxResults=min(50, max_results),
             )
-            playlist_response = playlist_request.execute()
-            
-            videos.extend(playlist_response.get("items", []))
-            
-            return {"items": videos}
+            playlist_response = await client.execute(playlist_request)
 
-        response = await run_in_threadpool(get_videos)
-        return response
-    except HttpError as e:
-        try:
-            error_details = json.loads(e.content.decode('utf-8'))['error']
-        except Exception:
-            error_details = {"message": str(e)}
-        print(f"Google API HttpError (videos): status={getattr(e.resp, 'status', 'unknown')} details={error_details}")
-        raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+            return {"items": playlist_response.get("items", [])}
+        except HttpError as e:
+            try:
+                error_details = json.loads(e.content.decode('utf-8'))['error']
+            except Exception:
+                error_details = {"message": str(e)}
+            api_log.warning("google_api.error", context="videos", status=getattr(e.resp, "status", None), details=error_details)
+            raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+    return await response_cache.respond(request, (client.user_id, "videos", min(50, max_results)), fetch)
 
 # --- YouTube Data Endpoints ---
+async def stream_comment_pages(video_id, first_page, pages):
+    # Emits {"items": [...]} one thread at a time so memory stays flat on huge videos.
+    yield '{"items": ['
+    separator = ''
+    items, _ = first_page
+    try:
+        while True:
+            for item in items:
+                yield separator + json.dumps(item)
+                separator = ','
+            items, _ = await anext(pages)
+    except StopAsyncIteration:
+        yield ']}'
+    except Exception as e:
+        api_log.warning("comments.stream_stopped", video_id=video_id, error=str(e))
+        yield '], "truncated": true}'
+
 @app.get("/youtube/comments/{video_id}")
-async def get_youtube_comments(video_id: str, credentials: Credentials = Depends(get_current_user_credentials)):
+async def get_youtube_comments(
+    video_id: str,
+    page_token: Optional[str] = None,
+    all_pages: bool = False,
+    client: YouTubeClient = Depends(get_youtube_client)
+):
     try:
-        def get_comments():
-            youtube = build("youtube", "v3", credentials=credentials)
-            request = youtube.commentThreads().list(part="snippet,replies", videoId=video_id, maxResults=100)
-            return request.execute()
-        response = await run_in_threadpool(get_comments)
+        if all_pages:
+            # Stream every page instead of stopping at the first 100 threads. The first
+            # page is fetched up front so API errors still map to a proper status code.
+            pages = iter_comment_thread_pages(client, video_id, page_token=page_token)
+            first_page = await anext(pages)
+            return StreamingResponse(stream_comment_pages(video_id, first_page, pages), media_type="application/json")
+
+        request = client.service.commentThreads().list(part="snippet,replies", videoId=video_id, maxResults=100, pageToken=page_token)
+        response = await client.execute(request)
         return response
     except HttpError as e:
         try:
@@ -541,7 +1049,7 @@ async def get_youtube_comments(video_id: str, credentials: Credentials = Depends
         except Exception:
             error_details = {"message": str(e), "errors": []}
 
-        print(f"Google API HttpError (comments): status={getattr(e.resp, 'status', 'unknown')} details={error_details}")
+        api_log.warning("google_api.error", context="comments", status=getattr(e.resp, "status", None), details=error_details)
 
         # If comments are disabled for the video, return an explicit, non-error response
         errors_list = error_details.get('errors', []) if isinstance(error_details.get('errors', []), list) else []
@@ -554,37 +1062,29 @@ async def get_youtube_comments(video_id: str, credentials: Credentials = Depends
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 @app.post("/youtube/comments/reply")
-async def reply_to_youtube_comment(request: ReplyRequest, credentials: Credentials = Depends(get_current_user_credentials)):
+async def reply_to_youtube_comment(request: ReplyRequest, client: YouTubeClient = Depends(get_youtube_client)):
     try:
-        def post_reply():
-            youtube = build("youtube", "v3", credentials=credentials)
-            youtube_request = youtube.comments().insert(
-                part="snippet",
-                body={"snippet": {"parentId": request.commentId, "textOriginal": request.replyText}}
-            )
-            return youtube_request.execute()
-        response = await run_in_threadpool(post_reply)
+        youtube_request = client.service.comments().insert(
+            part="snippet",
+            body={"snippet": {"parentId": request.commentId, "textOriginal": request.replyText}}
+        )
+        response = await client.execute(youtube_request)
         return response
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to post reply: {e}")
 
 
 @app.post("/youtube/comments/delete")
-async def delete_youtube_comment(request: DeleteRequest, credentials: Credentials = Depends(get_current_user_credentials)):
+async def delete_youtube_comment(request: DeleteRequest, client: YouTubeClient = Depends(get_youtube_client)):
     try:
-        def do_delete():
-            youtube = build("youtube", "v3", credentials=credentials)
-            youtube.comments().delete(id=request.commentId).execute()
-            return {"status": "deleted", "commentId": request.commentId}
-
-        response = await run_in_threadpool(do_delete)
-        return response
+        await client.execute(client.service.comments().delete(id=request.commentId))
+        return {"status": "deleted", "commentId": request.commentId}
     except HttpError as e:
         try:
             error_details = json.loads(e.content.decode('utf-8'))['error']
         except Exception:
             error_details = {"message": str(e)}
-        print(f"Google API HttpError (delete): status={getattr(e.resp, 'status', 'unknown')} details={error_details}")
+        api_log.warning("google_api.error", context="delete", status=getattr(e.resp, "status", None), details=error_details)
         raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to delete comment: {e}")
@@ -592,110 +1092,280 @@ async def delete_youtube_comment(request: DeleteRequest, credentials: Credential
 
 @app.post("/ai/generate-reply")
 async def ai_generate_reply(request: AIRequest):
-    # Try a list of models (prefer flash/latest variants which are commonly available).
-    candidates = [
-        'models/gemini-flash-latest',
-        'models/gemini-2.5-flash',
-        'models/gemini-2.5-pro',
-        'models/gemini-pro-latest',
-    ]
+    try:
+        return await ai_replies.generate_reply(request.comment_text)
+    except ai_replies.AIGenerationError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/comments")
+async def list_stored_comments(
+    video_id: Optional[str] = None,
+    statuses: Optional[list[CommentStatus]] = Query(None, alias="status"),
+    author: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(comment_pages.COMMENTS_PAGE_DEFAULT_LIMIT, ge=1, le=comment_pages.COMMENTS_PAGE_MAX_LIMIT),
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    # Comments the sweeper has stored, newest first; pass `nextCursor` back as `cursor`
+    # for the next page. Costs no YouTube quota.
+    try:
+        return await comment_pages.list_comments(
+            str(user["_id"]), channel_id, video_id=video_id,
+            statuses=[comment_status.value for comment_status in statuses or []],
+            author=author, cursor=cursor, limit=limit
+        )
+    except comment_pages.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    prompt = f"""
-    As a friendly and appreciative YouTube creator, please generate a short and engaging reply to the following comment.
-    Your reply should be based on the content and sentiment of the comment.
+@app.get("/triage/policy")
+async def get_triage_policy(
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    return triage_policy_to_api(await triage.get_policy(str(user["_id"]), channel_id))
 
-    **IMPORTANT INSTRUCTIONS:**
-    1.  IMPORTANT: First, detect the language of the comment (e.g., English, Telugu, Hindi). Your reply MUST be in the same language as the comment.
-    2.  **No Commitments:** Do NOT make any promises or commitments about future videos or content. If a user asks about the next video, give a friendly, non-committal answer like "I'm working on it, stay tuned!" or "Thanks for the suggestion, I'll keep it in mind!".
+@app.put("/triage/policy")
+async def update_triage_policy(
+    request: TriagePolicyRequest,
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    changes = {
+        TRIAGE_POLICY_FIELDS[name]: value
+        for name, value in request.model_dump(exclude_none=True).items()
+    }
+    if "blacklist_words" in changes:
+        changes["blacklist_words"] = list(dict.fromkeys(word.strip() for word in changes["blacklist_words"] if word.strip()))
+    if "allowed_scripts" in changes:
+        changes["allowed_scripts"] = [script.strip().lower() for script in changes["allowed_scripts"] if script.strip()]
+    return triage_policy_to_api(await triage.save_policy(str(user["_id"]), channel_id, changes))
+
+@app.get("/persona")
+async def get_persona(
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    return persona_to_api(await prompt_templates.get_persona(str(user["_id"]), channel_id))
 
-    Comment: "{request.comment_text}"
+@app.put("/persona")
+async def update_persona(
+    request: PersonaRequest,
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    changes = {PERSONA_FIELDS[name]: value for name, value in request.model_dump(exclude_none=True).items()}
+    if "description" in changes:
+        changes["description"] = changes["description"].strip()
+    if "rules" in changes:
+        changes["rules"] = [rule.strip() for rule in changes["rules"] if rule.strip()]
+    persona = await prompt_templates.save_persona(str(user["_id"]), channel_id, changes)
+    # Replies cached for the old persona would no longer match it.
+    reply_cache.invalidate(channel_id)
+    return persona_to_api(persona)
+
+@app.get("/replies/queue")
+async def get_reply_queue_stats(
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    return await reply_queue.queue_stats(str(user["_id"]), channel_id)
 
-    - If the comment is positive (e.g., "Great video!", "I learned so much"), express gratitude and acknowledge the compliment.
-    - If the comment is a question, provide a helpful and concise answer, but without making promises.
-    - If the comment is negative or critical, respond politely and professionally.
-    - Keep the reply authentic and avoid generic phrases.
+@app.post("/replies/queue/retry-dead")
+async def retry_dead_replies(
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id)
+):
+    # Gives dead-lettered replies a fresh set of attempts; their comments go back to PENDING.
+    user_id = str(user["_id"])
+    dead_jobs = await db.reply_jobs.find(
+        {"user_id": user_id, "channel_id": channel_id, "status": reply_queue.JOB_DEAD},
+        {"comment_id": 1, "published_at": 1}
+    ).to_list(length=None)
+    for job in dead_jobs:
+        filter_query = {"_id": job["comment_id"], "user_id": user_id, "channel_id": channel_id}
+        await set_comment_status(filter_query, job["published_at"], CommentStatus.FAILED.value, CommentStatus.PENDING.value)
+    requeued = await reply_queue.requeue_dead(user_id, channel_id, [job["comment_id"] for job in dead_jobs])
+    return {"requeued": requeued}
+
+@app.get("/ai/reply-cache/stats")
+async def get_reply_cache_stats(channel_id: str = Depends(get_current_channel_id)):
+    # Every hit is one Gemini call (and its latency) saved.
+    return reply_cache.stats(channel_id)
+
+@app.get("/webhooks/youtube")
+async def verify_youtube_webhook(request: Request):
+    # Hub verification of a (un)subscribe request: echo the challenge for channels we serve.
+    if not websub.WEBSUB_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload notifications are disabled")
+    params = request.query_params
+    channel_id = websub.channel_from_topic(params.get("hub.topic"))
+    if params.get("hub.mode") == "subscribe" and not await websub.is_known_channel(channel_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown topic")
+    return PlainTextResponse(params.get("hub.challenge", ""))
+
+@app.post("/webhooks/youtube")
+async def youtube_upload_notification(request: Request):
+    if not websub.WEBSUB_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload notifications are disabled")
+    body = await request.body()
+    if not websub.verify_signature(body, request.headers.get("X-Hub-Signature")):
+        # WebSub: a bad signature is acknowledged but ignored.
+        api_log.warning("websub.bad_signature")
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+    try:
+        entries = websub.parse_feed(body)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Atom feed: {e}")
+    queued = await websub.ingest(entries)
+    api_log.info("websub.notification", entries=len(entries), targets_queued=queued)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+@app.get("/youtube/quota")
+async def get_youtube_quota(client: YouTubeClient = Depends(get_youtube_client)):
+    # Quota units burned today (Pacific time, like Google's reset) for this user and project.
+    return await youtube_quota.snapshot(client.project_id, client.user_id)
+
+async def collect_metrics():
+    # Gauges that are cheap to read are sampled at scrape time.
+    for job_status, count in (await reply_queue.backlog_counts()).items():
+        metrics.REPLY_QUEUE_JOBS.set(count, status=job_status)
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    metrics.THREADPOOL_IN_USE.set(limiter.borrowed_tokens)
+    metrics.THREADPOOL_SIZE.set(limiter.total_tokens)
+    return metrics.expose()
+
+async def serve_metrics(reader, writer):
+    # Minimal HTTP responder for the metrics listener: every request gets the metrics page.
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = (await collect_metrics()).encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + f"Content-Type: {metrics.CONTENT_TYPE}; charset=utf-8\r\n".encode("ascii")
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+            + body
+        )
+        await writer.drain()
+    except Exception as e:
+        log.warning("metrics.serve_failed", error=str(e))
+    finally:
+        writer.close()
 
-    Generate the reply text only.
-    """
 
-    last_exc = None
-    for model_name in candidates:
-        try:
-            model = genai.GenerativeModel(model_name)
-            response = await run_in_threadpool(model.generate_content, prompt)
-            # response typically exposes `.text` on success
-            reply_text = getattr(response, 'text', None)
-            if not reply_text:
-                # try common response shapes
-                if hasattr(response, 'candidates') and response.candidates:
-                    try:
-                        reply_text = response.candidates[0].get('content') or response.candidates[0].get('text')
-                    except Exception:
-                        reply_text = str(response)
-                else:
-                    reply_text = str(response)
-
-            print(f"AI generated reply using model {model_name}")
-            return {"reply": reply_text.strip(), "model": model_name}
-        except Exception as e:
-            # keep last exception for reporting and try next model
-            last_exc = e
-            print(f"Model {model_name} failed: {e}")
+async def start_metrics_server(port, host=None):
+    # Metrics are kept off the public API port; this listener binds to METRICS_HOST.
+    return await asyncio.start_server(serve_metrics, host=host or METRICS_HOST, port=port)
 
-    # If we get here, none of the candidates worked
-    raise HTTPException(status_code=500, detail=f"AI generation failed: {last_exc}")
+@app.get("/ai/models/health")
+async def get_model_health(current_user: dict = Depends(get_current_user_db)):
+    # Breaker state and rolling latency/error rate per Gemini model, in routing order.
+    return ai_replies.model_router.snapshot()
 
 @app.post("/youtube/comments/rate")
-async def rate_youtube_comment(request: RateRequest, credentials: Credentials = Depends(get_current_user_credentials)):
+async def rate_youtube_comment(request: RateRequest, client: YouTubeClient = Depends(get_youtube_client)):
     try:
-        def do_rate():
-            youtube = build("youtube", "v3", credentials=credentials)
-            youtube.comments().rate(id=request.commentId, rating=request.rating).execute()
-            # The rate call does not return a body, so we return our own success message
-            return {"status": "success", "commentId": request.commentId, "rating": request.rating}
-        
-        response = await run_in_threadpool(do_rate)
-        return response
+        await client.execute(client.service.comments().rate(id=request.commentId, rating=request.rating))
+        # The rate call does not return a body, so we return our own success message
+        return {"status": "success", "commentId": request.commentId, "rating": request.rating}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to rate comment: {e}")
 
 
-@app.get("/youtube/video-stats/{video_id}")
-async def get_video_stats(video_id: str, credentials: Credentials = Depends(get_current_user_credentials)):
+async def video_status_counts(user_id, channel_id, video_ids):
+    # Grouping only on indexed fields lets user_channel_video_status_idx cover the query.
+    pipeline = [
+        {"$match": {"user_id": user_id, "channel_id": channel_id, "video_id": {"$in": list(video_ids)}}},
+        {"$project": {"_id": 0, "video_id": 1, "status": 1}},
+        {"$group": {"_id": {"video_id": "$video_id", "status": "$status"}, "count": {"$sum": 1}}},
+    ]
+    counts = {video_id: {} for video_id in video_ids}
+    async for row in db.comments.aggregate(pipeline):
+        counts.setdefault(row["_id"]["video_id"], {})[row["_id"]["status"]] = row["count"]
+    return counts
+
+
+def build_video_stats(statistics, status_counts):
+    replied_comments = status_counts.get(CommentStatus.REPLIED.value, 0)
+    tracked_comments = sum(status_counts.values())
+    success_rate = (replied_comments / tracked_comments * 100) if tracked_comments > 0 else 0
+    return {
+        "totalComments": int(statistics.get("commentCount", 0)),
+        "trackedComments": tracked_comments,
+        "repliedComments": replied_comments,
+        "pendingComments": status_counts.get(CommentStatus.PENDING.value, 0),
+        "failedReplies": status_counts.get(CommentStatus.FAILED.value, 0),
+        "successRate": round(success_rate, 2),
+        "viewCount": int(statistics.get("viewCount", 0)),
+        "likeCount": int(statistics.get("likeCount", 0)),
+    }
+
+
+async def fetch_video_stats(client, user_id, channel_id, video_ids):
+    # Lookups made at the same time (e.g. one per dashboard card) share multi-ID calls.
+    statistics = await video_statistics.load(client, video_ids)
+    counts = await video_status_counts(user_id, channel_id, statistics.keys())
+    return {video_id: build_video_stats(statistics[video_id], counts.get(video_id, {})) for video_id in statistics}
+
+
+def raise_for_google_error(e, context):
     try:
-        def fetch_stats():
-            youtube = build("youtube", "v3", credentials=credentials)
-            request = youtube.videos().list(part="statistics,snippet", id=video_id)
-            return request.execute()
+        error_details = json.loads(e.content.decode("utf-8"))["error"]
+    except Exception:
+        error_details = {"message": str(e)}
+    api_log.warning("google_api.error", context=context, status=getattr(e.resp, "status", None), details=error_details)
+    raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
 
-        response = await run_in_threadpool(fetch_stats)
-        items = response.get("items", [])
-        if not items:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found")
 
-        stats = items[0].get("statistics", {})
-        # Application-level metrics (replied/pending/failed) are app-specific; return placeholders
-        total_comments = int(stats.get("commentCount", 0))
+@app.get("/youtube/video-stats/{video_id}")
+async def get_video_stats(
+    request: Request,
+    video_id: str,
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id),
+    client: YouTubeClient = Depends(get_youtube_client)
+):
+    async def fetch():
+        try:
+            stats = await fetch_video_stats(client, str(user["_id"]), channel_id, [video_id])
+            if video_id not in stats:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Video not found")
+            return stats[video_id]
+        except HttpError as e:
+            raise_for_google_error(e, "video-stats")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
-        result = {
-            "totalComments": total_comments,
-            "repliedComments": 0,
-            "pendingComments": total_comments,
-            "failedReplies": 0,
-            "successRate": 0,
-        }
-        return result
-    except HttpError as e:
+    return await response_cache.respond(request, (str(user["_id"]), "video-stats", channel_id, video_id), fetch)
+
+
+@app.get("/youtube/video-stats")
+async def get_video_stats_batch(
+    request: Request,
+    ids: str,
+    user: dict = Depends(get_current_user_db),
+    channel_id: str = Depends(get_current_channel_id),
+    client: YouTubeClient = Depends(get_youtube_client)
+):
+    # Comma-separated video IDs; unknown videos are left out of the response.
+    video_ids = list(dict.fromkeys(video_id.strip() for video_id in ids.split(",") if video_id.strip()))
+    if not video_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No video IDs given")
+
+    async def fetch():
         try:
-            error_details = json.loads(e.content.decode("utf-8"))["error"]
-        except Exception:
-            error_details = {"message": str(e)}
-        print(f"Google API HttpError (video-stats): status={getattr(e.resp, 'status', 'unknown')} details={error_details}")
-        raise HTTPException(status_code=getattr(e.resp, 'status', 500), detail=f"Google API Error: {error_details.get('message')}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+            return await fetch_video_stats(client, str(user["_id"]), channel_id, video_ids)
+        except HttpError as e:
+            raise_for_google_error(e, "video-stats batch")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+    # The same set of IDs in any order is one cache entry.
+    return await response_cache.respond(
+        request, (str(user["_id"]), "video-stats-batch", channel_id, ",".join(sorted(video_ids))), fetch
+    )
 
 
 @app.get("/youtube/stats")
@@ -706,26 +1376,19 @@ async def get_youtube_stats(
     try:
         user_id = str(user["_id"])
 
-        total_comments = await db.comments.count_documents(
-            {"user_id": user_id, "channel_id": channel_id}
-        )
-        replied_comments = await db.comments.count_documents(
-            {"user_id": user_id, "channel_id": channel_id, "status": CommentStatus.REPLIED.value}
-        )
-        pending_comments = await db.comments.count_documents(
-            {"user_id": user_id, "channel_id": channel_id, "status": CommentStatus.PENDING.value}
-        )
-        failed_replies = await db.comments.count_documents(
-            {"user_id": user_id, "channel_id": channel_id, "status": CommentStatus.FAILED.value}
-        )
+        # Served from the per-day rollups the sweeper maintains, not from db.comments.
+        dashboard = await rollups.dashboard_stats(user_id, channel_id, [s.value for s in CommentStatus])
+        total_comments = dashboard["total"]
+        replied_comments = dashboard["by_status"][CommentStatus.REPLIED.value]
 
         success_rate = (replied_comments / total_comments * 100) if total_comments > 0 else 0
 
         return {
             "totalComments": total_comments,
             "repliedComments": replied_comments,
-            "pendingComments": pending_comments,
-            "failedReplies": failed_replies,
+            "pendingComments": dashboard["by_status"][CommentStatus.PENDING.value],
+            "failedReplies": dashboard["by_status"][CommentStatus.FAILED.value],
+            "skippedComments": dashboard["by_status"][CommentStatus.SKIPPED.value],
             "successRate": round(success_rate, 2),
         }
     except HTTPException:
@@ -740,54 +1403,18 @@ async def get_youtube_weekly_stats(
 ):
     try:
         user_id = str(user["_id"])
-        
-        # Define the last 7 days (including today)
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        pipeline = [
-            {"$match": {
-                "user_id": user_id,
-                "channel_id": channel_id,
-                "published_at": {"$gte": datetime.combine(today - timedelta(days=6), datetime.min.time())} # Last 7 days, start of day
-            }},
-            {"$group": {
-                "_id": { "$dayOfWeek": "$published_at" },
-                "total_comments": { "$sum": 1 },
-                "replied_comments": {
-                    "$sum": { "$cond": [{ "$eq": ["$status", CommentStatus.REPLIED.value] }, 1, 0] }
-                }
-            }},
-            {"$sort": { "_id": 1 }} # Sort by day of week (1=Sunday, 7=Saturday)
-        ]
 
-        weekly_data = await db.comments.aggregate(pipeline).to_list(length=None)
+        # Last 7 days (including today), oldest first, from the per-day rollups
+        dashboard = await rollups.dashboard_stats(user_id, channel_id, [s.value for s in CommentStatus])
 
-        # Map MongoDB dayOfWeek to desired day names and fill missing days
-        day_names = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
-        
-        # Create a dictionary for easier lookup
-        # MongoDB's $dayOfWeek returns 1 for Sunday, 2 for Monday, ..., 7 for Saturday
-        result_map = {item["_id"]: {"comments": item["total_comments"], "replies": item["replied_comments"]} for item in weekly_data}
-        
-        final_result = []
-        for i in range(7):
-            # Calculate the current day of the week, starting from today and going back 6 days
-            # Python's weekday() returns 0 for Monday, 6 for Sunday
-            # Adjust to match MongoDB's $dayOfWeek (Sunday=1, Monday=2, ...)
-            current_date = today - timedelta(days=6 - i)
-            mongo_day_of_week = (current_date.weekday() + 2) % 7 # +1 to make Monday=1, ..., +1 for Sunday=1 offset, then modulo 7. Sunday is 0 after this.
-            if mongo_day_of_week == 0:
-                mongo_day_of_week = 7 # Adjust Sunday from 0 to 7
-            
-            day_name = day_names[mongo_day_of_week - 1] # -1 to map 1-7 to 0-6 index for day_names
-
-            final_result.append({
-                "day": day_name,
-                "comments": result_map.get(mongo_day_of_week, {}).get("comments", 0),
-                "replies": result_map.get(mongo_day_of_week, {}).get("replies", 0),
-            })
-        
-        return final_result
+        return [
+            {
+                "day": day["date"].strftime("%a"),
+                "comments": day["total"],
+                "replies": day["counts"].get(CommentStatus.REPLIED.value, 0),
+            }
+            for day in dashboard["series"]
+        ]
 
     except HTTPException:
         raise
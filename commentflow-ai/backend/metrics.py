@@ -0,0 +1,169 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# In-process metrics in the Prometheus text format, served on a separate internal
+# listener (METRICS_PORT for the API, --metrics-port for sweepers), not the API port.
+#
+# Counters, gauges and histograms carry labels; values live in this process, so each
+# API or sweeper process exposes its own numbers and Prometheus sums them. Labels
+# take a bounded set of values: never user or channel IDs. Updates
+# take a lock because pymongo reports Mongo commands from its own threads.
+# `span(name)` times a block of code into the span_duration_seconds histogram.
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._sample_lines(key, value))
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _sample_lines(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+def expose():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics ---
+
+SWEEP_DURATION = Histogram("sweep_duration_seconds", "Duration of one user sweep.", ["kind"])
+SPAN_DURATION = Histogram("span_duration_seconds", "Duration of timed spans (sweep stages).", ["span"])
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "API request duration by route.", ["method", "route", "status"]
+)
+YOUTUBE_REQUESTS = Counter("youtube_requests_total", "YouTube Data API calls by method and outcome.", ["method", "outcome"])
+YOUTUBE_REQUEST_DURATION = Histogram("youtube_request_duration_seconds", "YouTube Data API call latency.", ["method"])
+GEMINI_REQUESTS = Counter("gemini_requests_total", "Gemini calls by model and outcome.", ["model", "outcome"])
+GEMINI_REQUEST_DURATION = Histogram("gemini_request_duration_seconds", "Gemini call latency.", ["model"])
+GEMINI_FALLBACKS = Counter("gemini_fallbacks_total", "Gemini calls retried on another model.", ["model"])
+MONGO_OPERATION_DURATION = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB command latency.", ["command", "outcome"]
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    "response_cache_requests_total", "Cached read endpoint responses by source.", ["endpoint", "result"]
+)
+COMMENTS = Counter("comments_total", "Comments ingested, replied to and failed.", ["event"])
+REPLY_QUEUE_JOBS = Gauge("reply_queue_jobs", "Reply jobs by status.", ["status"])
+PIPELINE_QUEUE_ITEMS = Gauge("pipeline_queue_items", "Items waiting in sweep pipeline queues.", ["stage"])
+THREADPOOL_IN_USE = Gauge("threadpool_threads_in_use", "Worker threads busy with blocking calls.")
+THREADPOOL_SIZE = Gauge("threadpool_threads_total", "Worker thread limit.")
+
+
+@contextmanager
+def span(name):
+    with SPAN_DURATION.time(span=name):
+        yield
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_OPERATION_DURATION.observe(event.duration_micros / 1e6, command=event.command_name, outcome="ok")
+
+    def failed(self, event):
+        MONGO_OPERATION_DURATION.observe(event.duration_micros / 1e6, command=event.command_name, outcome="error")
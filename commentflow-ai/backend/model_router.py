@@ -0,0 +1,170 @@
+import os
+import time
+from collections import OrderedDict, deque
+
+from fastapi.concurrency import run_in_threadpool
+
+import metrics
+from log import get_logger
+
+# Per-model circuit breakers and latency tracking for Gemini calls.
+#
+# Every call is routed to the healthiest fast model first instead of always walking
+# the candidate list in order. A model whose breaker is open is skipped until its
+# cooldown expires; it is then half-open and gets a single probe call, which closes
+# the breaker on success or re-opens it with a longer cooldown on failure.
+
+MODEL_STATS_WINDOW = int(os.getenv("MODEL_STATS_WINDOW", "50"))
+MODEL_FAILURE_THRESHOLD = int(os.getenv("MODEL_FAILURE_THRESHOLD", "3"))
+MODEL_ERROR_RATE_THRESHOLD = float(os.getenv("MODEL_ERROR_RATE_THRESHOLD", "0.5"))
+MODEL_COOLDOWN_SECONDS = float(os.getenv("MODEL_COOLDOWN_SECONDS", "30"))
+MODEL_MAX_COOLDOWN_SECONDS = float(os.getenv("MODEL_MAX_COOLDOWN_SECONDS", "600"))
+# Model instances kept, one per (model, system instruction).
+MODEL_INSTANCE_CACHE_SIZE = int(os.getenv("MODEL_INSTANCE_CACHE_SIZE", "256"))
+
+log = get_logger("ai")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class NoModelAvailable(Exception):
+    pass
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ModelHealth:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = MODEL_COOLDOWN_SECONDS
+        self.retry_at = 0.0
+        self.probe_in_flight = False
+        self.latencies = deque(maxlen=MODEL_STATS_WINDOW)
+        self.outcomes = deque(maxlen=MODEL_STATS_WINDOW)
+
+    @property
+    def error_rate(self):
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def available(self, now):
+        if self.state == OPEN and now >= self.retry_at:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.probe_in_flight
+        return self.state == CLOSED
+
+    def rank(self):
+        # Healthy before degraded, then fastest measured p50, then configured priority;
+        # unmeasured models sort after measured ones so a known-good model is kept.
+        p50 = _percentile(self.latencies, 0.5)
+        degraded = len(self.outcomes) >= 5 and self.error_rate >= MODEL_ERROR_RATE_THRESHOLD
+        return (degraded, p50 if p50 is not None else float("inf"), self.priority)
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.cooldown = MODEL_COOLDOWN_SECONDS
+
+    def record_failure(self, now):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            # Failed probe: stay away for longer next time.
+            self.cooldown = min(self.cooldown * 2, MODEL_MAX_COOLDOWN_SECONDS)
+            self._open(now)
+        elif self.consecutive_failures >= MODEL_FAILURE_THRESHOLD or (
+            len(self.outcomes) >= 5 and self.error_rate >= MODEL_ERROR_RATE_THRESHOLD
+        ):
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.retry_at = now + self.cooldown
+
+    def snapshot(self):
+        p50 = _percentile(self.latencies, 0.5)
+        p95 = _percentile(self.latencies, 0.95)
+        return {
+            "model": self.name,
+            "state": self.state,
+            "p50Ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95Ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "errorRate": round(self.error_rate, 3),
+            "samples": len(self.outcomes),
+            "retryInSeconds": max(0.0, round(self.retry_at - time.monotonic(), 1)) if self.state == OPEN else 0,
+        }
+
+
+class ModelRouter:
+    def __init__(self, candidates, model_factory):
+        # `model_factory(name, system_instruction)` builds a model; instances are created
+        # once per system instruction and reused. Health is tracked per model name.
+        self.model_factory = model_factory
+        self.health = {name: ModelHealth(name, priority) for priority, name in enumerate(candidates)}
+        self._models = OrderedDict()
+
+    def model(self, name, system_instruction=None):
+        key = (name, system_instruction)
+        model = self._models.get(key)
+        if model is None:
+            model = self.model_factory(name, system_instruction)
+            self._models[key] = model
+            while len(self._models) > MODEL_INSTANCE_CACHE_SIZE:
+                self._models.popitem(last=False)
+        self._models.move_to_end(key)
+        return model
+
+    def route(self):
+        now = time.monotonic()
+        return sorted(
+            (health for health in self.health.values() if health.available(now)),
+            key=lambda health: health.rank(),
+        )
+
+    async def generate(self, prompt, system_instruction=None, **kwargs):
+        # Returns (response, model name), trying models in routing order.
+        last_exc = None
+        for health in self.route():
+            if last_exc is not None:
+                metrics.GEMINI_FALLBACKS.inc(model=health.name)
+            probing = health.state == HALF_OPEN
+            if probing:
+                health.probe_in_flight = True
+            started = time.monotonic()
+            try:
+                response = await run_in_threadpool(self.model(health.name, system_instruction).generate_content, prompt, **kwargs)
+            except Exception as e:
+                # keep last exception for reporting and try next model
+                last_exc = e
+                health.record_failure(time.monotonic())
+                metrics.GEMINI_REQUESTS.inc(model=health.name, outcome="error")
+                metrics.GEMINI_REQUEST_DURATION.observe(time.monotonic() - started, model=health.name)
+                log.warning("ai.model_failed", model=health.name, state=health.state, error=str(e))
+                continue
+            else:
+                latency = time.monotonic() - started
+                health.record_success(latency)
+                metrics.GEMINI_REQUESTS.inc(model=health.name, outcome="ok")
+                metrics.GEMINI_REQUEST_DURATION.observe(latency, model=health.name)
+                return response, health.name
+            finally:
+                if probing:
+                    health.probe_in_flight = False
+        if last_exc is None:
+            raise NoModelAvailable("All models are unavailable (circuit breakers open)")
+        raise last_exc
+
+    def snapshot(self):
+        return [health.snapshot() for health in sorted(self.health.values(), key=lambda health: health.rank())]
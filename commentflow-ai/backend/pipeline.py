@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+import metrics
+from log import get_logger
+
+# Bounded streaming pipeline: a source async iterable feeds a chain of stages through
+# bounded queues. A full queue blocks the stage before it, so a slow stage (usually
+# replying) throttles fetching and memory stays flat however many items flow through.
+# An item a stage fails on is dropped so the queues keep moving, but the run then
+# ends with StageFailed, so callers never treat a partial run as complete.
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+log = get_logger("pipeline")
+
+_DONE = object()
+
+
+class StageFailed(Exception):
+    # Raised by run_pipeline after draining when stages failed on some items.
+    def __init__(self, failures, error):
+        # `failures` counts failed items per stage name; `error` is the first failure.
+        self.failures = failures
+        self.error = error
+        summary = ", ".join(f"{stage}: {count}" for stage, count in failures.items())
+        super().__init__(f"Pipeline stages failed ({summary}): {error}")
+
+
+async def run_pipeline(source, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    # `stages` is a list of (handler, workers). Each handler is awaited as
+    # `handler(item, emit)` and calls `await emit(value)` to pass values on to the
+    # next stage; the last stage's handler never emits.
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    names = [getattr(handler, "__name__", str(index)) for index, (handler, _) in enumerate(stages)]
+    failures = {}
+    errors = []
+
+    async def put(index, value):
+        await queues[index].put(value)
+        metrics.PIPELINE_QUEUE_ITEMS.inc(stage=names[index])
+
+    async def worker(index, handler):
+        inbox = queues[index]
+
+        async def emit(value):
+            if index + 1 >= len(queues):
+                raise RuntimeError("The last pipeline stage cannot emit values")
+            await put(index + 1, value)
+
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            metrics.PIPELINE_QUEUE_ITEMS.inc(-1, stage=names[index])
+            try:
+                with metrics.span(f"pipeline.{names[index]}"):
+                    await handler(item, emit)
+            except Exception as e:
+                # A failing item must not stall the queues feeding this stage.
+                log.warning("pipeline.stage_failed", stage=names[index], error=str(e))
+                failures[names[index]] = failures.get(names[index], 0) + 1
+                errors.append(e)
+
+    stage_tasks = [
+        [asyncio.create_task(worker(index, handler)) for _ in range(max(1, workers))]
+        for index, (handler, workers) in enumerate(stages)
+    ]
+
+    source_error = None
+    try:
+        try:
+            async for item in source:
+                await put(0, item)
+        except Exception as e:
+            # Let the items already queued drain before surfacing the error.
+            source_error = e
+
+        # Shut stages down in order so every queued item is handled exactly once.
+        for index, tasks in enumerate(stage_tasks):
+            for _ in tasks:
+                await queues[index].put(_DONE)
+            await asyncio.gather(*tasks)
+    except BaseException:
+        for tasks in stage_tasks:
+            for task in tasks:
+                task.cancel()
+        # Items abandoned in the queues no longer count as waiting.
+        for index, queue in enumerate(queues):
+            while not queue.empty():
+                if queue.get_nowait() is not _DONE:
+                    metrics.PIPELINE_QUEUE_ITEMS.inc(-1, stage=names[index])
+        raise
+
+    if source_error is not None:
+        raise source_error
+    if failures:
+        raise StageFailed(failures, errors[0])
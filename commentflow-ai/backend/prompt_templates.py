@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from database import db
+
+# Reply prompts compiled from per-channel persona settings.
+#
+# A channel's persona (tone, a short description of the creator, extra rules and a
+# reply length limit) is stored in db.channel_settings. It is compiled once into a
+# PromptTemplate whose fixed instructions are sent as the model's system instruction,
+# so each Gemini call only carries the comment, or the JSON array of comments, itself.
+# Compiled templates are cached by content, so channels with identical personas share
+# one, and the model router keeps one model instance per system instruction.
+
+PROMPT_TEMPLATE_CACHE_SIZE = int(os.getenv("PROMPT_TEMPLATE_CACHE_SIZE", "1000"))
+PERSONA_TTL_SECONDS = float(os.getenv("PERSONA_TTL_SECONDS", "60"))
+
+TONES = {
+    "friendly": "a friendly and appreciative YouTube creator",
+    "professional": "a professional and courteous YouTube creator",
+    "casual": "a casual, laid-back YouTube creator",
+}
+
+DEFAULT_PERSONA = {
+    "tone": "friendly",
+    # A few sentences about the creator and the channel, in the creator's words.
+    "description": "",
+    "rules": [],
+    "max_reply_length": 500,
+}
+
+REPLY_GUIDELINES = [
+    "First, detect the language of the comment (e.g., English, Telugu, Hindi). Your reply MUST be in the same "
+    "language as the comment.",
+    "No commitments: do NOT make any promises or commitments about future videos or content. If a user asks about "
+    "the next video, give a friendly, non-committal answer like \"I'm working on it, stay tuned!\" or \"Thanks for "
+    "the suggestion, I'll keep it in mind!\".",
+]
+
+REPLY_STYLE = [
+    "If the comment is positive (e.g., \"Great video!\", \"I learned so much\"), express gratitude and acknowledge "
+    "the compliment.",
+    "If the comment is a question, provide a helpful and concise answer, but without making promises.",
+    "If the comment is negative or critical, respond politely and professionally.",
+    "Keep the reply authentic and avoid generic phrases.",
+]
+
+BATCH_FORMAT = (
+    "Respond with ONLY a JSON array containing exactly one object per comment, in the form "
+    "[{\"id\": \"<comment id>\", \"reply\": \"<reply text>\"}]. Use the ids exactly as given."
+)
+
+_templates = OrderedDict()
+_personas = {}
+
+
+class PromptTemplate:
+    def __init__(self, persona):
+        tone = TONES.get(persona["tone"], TONES["friendly"])
+        intro = [f"You are {tone}, replying to comments on your own channel."]
+        if persona["description"]:
+            intro.append(f"About you and your channel: {persona['description']}")
+        guidelines = REPLY_GUIDELINES + list(persona["rules"])
+        style = REPLY_STYLE + [f"Keep every reply under {persona['max_reply_length']} characters."]
+
+        def instruction(task, extra_guidelines, output):
+            numbered = "\n".join(f"{index}. {rule}" for index, rule in enumerate(guidelines + extra_guidelines, 1))
+            bullets = "\n".join(f"- {rule}" for rule in style)
+            return "\n".join(intro + [task, "", "IMPORTANT INSTRUCTIONS:", numbered, "", bullets, "", output])
+
+        self.single_instruction = instruction(
+            "Write a short and engaging reply to the comment you are given, based on its content and sentiment.",
+            [],
+            "Generate the reply text only.",
+        )
+        self.batch_instruction = instruction(
+            "Write a short and engaging reply to each comment in the JSON array you are given, each based on the "
+            "content and sentiment of its own comment.",
+            ["Every instruction applies to each comment separately; detect the language of each comment on its own."],
+            BATCH_FORMAT,
+        )
+
+    def single_prompt(self, comment_text):
+        return f'Comment: "{comment_text}"'
+
+    def batch_prompt(self, comments):
+        payload = json.dumps([{"id": comment["id"], "text": comment["text"]} for comment in comments], ensure_ascii=False)
+        return f'Comments (JSON array of objects with "id" and "text"):\n{payload}\n'
+
+
+def compile_template(persona):
+    persona = {**DEFAULT_PERSONA, **persona}
+    key = hashlib.sha1(json.dumps(persona, sort_keys=True).encode("utf-8")).hexdigest()
+    template = _templates.get(key)
+    if template is None:
+        template = PromptTemplate(persona)
+        _templates[key] = template
+        while len(_templates) > PROMPT_TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    _templates.move_to_end(key)
+    return template
+
+
+DEFAULT_TEMPLATE = compile_template(DEFAULT_PERSONA)
+
+
+def _settings_key(user_id, channel_id):
+    return f"{user_id}:{channel_id}"
+
+
+async def get_persona(user_id, channel_id):
+    # Cached for PERSONA_TTL_SECONDS per process.
+    key = _settings_key(user_id, channel_id)
+    cached = _personas.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    doc = await db.channel_settings.find_one({"_id": key}, {"persona": 1}) or {}
+    persona = {**DEFAULT_PERSONA, **doc.get("persona", {})}
+    _personas[key] = (persona, time.monotonic() + PERSONA_TTL_SECONDS)
+    return persona
+
+
+async def get_template(user_id, channel_id):
+    return compile_template(await get_persona(user_id, channel_id))
+
+
+async def save_persona(user_id, channel_id, changes):
+    key = _settings_key(user_id, channel_id)
+    await db.channel_settings.update_one(
+        {"_id": key},
+        {"$set": {"user_id": user_id, "channel_id": channel_id, **{f"persona.{name}": value for name, value in changes.items()}}},
+        upsert=True,
+    )
+    _personas.pop(key, None)
+    return await get_persona(user_id, channel_id)
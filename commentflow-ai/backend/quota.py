@@ -0,0 +1,380 @@
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from log import get_logger
+
+# Cost-weighted YouTube Data API quota limiter.
+#
+# Every request is charged its quota cost (list calls 1 unit, writes such as
+# comments.insert 50) against two token buckets: one for the Google project (the
+# OAuth client the credentials belong to) and one for the user. Buckets hold a slice
+# of the daily quota and refill so that a rolling day never spends more than it.
+# Reads must leave a reserve in the buckets, so as quota runs low the remaining units
+# go to replies. A 403 quotaExceeded from Google empties the project bucket until the
+# daily reset (midnight Pacific time); rate-limit errors back the user off.
+#
+# The buckets live in db.youtube_quota, one document per project and per user, so
+# every instance (API processes and sweepers) spends from the same budget and a
+# restart does not hand out a fresh bucket. Instances do not go to MongoDB for each
+# call: they lease QUOTA_LEASE_UNITS at a time with one conditional update that
+# refills the bucket and takes the units only if it holds enough, spend them locally,
+# and lease the next chunk in the background once half is gone. Unspent units go back
+# on shutdown; a crash loses at most one chunk per bucket. Units burned per Pacific
+# day are counted locally and written to db.youtube_quota_usage along with the
+# leases, and kept for QUOTA_USAGE_RETENTION_DAYS. A block reaches other instances
+# when they next lease units.
+
+YOUTUBE_PROJECT_DAILY_QUOTA = int(os.getenv("YOUTUBE_PROJECT_DAILY_QUOTA", "10000"))
+YOUTUBE_USER_DAILY_QUOTA = int(os.getenv("YOUTUBE_USER_DAILY_QUOTA", "5000"))
+# Share of the daily quota that may be spent in one burst.
+QUOTA_BURST_FRACTION = float(os.getenv("QUOTA_BURST_FRACTION", "0.1"))
+# Share of each bucket that only writes may use.
+QUOTA_WRITE_RESERVE_FRACTION = float(os.getenv("QUOTA_WRITE_RESERVE_FRACTION", "0.5"))
+# Requests that would wait longer than this for quota fail with QuotaExhausted instead.
+QUOTA_MAX_WAIT_SECONDS = float(os.getenv("QUOTA_MAX_WAIT_SECONDS", "30"))
+QUOTA_BACKOFF_SECONDS = float(os.getenv("QUOTA_BACKOFF_SECONDS", "30"))
+QUOTA_MAX_BACKOFF_SECONDS = float(os.getenv("QUOTA_MAX_BACKOFF_SECONDS", "900"))
+# Units an instance takes from a shared bucket at a time.
+QUOTA_LEASE_UNITS = float(os.getenv("QUOTA_LEASE_UNITS", "100"))
+QUOTA_USAGE_RETENTION_DAYS = int(os.getenv("QUOTA_USAGE_RETENTION_DAYS", "30"))
+
+log = get_logger("quota")
+
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    "youtube.comments.insert": 50,
+    "youtube.comments.update": 50,
+    "youtube.comments.delete": 50,
+    "youtube.comments.markAsSpam": 50,
+    "youtube.comments.setModerationStatus": 50,
+    "youtube.commentThreads.insert": 50,
+    "youtube.videos.rate": 50,
+    "youtube.videos.update": 50,
+    "youtube.search.list": 100,
+}
+DEFAULT_QUOTA_COST = 1
+
+DAILY_QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+class QuotaExhausted(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def quota_cost(method_id):
+    return QUOTA_COSTS.get(method_id, DEFAULT_QUOTA_COST)
+
+
+def is_write(method_id):
+    return not (method_id or "").endswith(".list")
+
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+def seconds_until_reset():
+    now = datetime.now(QUOTA_TIMEZONE)
+    reset = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (reset - now).total_seconds()
+
+
+class TokenBucket:
+    def __init__(self, daily_quota, state=None, now=None):
+        # `state` is a stored bucket (see `state()`); a missing one starts full.
+        # Times are wall-clock seconds, as instances share the state.
+        self.capacity = max(daily_quota * QUOTA_BURST_FRACTION, 2 * max(QUOTA_COSTS.values()))
+        # Refill leaves room for the initial burst, so a rolling day stays within quota.
+        self.rate = max(daily_quota - self.capacity, daily_quota * 0.01) / 86400
+        state = state or {}
+        self.tokens = state.get("tokens", self.capacity)
+        self.updated = state.get("updated", time.time() if now is None else now)
+        self.blocked_until = state.get("blocked_until", 0.0)
+        self.failures = state.get("failures", 0)
+
+    def state(self):
+        return {"tokens": self.tokens, "updated": self.updated, "blocked_until": self.blocked_until, "failures": self.failures}
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def needed(self, cost, write):
+        return cost if write else cost + self.capacity * QUOTA_WRITE_RESERVE_FRACTION
+
+    def wait_time(self, cost, write, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        needed = self.needed(cost, write)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= cost
+        self.failures = 0
+
+    def block(self, now, seconds, drain=False):
+        # Only an exhausted daily quota drains the bucket; after a rate-limit backoff
+        # the tokens saved up are still good.
+        if drain:
+            self._refill(now)
+            self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def _refilled(self, now):
+        # _refill() as a MongoDB expression on the stored document.
+        elapsed = {"$max": [0.0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}
+        return {"$min": [self.capacity, {"$add": [{"$ifNull": ["$tokens", self.capacity]}, {"$multiply": [elapsed, self.rate]}]}]}
+
+    def take_filter(self, cost, write, now):
+        # Matches the stored bucket when wait_time(cost, write, now) would be 0.
+        return {"$expr": {"$and": [
+            {"$lte": [{"$ifNull": ["$blocked_until", 0.0]}, now]},
+            {"$gte": [self._refilled(now), self.needed(cost, write)]},
+        ]}}
+
+    def take_update(self, cost, now):
+        # _refill() and take() as one update pipeline.
+        return [{"$set": {
+            "tokens": {"$subtract": [self._refilled(now), cost]},
+            "updated": {"$max": [{"$ifNull": ["$updated", now]}, now]},
+            "failures": 0,
+        }}]
+
+
+def _method_field(method_id):
+    # Method IDs are dotted, which Mongo would read as a path.
+    return method_id.replace(".", ":")
+
+
+class _Lease:
+    # Units one instance took from a shared bucket and has not spent yet, and the burn
+    # it has not written to the usage collection.
+    def __init__(self, scope, key, daily_quota):
+        self.scope = scope
+        self.key = key
+        self.daily_quota = daily_quota
+        self.doc_id = f"{scope}:{key}"
+        self.units = 0.0
+        self.blocked_until = 0.0
+        self.burn = defaultdict(Counter)
+        self.created = False
+        self.lock = asyncio.Lock()
+        self.refill_task = None
+
+    def take(self, cost, count, method_id):
+        self.units -= cost
+        burn = self.burn[quota_day()]
+        burn["units"] += cost
+        burn["requests"] += count
+        burn[f"by_method.{_method_field(method_id)}"] += cost
+
+
+class QuotaManager:
+    def __init__(self, collection=None, usage_collection=None, lease_units=QUOTA_LEASE_UNITS):
+        self.collection = collection if collection is not None else db.youtube_quota
+        self.usage = usage_collection if usage_collection is not None else db.youtube_quota_usage
+        self.lease_units = lease_units
+        self._leases = {}
+
+    def _lease(self, scope, key):
+        lease = self._leases.get((scope, key))
+        if lease is None:
+            daily_quota = YOUTUBE_PROJECT_DAILY_QUOTA if scope == "project" else YOUTUBE_USER_DAILY_QUOTA
+            lease = self._leases[(scope, key)] = _Lease(scope, key, daily_quota)
+        return lease
+
+    async def _create(self, lease):
+        if lease.created:
+            return
+        try:
+            await self.collection.update_one(
+                {"_id": lease.doc_id},
+                {"$setOnInsert": {"scope": lease.scope, "key": lease.key, **TokenBucket(lease.daily_quota).state()}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Created by another instance at the same moment.
+            pass
+        lease.created = True
+
+    async def _refill(self, lease, cost, write):
+        # Leases units from the shared bucket until `cost` are here; returns 0 then, or
+        # the seconds until the bucket can spare them.
+        async with lease.lock:
+            needed = cost - lease.units
+            if needed <= 0:
+                return 0.0
+            await self._create(lease)
+            bucket = TokenBucket(lease.daily_quota)
+            # A whole chunk if the bucket has it, else just what this call needs.
+            for amount in dict.fromkeys((max(needed, self.lease_units), needed)):
+                now = time.time()
+                result = await self.collection.update_one(
+                    {"_id": lease.doc_id, **bucket.take_filter(amount, write, now)}, bucket.take_update(amount, now)
+                )
+                if result.matched_count:
+                    lease.units += amount
+                    return 0.0
+            now = time.time()
+            bucket = TokenBucket(lease.daily_quota, await self.collection.find_one({"_id": lease.doc_id}), now)
+            lease.blocked_until = max(lease.blocked_until, bucket.blocked_until)
+            # Zero means the bucket refilled since the update; try again shortly.
+            return bucket.wait_time(needed, write, now) or 0.01
+
+    def _refill_soon(self, lease):
+        if lease.units >= self.lease_units / 2 or (lease.refill_task and not lease.refill_task.done()):
+            return
+        lease.refill_task = asyncio.create_task(self._prefetch(lease))
+
+    async def _prefetch(self, lease):
+        # Leases like a read, so it leaves the write reserve alone and never takes the
+        # last units of a bucket from other instances.
+        try:
+            await self._refill(lease, self.lease_units, write=False)
+            await self._flush(lease)
+        except Exception as e:
+            # The next call that runs short leases the units itself.
+            log.warning("quota.refill_failed", bucket=lease.doc_id, error=str(e))
+
+    async def _flush(self, lease):
+        # Writes the burn counted since the last flush to the usage collection.
+        burn, lease.burn = lease.burn, defaultdict(Counter)
+        operations = [
+            UpdateOne(
+                {"_id": f"{lease.doc_id}:{day}"},
+                {
+                    "$inc": dict(counts),
+                    "$setOnInsert": {"scope": lease.scope, "key": lease.key, "day": day, "created_at": datetime.utcnow()},
+                },
+                upsert=True,
+            )
+            for day, counts in burn.items() if counts
+        ]
+        if not operations:
+            return
+        try:
+            await self.usage.bulk_write(operations, ordered=False)
+        except Exception:
+            # Keep the counts for the next flush.
+            for day, counts in burn.items():
+                lease.burn[day].update(counts)
+            raise
+
+    async def acquire(self, project_id, user_id, method_id, max_wait=QUOTA_MAX_WAIT_SECONDS, count=1):
+        # Charges `count` requests of `method_id` at once, e.g. the parts of a batch call.
+        cost = quota_cost(method_id) * count
+        write = is_write(method_id)
+        leases = (self._lease("project", project_id), self._lease("user", user_id))
+        waited = 0.0
+        while True:
+            now = time.time()
+            wait = max(0.0, *(lease.blocked_until - now for lease in leases))
+            if not wait:
+                short = [lease for lease in leases if lease.units < cost]
+                if not short:
+                    for lease in leases:
+                        lease.take(cost, count, method_id)
+                        self._refill_soon(lease)
+                    return cost
+                # Units leased for one bucket while the other is out stay here for the next call.
+                wait = max(await asyncio.gather(*(self._refill(lease, cost, write) for lease in short)))
+                if not wait:
+                    continue
+            if waited + wait > max_wait:
+                raise QuotaExhausted(
+                    f"YouTube quota exhausted for {method_id} ({cost} units); retry in {wait:.0f}s", wait
+                )
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def report_error(self, project_id, user_id, reasons):
+        # Called with the error reasons of a 403 from Google; returns True if it was a quota error.
+        if DAILY_QUOTA_REASONS & set(reasons):
+            retry_after = seconds_until_reset()
+            log.error("quota.daily_exceeded", project_id=project_id, resets_in_s=round(retry_after))
+            lease = self._lease("project", project_id)
+            await self._create(lease)
+            now = time.time()
+            await self.collection.update_one(
+                {"_id": lease.doc_id},
+                {"$set": {"tokens": 0.0, "updated": now}, "$max": {"blocked_until": now + retry_after}},
+            )
+            lease.units = 0.0
+            lease.blocked_until = max(lease.blocked_until, now + retry_after)
+            return True
+        if RATE_LIMIT_REASONS & set(reasons):
+            lease = self._lease("user", user_id)
+            await self._create(lease)
+            doc = await self.collection.find_one_and_update(
+                {"_id": lease.doc_id}, {"$inc": {"failures": 1}}, return_document=ReturnDocument.AFTER
+            )
+            backoff = min(QUOTA_BACKOFF_SECONDS * (2 ** (doc["failures"] - 1)), QUOTA_MAX_BACKOFF_SECONDS)
+            now = time.time()
+            await self.collection.update_one({"_id": lease.doc_id}, {"$max": {"blocked_until": now + backoff}})
+            lease.blocked_until = max(lease.blocked_until, now + backoff)
+            log.warning("quota.rate_limited", user_id=user_id, backoff_s=round(backoff))
+            return True
+        return False
+
+    async def _bucket_snapshot(self, scope, key):
+        lease = self._lease(scope, key)
+        await self._flush(lease)
+        now = time.time()
+        bucket = TokenBucket(lease.daily_quota, await self.collection.find_one({"_id": lease.doc_id}), now)
+        bucket._refill(now)
+        usage = await self.usage.find_one({"_id": f"{lease.doc_id}:{quota_day()}"}) or {}
+        return {
+            "dailyQuota": lease.daily_quota,
+            "usedToday": usage.get("units", 0),
+            "requestsToday": usage.get("requests", 0),
+            "usedByMethod": {field.replace(":", "."): units for field, units in usage.get("by_method", {}).items()},
+            # Units leased here are still available to this instance.
+            "available": round(bucket.tokens + lease.units, 1),
+            "burstCapacity": round(bucket.capacity, 1),
+            "blockedForSeconds": round(max(0.0, bucket.blocked_until - now, lease.blocked_until - now), 1),
+        }
+
+    async def snapshot(self, project_id, user_id):
+        return {
+            "project": await self._bucket_snapshot("project", project_id),
+            "user": await self._bucket_snapshot("user", user_id),
+            "resetsInSeconds": round(seconds_until_reset()),
+        }
+
+    async def close(self):
+        # Gives unspent units back to the shared buckets and writes the remaining burn.
+        tasks = [lease.refill_task for lease in self._leases.values() if lease.refill_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for lease in self._leases.values():
+            if lease.units > 0:
+                # Refill caps the tokens at the bucket's capacity again.
+                await self.collection.update_one({"_id": lease.doc_id}, {"$inc": {"tokens": lease.units}})
+                lease.units = 0.0
+            await self._flush(lease)
+
+
+async def ensure_indexes():
+    await youtube_quota.usage.create_index(
+        [("created_at", 1)], name="created_ttl_idx", expireAfterSeconds=QUOTA_USAGE_RETENTION_DAYS * 86400
+    )
+
+
+youtube_quota = QuotaManager()
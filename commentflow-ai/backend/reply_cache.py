@@ -0,0 +1,166 @@
+import html
+import os
+import random
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+
+# Reply cache for duplicate and near-duplicate comments ("Great video!", "first",
+# "nice 🔥", emoji-only ...).
+#
+# Short comments are reduced to a similarity key: the script they are written in
+# (a cheap stand-in for language), whether they ask a question, and their normalized
+# tokens, so case, punctuation and repeated letters/emoji do not matter. Comments
+# match an entry with the same script and question-ness whose character 3-gram
+# shingles overlap by at least AI_REPLY_CACHE_SIMILARITY (Jaccard), so "great video"
+# also finds "great video bro" and "video was great"; an inverted index over the
+# shingles keeps that to the entries sharing some of them. Each entry holds a small
+# pool of generated replies; once the pool is full, further matches reuse a random
+# reply from it instead of calling Gemini, so reused answers vary.
+
+AI_REPLY_CACHE_SIZE = int(os.getenv("AI_REPLY_CACHE_SIZE", "5000"))
+AI_REPLY_CACHE_TTL_SECONDS = float(os.getenv("AI_REPLY_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+AI_REPLY_CACHE_POOL_SIZE = int(os.getenv("AI_REPLY_CACHE_POOL_SIZE", "3"))
+# Longer comments say something specific and always get their own reply.
+AI_REPLY_CACHE_MAX_CHARS = int(os.getenv("AI_REPLY_CACHE_MAX_CHARS", "40"))
+AI_REPLY_CACHE_SIMILARITY = float(os.getenv("AI_REPLY_CACHE_SIMILARITY", "0.6"))
+
+SHINGLE_SIZE = 3
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_REPEAT_RE = re.compile(r"(.)\1{2,}")
+
+
+def _script(text):
+    # Name of the Unicode script of the first letter, e.g. LATIN, TELUGU, DEVANAGARI.
+    for char in text:
+        if char.isalpha():
+            return unicodedata.name(char, "UNKNOWN").split(" ")[0]
+    return "NONE"
+
+
+def similarity_key(text):
+    text = html.unescape(_TAG_RE.sub(" ", text)).lower()
+    # Drop emoji variation selectors and joiners so "🔥" and "🔥\ufe0f" match.
+    text = unicodedata.normalize("NFKC", text).replace("\ufe0f", "").replace("\u200d", "")
+    text = _REPEAT_RE.sub(r"\1\1", text)
+    if len(text.strip()) > AI_REPLY_CACHE_MAX_CHARS:
+        return None
+    tokens = []
+    for word in text.split():
+        # Emoji and other symbols count one by one; other punctuation carries no meaning.
+        letters = "".join(char for char in word if not unicodedata.category(char).startswith(("P", "S")))
+        symbols = [char for char in word if unicodedata.category(char).startswith("S")]
+        for token in ([letters] if letters else []) + symbols:
+            # "🔥🔥" and "🔥" say the same thing.
+            if not tokens or tokens[-1] != token:
+                tokens.append(token)
+    if not tokens:
+        return None
+    question = "?" if "?" in text else ""
+    return f"{_script(text)}|{question}|{' '.join(tokens)}"
+
+
+def shingles(key):
+    # Character n-grams of the key's tokens, padded so word starts and ends count.
+    text = f" {key.split('|', 2)[2]} "
+    return frozenset(text[index:index + SHINGLE_SIZE] for index in range(max(1, len(text) - SHINGLE_SIZE + 1)))
+
+
+def _group(key):
+    # Script and question-ness must match exactly.
+    return key.rsplit("|", 1)[0]
+
+
+class ReplyCache:
+    def __init__(self, max_entries=AI_REPLY_CACHE_SIZE, ttl=AI_REPLY_CACHE_TTL_SECONDS, pool_size=AI_REPLY_CACHE_POOL_SIZE,
+                 similarity=AI_REPLY_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # (channel_id, group) -> shingle -> keys of the entries containing it.
+        self._index = defaultdict(lambda: defaultdict(set))
+        self._stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+    def _find(self, channel_id, key):
+        # The entry for `key` itself, else the most similar one above the threshold.
+        if (channel_id, key) in self._entries:
+            return key
+        key_shingles = shingles(key)
+        index = self._index.get((channel_id, _group(key)))
+        if not index:
+            return None
+        shared = Counter()
+        for shingle in key_shingles:
+            shared.update(index.get(shingle, ()))
+        best, best_similarity = None, self.similarity
+        for candidate, overlap in shared.items():
+            similarity = overlap / (len(key_shingles) + len(self._entries[(channel_id, candidate)]["shingles"]) - overlap)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def _remove(self, channel_id, key):
+        entry = self._entries.pop((channel_id, key))
+        index = self._index[(channel_id, _group(key))]
+        for shingle in entry["shingles"]:
+            index[shingle].discard(key)
+            if not index[shingle]:
+                del index[shingle]
+
+    def lookup(self, channel_id, text):
+        key = similarity_key(text)
+        if key is None:
+            return None
+        match = self._find(channel_id, key)
+        entry = self._entries.get((channel_id, match)) if match else None
+        if entry is not None and time.monotonic() - entry["created_at"] > self.ttl:
+            self._remove(channel_id, match)
+            entry = None
+        if entry is None or len(entry["replies"]) < self.pool_size:
+            self._stats[channel_id]["misses"] += 1
+            return None
+        self._entries.move_to_end((channel_id, match))
+        self._stats[channel_id]["hits"] += 1
+        return random.choice(entry["replies"])
+
+    def store(self, channel_id, text, reply):
+        key = similarity_key(text)
+        if key is None or not reply:
+            return
+        # Replies to near duplicates fill the pool of the entry they match.
+        match = self._find(channel_id, key)
+        if match is None:
+            match = key
+            entry = {"replies": [], "created_at": time.monotonic(), "shingles": shingles(key)}
+            self._entries[(channel_id, key)] = entry
+            index = self._index[(channel_id, _group(key))]
+            for shingle in entry["shingles"]:
+                index[shingle].add(key)
+        entry = self._entries[(channel_id, match)]
+        self._entries.move_to_end((channel_id, match))
+        if len(entry["replies"]) < self.pool_size and reply not in entry["replies"]:
+            entry["replies"].append(reply)
+        while len(self._entries) > self.max_entries:
+            self._remove(*next(iter(self._entries)))
+
+    def invalidate(self, channel_id):
+        for key in [key for key in self._entries if key[0] == channel_id]:
+            del self._entries[key]
+        for group in [group for group in self._index if group[0] == channel_id]:
+            del self._index[group]
+
+    def stats(self, channel_id):
+        counts = self._stats.get(channel_id, {"hits": 0, "misses": 0})
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hitRate": round(counts["hits"] / lookups * 100, 2) if lookups else 0,
+        }
+
+
+reply_cache = ReplyCache()
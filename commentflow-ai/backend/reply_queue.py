@@ -0,0 +1,259 @@
+import asyncio
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+from database import db
+from log import get_logger
+
+# Durable reply job queue in MongoDB.
+#
+# The sweep enqueues one job per comment that needs an AI reply, in the same step that
+# stores the comment as pending; a pool of async workers leases jobs and posts the
+# replies. A job is held for REPLY_HOLD_SECONDS while the sweep generates the page's
+# replies in one batch and releases it with its reply attached; if that never happens
+# (generation failed, the process died) the hold runs out and the worker generates
+# the reply itself. Jobs are keyed by user, channel and comment ID, so enqueueing the
+# same comment twice is a no-op. A leased job belongs to one worker until its lease
+# expires, so jobs held by a crashed process are picked up again after a restart.
+# Failed attempts are retried with exponential backoff; after REPLY_MAX_ATTEMPTS the
+# job is dead-lettered (kept with status "dead"). Done and dead jobs carry
+# completed_at and a TTL index removes them REPLY_JOB_RETENTION_DAYS later, so the
+# collection holds about that many days of replies; a dead job can be requeued
+# until then.
+
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS", "4"))
+REPLY_LEASE_SECONDS = float(os.getenv("REPLY_LEASE_SECONDS", "120"))
+REPLY_MAX_ATTEMPTS = int(os.getenv("REPLY_MAX_ATTEMPTS", "6"))
+REPLY_RETRY_BASE_SECONDS = float(os.getenv("REPLY_RETRY_BASE_SECONDS", "30"))
+REPLY_RETRY_MAX_SECONDS = float(os.getenv("REPLY_RETRY_MAX_SECONDS", "3600"))
+REPLY_POLL_SECONDS = float(os.getenv("REPLY_POLL_SECONDS", "2"))
+REPLY_HOLD_SECONDS = float(os.getenv("REPLY_HOLD_SECONDS", "300"))
+REPLY_JOB_RETENTION_DAYS = float(os.getenv("REPLY_JOB_RETENTION_DAYS", "14"))
+
+log = get_logger("replies")
+
+JOB_QUEUED = "queued"
+JOB_LEASED = "leased"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+
+
+class RetryLater(Exception):
+    # Raised by a job handler to retry after `delay` seconds without using up an attempt.
+    def __init__(self, message, delay):
+        super().__init__(message)
+        self.delay = delay
+
+
+class PermanentFailure(Exception):
+    # Raised by a job handler when retrying cannot help; the job is dead-lettered at once.
+    pass
+
+
+def job_key(user_id, channel_id, comment_id):
+    return f"{user_id}:{channel_id}:{comment_id}"
+
+
+def retry_delay(attempts):
+    delay = min(REPLY_RETRY_BASE_SECONDS * (2 ** (attempts - 1)), REPLY_RETRY_MAX_SECONDS)
+    # Jitter spreads out retries of jobs that failed together.
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def ensure_indexes():
+    await db.reply_jobs.create_index([("status", 1), ("available_at", 1)], name="status_available_idx")
+    await db.reply_jobs.create_index([("status", 1), ("lease_expires_at", 1)], name="status_lease_idx")
+    await db.reply_jobs.create_index([("user_id", 1), ("channel_id", 1), ("status", 1)], name="user_channel_status_idx")
+    await db.reply_jobs.create_index(
+        [("completed_at", 1)], name="completed_ttl_idx", expireAfterSeconds=int(REPLY_JOB_RETENTION_DAYS * 86400)
+    )
+
+
+async def enqueue(jobs, hold_seconds=0):
+    # `jobs` are dicts with user_id, channel_id, comment_id, video_id, text,
+    # published_at and an optional pre-generated reply_text. Workers leave the jobs
+    # alone for `hold_seconds`, or until they are released.
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"_id": job_key(job["user_id"], job["channel_id"], job["comment_id"])},
+            {"$setOnInsert": {
+                **job,
+                "status": JOB_QUEUED,
+                "attempts": 0,
+                "available_at": now + timedelta(seconds=hold_seconds),
+                "created_at": now,
+            }},
+            upsert=True,
+        )
+        for job in jobs
+    ]
+    if not operations:
+        return 0
+    result = await db.reply_jobs.bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+
+async def release(user_id, channel_id, replies):
+    # Makes held jobs available now; `replies` maps comment IDs to a generated reply
+    # text, or None to leave generating it to the worker. Jobs already leased are
+    # left alone.
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"_id": job_key(user_id, channel_id, comment_id), "status": JOB_QUEUED},
+            {"$set": {"available_at": now, **({"reply_text": reply_text} if reply_text else {})}},
+        )
+        for comment_id, reply_text in replies.items()
+    ]
+    if not operations:
+        return 0
+    result = await db.reply_jobs.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+async def lease(owner, lease_seconds=REPLY_LEASE_SECONDS):
+    now = datetime.utcnow()
+    return await db.reply_jobs.find_one_and_update(
+        {"$or": [
+            {"status": JOB_QUEUED, "available_at": {"$lte": now}},
+            # Lease expired: the worker holding it died or hung.
+            {"status": JOB_LEASED, "lease_expires_at": {"$lte": now}},
+        ]},
+        {
+            "$set": {"status": JOB_LEASED, "lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _finish(job, update):
+    # Only the current lease holder may finish a job.
+    result = await db.reply_jobs.update_one(
+        {"_id": job["_id"], "status": JOB_LEASED, "lease_owner": job["lease_owner"]},
+        update,
+    )
+    return result.modified_count == 1
+
+
+async def complete(job, **fields):
+    return await _finish(job, {
+        "$set": {"status": JOB_DONE, "completed_at": datetime.utcnow(), **fields},
+        "$unset": {"lease_owner": "", "lease_expires_at": ""},
+    })
+
+
+async def retry(job, error, delay=None, count_attempt=True):
+    update = {
+        "$set": {
+            "status": JOB_QUEUED,
+            "available_at": datetime.utcnow() + timedelta(seconds=delay if delay is not None else retry_delay(job["attempts"])),
+            "last_error": str(error),
+        },
+        "$unset": {"lease_owner": "", "lease_expires_at": ""},
+    }
+    if not count_attempt:
+        update["$inc"] = {"attempts": -1}
+    return await _finish(job, update)
+
+
+async def dead_letter(job, error):
+    now = datetime.utcnow()
+    return await _finish(job, {
+        "$set": {"status": JOB_DEAD, "last_error": str(error), "dead_at": now, "completed_at": now},
+        "$unset": {"lease_owner": "", "lease_expires_at": ""},
+    })
+
+
+async def requeue_dead(user_id, channel_id, comment_ids=None):
+    query = {"user_id": user_id, "channel_id": channel_id, "status": JOB_DEAD}
+    if comment_ids:
+        query["comment_id"] = {"$in": comment_ids}
+    result = await db.reply_jobs.update_many(
+        query,
+        {"$set": {"status": JOB_QUEUED, "attempts": 0, "available_at": datetime.utcnow()}, "$unset": {"completed_at": ""}},
+    )
+    return result.modified_count
+
+
+async def queue_stats(user_id, channel_id):
+    pipeline = [
+        {"$match": {"user_id": user_id, "channel_id": channel_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]
+    rows = await db.reply_jobs.aggregate(pipeline).to_list(length=None)
+    counts = {row["_id"]: row["count"] for row in rows}
+    return {status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_LEASED, JOB_DONE, JOB_DEAD)}
+
+
+async def backlog_counts():
+    # Jobs waiting, in flight and dead across all users (for /metrics); done jobs are not counted.
+    counts = {}
+    for status in (JOB_QUEUED, JOB_LEASED, JOB_DEAD):
+        counts[status] = await db.reply_jobs.count_documents({"status": status})
+    return counts
+
+
+class ReplyWorkerPool:
+    def __init__(self, handle_job, on_dead=None, workers=REPLY_WORKERS, poll_seconds=REPLY_POLL_SECONDS, max_attempts=REPLY_MAX_ATTEMPTS):
+        # `handle_job(job)` posts one reply; it may raise RetryLater or PermanentFailure,
+        # and any other exception counts as a failed attempt. `on_dead(job, error)` is
+        # awaited after a job is dead-lettered.
+        self.handle_job = handle_job
+        self.on_dead = on_dead
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+
+    async def run_job(self, job):
+        try:
+            await self.handle_job(job)
+        except asyncio.CancelledError:
+            # The lease runs out and another worker picks the job up.
+            raise
+        except RetryLater as e:
+            log.info("reply.deferred", job_id=job["_id"], delay_s=round(e.delay), error=str(e))
+            await retry(job, e, delay=e.delay, count_attempt=False)
+        except Exception as e:
+            if isinstance(e, PermanentFailure) or job["attempts"] >= self.max_attempts:
+                log.error("reply.dead_lettered", job_id=job["_id"], attempts=job["attempts"], error=str(e))
+                if await dead_letter(job, e) and self.on_dead:
+                    await self.on_dead(job, e)
+            else:
+                log.warning("reply.retry", job_id=job["_id"], attempts=job["attempts"], error=str(e))
+                await retry(job, e)
+        else:
+            await complete(job)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await lease(self.owner)
+                if job is None:
+                    await asyncio.sleep(self.poll_seconds)
+                    continue
+                await self.run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Bookkeeping failed (e.g. Mongo unavailable); an unfinished lease simply expires.
+                log.exception("reply.worker_error")
+                await asyncio.sleep(self.poll_seconds)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+import metrics
+
+# Short-lived cache for read endpoints that call Google (videos, video stats, /me).
+#
+# Responses are cached per user and parameters as serialized JSON with an ETag, in a
+# size-bounded LRU with a TTL. Concurrent misses for the same key share a single
+# fetch. Every response carries its ETag and a private Cache-Control max-age for the
+# rest of its TTL, and a request whose If-None-Match still matches gets a 304, so
+# dashboard refreshes cost neither quota nor bandwidth.
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "60"))
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match.
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    async def _load(self, key, fetch, ttl):
+        body = json.dumps(jsonable_encoder(await fetch()), separators=(",", ":")).encode("utf-8")
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+            "expires_at": time.monotonic() + ttl,
+        }
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the error as retrieved even if every waiter has gone away.
+            task.exception()
+
+    async def get(self, key, fetch, ttl=None):
+        # Returns (entry, source): source is "hit", "miss" or "shared" (joined a fetch
+        # already in flight). Errors from `fetch` reach every waiter and are not cached.
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry["expires_at"] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry, "hit"
+            del self._entries[key]
+        task = self._inflight.get(key)
+        source = "shared"
+        if task is None:
+            # A task, so a client disconnecting does not cancel the fetch for the others.
+            task = asyncio.create_task(self._load(key, fetch, self.ttl if ttl is None else ttl))
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self._inflight[key] = task
+            source = "miss"
+        return await asyncio.shield(task), source
+
+    def invalidate(self, user_id):
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+    async def respond(self, request, key, fetch, ttl=None):
+        # `key` is (user_id, endpoint, *params); `fetch()` returns the JSON-able body.
+        entry, source = await self.get(key, fetch, ttl)
+        headers = {
+            "ETag": entry["etag"],
+            "Cache-Control": f"private, max-age={max(0, math.ceil(entry['expires_at'] - time.monotonic()))}",
+        }
+        if _etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+            metrics.RESPONSE_CACHE_REQUESTS.inc(endpoint=key[1], result="not_modified")
+            return Response(status_code=304, headers=headers)
+        metrics.RESPONSE_CACHE_REQUESTS.inc(endpoint=key[1], result=source)
+        return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from database import db
+
+# Materialized per-user/channel/day comment counts.
+#
+# The sweeper applies +1/-1 increments whenever it inserts a comment or changes a
+# comment's status, so the dashboard reads a handful of day documents instead of
+# scanning every comment a creator has ever received. Days are bucketed by the
+# comment's published_at (UTC), matching the weekly chart.
+
+
+def day_bucket(published_at):
+    return datetime(published_at.year, published_at.month, published_at.day)
+
+
+def _rollup_key(user_id, channel_id, day):
+    return f"{user_id}:{channel_id}:{day.strftime('%Y-%m-%d')}"
+
+
+class RollupBatch:
+    def __init__(self, user_id, channel_id):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self._increments = defaultdict(lambda: defaultdict(int))
+
+    def record(self, published_at, old_status, new_status):
+        # old_status is None for a newly inserted comment.
+        if old_status == new_status:
+            return
+        increments = self._increments[day_bucket(published_at)]
+        if old_status is None:
+            increments["total"] += 1
+        else:
+            increments[f"counts.{old_status}"] -= 1
+        if new_status is not None:
+            increments[f"counts.{new_status}"] += 1
+
+    async def flush(self):
+        operations = [
+            UpdateOne(
+                {"_id": _rollup_key(self.user_id, self.channel_id, day)},
+                {
+                    "$inc": dict(increments),
+                    "$setOnInsert": {"user_id": self.user_id, "channel_id": self.channel_id, "day": day},
+                },
+                upsert=True,
+            )
+            for day, increments in self._increments.items()
+        ]
+        self._increments.clear()
+        if operations:
+            await db.comment_rollups.bulk_write(operations, ordered=False)
+
+
+async def record_status_change(user_id, channel_id, published_at, old_status, new_status):
+    batch = RollupBatch(user_id, channel_id)
+    batch.record(published_at, old_status, new_status)
+    await batch.flush()
+
+
+async def ensure_indexes():
+    await db.comment_rollups.create_index([("user_id", 1), ("channel_id", 1), ("day", 1)], name="user_channel_day_idx")
+
+
+async def rebuild(user_id, channel_id):
+    # One-off backfill from db.comments for channels whose history predates the rollups.
+    pipeline = [
+        {"$match": {"user_id": user_id, "channel_id": channel_id}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$published_at"}},
+                "status": "$status",
+            },
+            "count": {"$sum": 1},
+        }},
+    ]
+    rows = await db.comments.aggregate(pipeline).to_list(length=None)
+    days = defaultdict(lambda: {"total": 0, "counts": {}})
+    for row in rows:
+        day = days[row["_id"]["day"]]
+        day["total"] += row["count"]
+        day["counts"][row["_id"]["status"]] = row["count"]
+
+    # Each day is overwritten in place by its own upsert instead of the channel's
+    # rollups being deleted and re-inserted, so increments applied meanwhile by reply
+    # workers or API handlers are never lost to a missing or duplicate document; only
+    # one landing between the aggregation and its day's $set can be overwritten.
+    # Days that no longer have comments are zeroed.
+    existing = await db.comment_rollups.find(
+        {"user_id": user_id, "channel_id": channel_id}, {"day": 1}
+    ).to_list(length=None)
+    for doc in existing:
+        days.setdefault(doc["day"].strftime("%Y-%m-%d"), {"total": 0, "counts": {}})
+    operations = []
+    for day_string, values in days.items():
+        day = datetime.strptime(day_string, "%Y-%m-%d")
+        operations.append(UpdateOne(
+            {"_id": _rollup_key(user_id, channel_id, day)},
+            {"$set": {"user_id": user_id, "channel_id": channel_id, "day": day, **values}},
+            upsert=True,
+        ))
+    if operations:
+        await db.comment_rollups.bulk_write(operations, ordered=False)
+
+
+async def dashboard_stats(user_id, channel_id, statuses, days=7):
+    # A single $facet over the rollups returns all-time totals, per-status counts and
+    # the per-day series for the last `days` days (including today).
+    today = day_bucket(datetime.utcnow())
+    first_day = today - timedelta(days=days - 1)
+    pipeline = [
+        {"$match": {"user_id": user_id, "channel_id": channel_id}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": "$total"},
+                    **{status: {"$sum": f"$counts.{status}"} for status in statuses},
+                }},
+            ],
+            "series": [
+                {"$match": {"day": {"$gte": first_day}}},
+                {"$project": {"_id": 0, "day": 1, "total": 1, "counts": 1}},
+            ],
+        }},
+    ]
+    result = (await db.comment_rollups.aggregate(pipeline).to_list(length=1) or [{}])[0]
+    totals = (result.get("totals") or [{}])[0]
+    by_status = {status: totals.get(status, 0) for status in statuses}
+
+    series_by_day = {row["day"]: row for row in result.get("series", [])}
+    series = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        row = series_by_day.get(day, {})
+        series.append({"date": day, "total": row.get("total", 0), "counts": row.get("counts", {})})
+    return {"total": totals.get("total", 0), "by_status": by_status, "series": series}
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+
+from database import db
+from log import get_logger
+
+# Sweep scheduler: runs one sweep per user concurrently instead of walking every
+# user one after another, so a slow channel no longer holds up everybody else.
+# With a `membership` (see sweeper_shard) it only sweeps the users leased to this
+# instance, so several instances can run side by side. Videos listed in a user's
+# `sweep_targets` (filled by the upload webhook) are swept right away with
+# `sweep_videos`, without waiting for the user's next full sweep.
+
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "10"))
+SWEEP_MAX_CONCURRENT_USERS = int(os.getenv("SWEEP_MAX_CONCURRENT_USERS", "8"))
+SWEEP_MAX_REQUESTS_PER_USER = int(os.getenv("SWEEP_MAX_REQUESTS_PER_USER", "4"))
+SWEEP_MAX_BACKOFF_SECONDS = float(os.getenv("SWEEP_MAX_BACKOFF_SECONDS", "300"))
+
+log = get_logger("scheduler")
+
+
+class SweepScheduler:
+    def __init__(
+        self,
+        sweep_user,
+        interval=SWEEP_INTERVAL_SECONDS,
+        max_concurrent_users=SWEEP_MAX_CONCURRENT_USERS,
+        max_requests_per_user=SWEEP_MAX_REQUESTS_PER_USER,
+        max_backoff=SWEEP_MAX_BACKOFF_SECONDS,
+        membership=None,
+        sweep_videos=None,
+    ):
+        # `sweep_user(user, limiter)` is awaited once per due user. `limiter` is an
+        # asyncio.Semaphore bounding that user's in-flight YouTube requests.
+        # `sweep_videos(user, limiter, video_ids)` runs a targeted sweep.
+        self.sweep_user = sweep_user
+        self.sweep_videos = sweep_videos
+        self.interval = interval
+        self.max_requests_per_user = max_requests_per_user
+        self.max_backoff = max_backoff
+        self.membership = membership
+        self._user_slots = asyncio.Semaphore(max_concurrent_users)
+        self._limiters = {}
+        self._next_run_at = {}
+        self._failures = {}
+        self._running = {}
+
+    def limiter_for(self, user_id):
+        limiter = self._limiters.get(user_id)
+        if limiter is None:
+            limiter = asyncio.Semaphore(self.max_requests_per_user)
+            self._limiters[user_id] = limiter
+        return limiter
+
+    def user_interval(self, user):
+        # Users may override the global cadence with their own interval.
+        return float(user.get("sweep_interval_seconds") or self.interval)
+
+    def due_users(self, users, now):
+        # Yields (user, targets): targets is None for a full sweep, or the video IDs
+        # of a targeted sweep.
+        for user in users:
+            user_id = str(user["_id"])
+            if user_id in self._running:
+                continue
+            if self._next_run_at.get(user_id, 0) <= now:
+                yield user, None
+            elif user.get("sweep_targets") and self.sweep_videos is not None:
+                yield user, list(user["sweep_targets"])
+
+    async def _clear_targets(self, user):
+        # A full sweep picks up requested videos too (their sync state is flagged).
+        # Targets added while this sweep runs stay for the next one.
+        if user.get("sweep_targets"):
+            await db.users.update_one({"_id": user["_id"]}, {"$pullAll": {"sweep_targets": user["sweep_targets"]}})
+
+    async def _run_targets(self, user, targets):
+        user_id = str(user["_id"])
+        try:
+            await self._clear_targets(user)
+            async with self._user_slots:
+                await self.sweep_videos(user, self.limiter_for(user_id), targets)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("sweep.targeted_failed", user_id=user_id, error=str(e))
+        finally:
+            self._running.pop(user_id, None)
+
+    async def _run_user(self, user):
+        user_id = str(user["_id"])
+        try:
+            await self._clear_targets(user)
+            async with self._user_slots:
+                await self.sweep_user(user, self.limiter_for(user_id))
+            self._failures.pop(user_id, None)
+            delay = self.user_interval(user)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # One user's failure must not affect anyone else; back off exponentially.
+            failures = self._failures.get(user_id, 0) + 1
+            self._failures[user_id] = failures
+            delay = min(self.user_interval(user) * (2 ** failures), self.max_backoff)
+            log.warning("sweep.failed", user_id=user_id, failures=failures, retry_in_s=round(delay), error=str(e))
+        finally:
+            self._running.pop(user_id, None)
+        self._next_run_at[user_id] = time.monotonic() + delay
+
+    def _forget_missing(self, users):
+        known = {str(user["_id"]) for user in users}
+        for user_id in list(self._next_run_at):
+            if user_id not in known and user_id not in self._running:
+                self._next_run_at.pop(user_id, None)
+                self._failures.pop(user_id, None)
+                self._limiters.pop(user_id, None)
+
+    async def tick(self):
+        users = await db.users.find({"google_credentials": {"$exists": True}}).to_list(length=None)
+        if self.membership is not None:
+            users = await self.membership.claim(users, self._running)
+        self._forget_missing(users)
+        now = time.monotonic()
+        for user, targets in self.due_users(users, now):
+            user_id = str(user["_id"])
+            if targets is None:
+                self._running[user_id] = asyncio.create_task(self._run_user(user))
+            else:
+                self._running[user_id] = asyncio.create_task(self._run_targets(user, targets))
+        return users
+
+    async def run_forever(self):
+        # Poll at a fraction of the shortest interval so per-user schedules stay accurate.
+        poll_every = max(min(self.interval, 5.0), 0.5)
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("scheduler.tick_failed")
+            await asyncio.sleep(poll_every)
+
+    async def shutdown(self):
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.membership is not None:
+            await self.membership.leave()
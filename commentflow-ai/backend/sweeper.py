@@ -0,0 +1,61 @@
+"""Run the comment sweeper and reply workers without the API server.
+
+Start as many instances as needed; they share users through leases in MongoDB
+(see sweeper_shard). Run the API with EMBEDDED_SWEEPER=false alongside them.
+
+    python sweeper.py
+    python sweeper.py --reply-workers 8
+    python sweeper.py --reply-workers 0      # sweep only, post replies elsewhere
+    python sweeper.py --metrics-port 9108    # serve Prometheus metrics on 127.0.0.1:9108/metrics
+    python sweeper.py --metrics-port 9108 --metrics-host 0.0.0.0   # ... for a scraper on another host
+"""
+import argparse
+import asyncio
+import signal
+
+import main
+from log import get_logger
+
+log = get_logger("scheduler")
+
+
+async def run(reply_workers, sweep, metrics_port=None, metrics_host=None):
+    await main.ensure_indexes()
+    metrics_server = await main.start_metrics_server(metrics_port, metrics_host) if metrics_port else None
+    main.reply_workers.workers = reply_workers
+    main.reply_workers.start()
+    sweep_task = asyncio.create_task(main.auto_reply_task()) if sweep else None
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    log.info("sweeper.stop")
+    if sweep_task:
+        sweep_task.cancel()
+        await asyncio.gather(sweep_task, return_exceptions=True)
+        # Releases this instance's user leases so the others take over right away.
+        await main.sweep_scheduler.shutdown()
+    await main.reply_workers.shutdown()
+    await main.youtube_quota.close()
+    await main.close_async_http()
+    if metrics_server:
+        metrics_server.close()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reply-workers", type=int, default=main.reply_workers.workers,
+                        help="concurrent reply queue workers (0 disables them)")
+    parser.add_argument("--no-sweep", action="store_true", help="only drain the reply queue")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default=main.METRICS_HOST,
+                        help="interface for the metrics listener (default: METRICS_HOST, 127.0.0.1)")
+    args = parser.parse_args()
+    asyncio.run(run(args.reply_workers, not args.no_sweep, args.metrics_port, args.metrics_host))
+
+
+if __name__ == "__main__":
+    cli()
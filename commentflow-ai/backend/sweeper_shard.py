@@ -0,0 +1,104 @@
+import hashlib
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import db
+from log import get_logger
+
+# Shards users across sweeper instances (API processes or `python sweeper.py`).
+#
+# Each instance heartbeats into db.sweeper_instances. Every live instance sees the
+# same member list and assigns users by rendezvous hashing, so when an instance joins
+# or leaves only its share of users moves. Assignment alone can briefly disagree
+# while the member list changes, so an instance also has to hold a lease on a user in
+# db.sweeper_leases before sweeping it; leases are renewed every tick and expire when
+# their holder stops heartbeating.
+
+SWEEPER_HEARTBEAT_SECONDS = float(os.getenv("SWEEPER_HEARTBEAT_SECONDS", "10"))
+SWEEPER_INSTANCE_TTL_SECONDS = float(os.getenv("SWEEPER_INSTANCE_TTL_SECONDS", "30"))
+SWEEPER_LEASE_SECONDS = float(os.getenv("SWEEPER_LEASE_SECONDS", "60"))
+
+log = get_logger("scheduler")
+
+
+def _score(instance_id, user_id):
+    return hashlib.sha1(f"{instance_id}:{user_id}".encode("utf-8")).digest()
+
+
+class SweeperMembership:
+    def __init__(self, instance_id=None, heartbeat_seconds=SWEEPER_HEARTBEAT_SECONDS,
+                 instance_ttl=SWEEPER_INSTANCE_TTL_SECONDS, lease_seconds=SWEEPER_LEASE_SECONDS):
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.heartbeat_seconds = heartbeat_seconds
+        self.instance_ttl = instance_ttl
+        self.lease_seconds = lease_seconds
+        self.members = [self.instance_id]
+        self._last_heartbeat = 0.0
+        self._owned = set()
+
+    async def heartbeat(self):
+        now = datetime.utcnow()
+        await db.sweeper_instances.update_one(
+            {"_id": self.instance_id},
+            {"$set": {"heartbeat_at": now}, "$setOnInsert": {"started_at": now, "host": socket.gethostname()}},
+            upsert=True,
+        )
+        live = await db.sweeper_instances.find(
+            {"heartbeat_at": {"$gte": now - timedelta(seconds=self.instance_ttl)}}, {"_id": 1}
+        ).to_list(length=None)
+        members = sorted({doc["_id"] for doc in live} | {self.instance_id})
+        if members != self.members:
+            log.info("sweeper.membership_changed", instance_id=self.instance_id, instances=len(members))
+        self.members = members
+        self._last_heartbeat = time.monotonic()
+
+    def assigned(self, user_id):
+        return max(self.members, key=lambda instance_id: _score(instance_id, user_id)) == self.instance_id
+
+    async def _acquire(self, user_ids):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        operations = [
+            UpdateOne(
+                {"_id": user_id, "$or": [{"owner": self.instance_id}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": self.instance_id, "expires_at": expires_at}},
+                upsert=True,
+            )
+            for user_id in user_ids
+        ]
+        if operations:
+            try:
+                await db.sweeper_leases.bulk_write(operations, ordered=False)
+            except BulkWriteError:
+                # Duplicate key: someone else holds a live lease on that user.
+                pass
+        owned = await db.sweeper_leases.find(
+            {"_id": {"$in": list(user_ids)}, "owner": self.instance_id}, {"_id": 1}
+        ).to_list(length=None)
+        return {doc["_id"] for doc in owned}
+
+    async def release(self, user_ids):
+        if user_ids:
+            await db.sweeper_leases.delete_many({"_id": {"$in": list(user_ids)}, "owner": self.instance_id})
+
+    async def claim(self, users, running):
+        # Returns the users this instance may sweep now. Users it is still sweeping
+        # keep their lease until the sweep ends, even if they were reassigned.
+        if time.monotonic() - self._last_heartbeat >= self.heartbeat_seconds:
+            await self.heartbeat()
+        wanted = {str(user["_id"]) for user in users if self.assigned(str(user["_id"]))} | set(running)
+        await self.release(self._owned - wanted)
+        self._owned = await self._acquire(wanted)
+        return [user for user in users if str(user["_id"]) in self._owned]
+
+    async def leave(self):
+        # Hand users over right away instead of waiting for the leases to expire.
+        await self.release(self._owned)
+        self._owned = set()
+        await db.sweeper_instances.delete_one({"_id": self.instance_id})
@@ -0,0 +1,195 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+from database import db
+
+# Per-channel and per-video sync state for incremental comment ingestion.
+#
+# The channel document remembers the newest upload seen in the uploads playlist so
+# later sweeps only page through new uploads. Each video document remembers the
+# newest comment thread seen (the high-water mark) plus the page token of a scan
+# that ran out of page budget, so the next sweep resumes where it stopped.
+#
+# Polling adapts per video: every completed scan that finds new threads halves the
+# video's poll interval (down to SYNC_MIN_POLL_SECONDS), and every quiet one grows it
+# by SYNC_POLL_BACKOFF (up to SYNC_COLD_RESCAN_SECONDS). An upload notification
+# flags a video with `sweep_requested_at` so it is scanned on the next sweep anyway.
+
+SYNC_MAX_PAGES_PER_VIDEO = int(os.getenv("SYNC_MAX_PAGES_PER_VIDEO", "0"))  # 0 = follow every page
+SYNC_HOT_WINDOW_SECONDS = float(os.getenv("SYNC_HOT_WINDOW_SECONDS", str(2 * 24 * 3600)))
+SYNC_DEEP_RESCAN_SECONDS = float(os.getenv("SYNC_DEEP_RESCAN_SECONDS", "900"))
+SYNC_COLD_RESCAN_SECONDS = float(os.getenv("SYNC_COLD_RESCAN_SECONDS", "3600"))
+SYNC_MIN_POLL_SECONDS = float(os.getenv("SYNC_MIN_POLL_SECONDS", "10"))
+SYNC_POLL_BACKOFF = float(os.getenv("SYNC_POLL_BACKOFF", "2"))
+
+SCAN_INCREMENTAL = "incremental"
+SCAN_DEEP = "deep"
+
+
+def parse_youtube_time(value):
+    # YouTube timestamps are RFC 3339 in UTC; Mongo hands datetimes back naive, so
+    # normalise to naive UTC to keep comparisons consistent.
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _channel_key(user_id, channel_id):
+    return f"channel:{user_id}:{channel_id}"
+
+
+def _video_key(user_id, channel_id, video_id):
+    return f"video:{user_id}:{channel_id}:{video_id}"
+
+
+async def ensure_indexes():
+    await db.sync_state.create_index([("user_id", 1), ("channel_id", 1), ("kind", 1)], name="user_channel_kind_idx")
+
+
+async def load_channel_state(user_id, channel_id):
+    return await db.sync_state.find_one({"_id": _channel_key(user_id, channel_id)}) or {}
+
+
+async def save_channel_state(user_id, channel_id, newest_video_published_at=None, **fields):
+    update = {
+        "$set": {"kind": "channel", "user_id": user_id, "channel_id": channel_id, "last_synced_at": datetime.utcnow(), **fields},
+    }
+    if newest_video_published_at:
+        update["$max"] = {"newest_video_published_at": newest_video_published_at}
+    await db.sync_state.update_one({"_id": _channel_key(user_id, channel_id)}, update, upsert=True)
+
+
+async def register_videos(user_id, channel_id, videos):
+    # `videos` are uploads playlist items; new ones get a fresh state document.
+    operations = []
+    for video in videos:
+        video_id = video["contentDetails"]["videoId"]
+        operations.append(UpdateOne(
+            {"_id": _video_key(user_id, channel_id, video_id)},
+            {
+                "$set": {"video_title": video["snippet"]["title"]},
+                "$setOnInsert": {
+                    "kind": "video",
+                    "user_id": user_id,
+                    "channel_id": channel_id,
+                    "video_id": video_id,
+                    "video_published_at": parse_youtube_time(video["snippet"]["publishedAt"]),
+                },
+            },
+            upsert=True,
+        ))
+    if operations:
+        await db.sync_state.bulk_write(operations, ordered=False)
+
+
+async def request_video_scan(user_id, channel_id, video_id, video_title, video_published_at):
+    # Registers a video from an upload notification (if it is new) and flags it for
+    # the next sweep.
+    set_fields = {"sweep_requested_at": datetime.utcnow()}
+    if video_title:
+        set_fields["video_title"] = video_title
+    await db.sync_state.update_one(
+        {"_id": _video_key(user_id, channel_id, video_id)},
+        {
+            "$set": set_fields,
+            "$setOnInsert": {
+                "kind": "video",
+                "user_id": user_id,
+                "channel_id": channel_id,
+                "video_id": video_id,
+                "video_published_at": video_published_at,
+            },
+        },
+        upsert=True,
+    )
+
+
+async def load_video_states(user_id, channel_id, video_ids=None):
+    query = {"user_id": user_id, "channel_id": channel_id, "kind": "video"}
+    if video_ids is not None:
+        query["video_id"] = {"$in": list(video_ids)}
+    return await db.sync_state.find(query).to_list(length=None)
+
+
+def is_hot(state, now):
+    last_activity = max(
+        filter(None, [state.get("last_activity_at"), state.get("video_published_at")]),
+        default=None,
+    )
+    return last_activity is not None and now - last_activity <= timedelta(seconds=SYNC_HOT_WINDOW_SECONDS)
+
+
+def next_poll_interval(state, new_threads, now):
+    previous = state.get("poll_interval_seconds")
+    if previous is None:
+        interval = SYNC_MIN_POLL_SECONDS if is_hot(state, now) else SYNC_COLD_RESCAN_SECONDS
+    elif new_threads:
+        interval = previous / 2
+    else:
+        interval = previous * SYNC_POLL_BACKOFF
+    return min(max(interval, SYNC_MIN_POLL_SECONDS), SYNC_COLD_RESCAN_SECONDS)
+
+
+def scan_mode(state, now=None):
+    # Decide how (and whether) a video should be scanned in this sweep:
+    # - a scan that ran out of page budget resumes in the same mode;
+    # - never-scanned videos get a full (deep) scan;
+    # - a video flagged by an upload notification is scanned right away;
+    # - otherwise a video waits for its adaptive poll interval, and hot videos get a
+    #   periodic deep rescan to pick up replies posted directly on YouTube.
+    now = now or datetime.utcnow()
+    if state.get("page_token"):
+        return state.get("scan_mode") or SCAN_INCREMENTAL
+    last_scanned_at = state.get("last_scanned_at")
+    if last_scanned_at is None:
+        return SCAN_DEEP
+
+    requested = state.get("sweep_requested_at") is not None
+    next_scan_at = state.get("next_scan_at")
+    if next_scan_at is None:
+        # Scanned before adaptive polling existed.
+        next_scan_at = last_scanned_at + timedelta(seconds=SYNC_MIN_POLL_SECONDS if is_hot(state, now) else SYNC_COLD_RESCAN_SECONDS)
+    if not requested and now < next_scan_at:
+        return None
+    if is_hot(state, now):
+        last_deep_scan_at = state.get("last_deep_scan_at")
+        if last_deep_scan_at is None or now - last_deep_scan_at >= timedelta(seconds=SYNC_DEEP_RESCAN_SECONDS):
+            return SCAN_DEEP
+    return SCAN_INCREMENTAL
+
+
+async def record_video_scan(state, mode, scan_newest, page_token, new_threads):
+    # `state` is the video's sync state as loaded for this scan.
+    now = datetime.utcnow()
+    set_fields = {"last_scanned_at": now}
+    max_fields = {}
+    update = {"$set": set_fields}
+    if page_token:
+        # Out of page budget: keep the token so the next sweep resumes this scan.
+        # The high-water mark only moves once the scan completes, otherwise the
+        # unread gap between it and the newest thread would be skipped.
+        set_fields.update(page_token=page_token, scan_mode=mode, scan_newest_published_at=scan_newest)
+    else:
+        set_fields.update(page_token=None, scan_mode=None, scan_newest_published_at=None)
+        if mode == SCAN_DEEP:
+            set_fields["last_deep_scan_at"] = now
+        interval = next_poll_interval(state, new_threads, now)
+        set_fields.update(poll_interval_seconds=interval, next_scan_at=now + timedelta(seconds=interval))
+        if scan_newest:
+            max_fields["newest_comment_published_at"] = scan_newest
+    if new_threads and scan_newest:
+        # Activity is dated by the newest thread itself, so a first full ingest of an
+        # old video does not make it look hot.
+        max_fields["last_activity_at"] = scan_newest
+    if max_fields:
+        update["$max"] = max_fields
+    await db.sync_state.update_one({"_id": state["_id"]}, update)
+    if not page_token and state.get("sweep_requested_at"):
+        # Leave a request that arrived during this scan for the next sweep.
+        await db.sync_state.update_one(
+            {"_id": state["_id"], "sweep_requested_at": state["sweep_requested_at"]},
+            {"$unset": {"sweep_requested_at": ""}},
+        )
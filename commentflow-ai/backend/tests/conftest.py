@@ -0,0 +1,28 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by bare name, and the in-memory MongoDB from
+# the load bench's fakes stands in for `database`; both must be in place before any
+# app module is imported.
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "bench")]
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+for name in ("SESSION_SECRET", "GOOGLE_CLIENT_ID", "GOOGLE_CLIENT_SECRET", "GOOGLE_API_KEY"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("EMBEDDED_SWEEPER", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import fakes  # noqa: E402
+
+if "database" not in sys.modules:
+    sys.modules["database"] = fakes.memory_database(database_name="commentflow_test")
+
+
+@pytest.fixture
+def db():
+    database = sys.modules["database"]
+    yield database.db
+    asyncio.run(database.client.drop_database(database.db.name))
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import types
+
+import pytest
+
+import ai_replies
+import fakes
+from ai_replies import estimate_tokens, generate_replies, parse_batch_replies, split_batches
+from model_router import ModelRouter
+
+
+def comments(count, text="Nice one"):
+    return [{"id": f"c{index}", "text": text} for index in range(count)]
+
+
+class ScriptedModel:
+    # Answers batch prompts with `batch_reply(comments)` and single prompts with a fixed reply.
+    def __init__(self, batch_reply, calls):
+        self.batch_reply = batch_reply
+        self.calls = calls
+
+    def generate_content(self, prompt, **kwargs):
+        match = fakes.FakeGeminiModel.BATCH_PAYLOAD.search(prompt)
+        if match is None:
+            self.calls.append("single")
+            return types.SimpleNamespace(text="Thanks for watching!")
+        self.calls.append("batch")
+        return types.SimpleNamespace(text=self.batch_reply(json.loads(match.group(1))))
+
+
+@pytest.fixture
+def use_model(monkeypatch):
+    def install(factory):
+        monkeypatch.setattr(ai_replies, "model_router", ModelRouter(["models/test"], factory))
+
+    return install
+
+
+def test_split_batches_caps_comments_and_tokens():
+    assert [len(batch) for batch in split_batches(comments(7), max_comments=3)] == [3, 3, 1]
+
+    long_text = "x" * 400
+    batches = list(split_batches(comments(5, long_text), max_comments=10, max_tokens=3 * estimate_tokens(long_text)))
+    assert [len(batch) for batch in batches] == [3, 2]
+    # A comment over the budget on its own still gets a batch.
+    assert [len(batch) for batch in split_batches(comments(2, long_text), max_tokens=1)] == [1, 1]
+
+
+def test_parse_batch_replies_keeps_valid_replies_for_asked_ids():
+    text = "```json\n" + json.dumps([
+        {"id": "c0", "reply": "  Thank you! 🙏 "},
+        {"id": "c1", "reply": ""},
+        {"id": "c2", "reply": 42},
+        {"id": "other", "reply": "Not asked for"},
+        {"id": "c0", "reply": "Second answer"},
+        "stray",
+    ], ensure_ascii=False) + "\n```"
+
+    assert parse_batch_replies(text, {"c0", "c1", "c2"}) == {"c0": "Thank you! 🙏"}
+
+
+@pytest.mark.parametrize("text", ["not json", '{"id": "c0", "reply": "hi"}'])
+def test_parse_batch_replies_rejects_malformed_output(text):
+    with pytest.raises(ValueError):
+        parse_batch_replies(text, {"c0"})
+
+
+def test_batch_answers_every_comment_in_one_call(use_model):
+    gemini = fakes.FakeGemini()
+    use_model(gemini)
+
+    replies = asyncio.run(generate_replies(comments(4)))
+
+    assert set(replies) == {"c0", "c1", "c2", "c3"}
+    assert gemini.calls == {"batch": 1}
+
+
+def test_short_batch_reply_falls_back_per_missing_comment(use_model):
+    calls = []
+    use_model(lambda name, system_instruction: ScriptedModel(
+        lambda batch: json.dumps([{"id": batch[0]["id"], "reply": "Batched reply"}]), calls
+    ))
+
+    replies = asyncio.run(generate_replies(comments(3)))
+
+    assert replies == {"c0": "Batched reply", "c1": "Thanks for watching!", "c2": "Thanks for watching!"}
+    assert calls == ["batch", "single", "single"]
+
+
+def test_malformed_batch_reply_falls_back_per_comment(use_model):
+    calls = []
+    use_model(lambda name, system_instruction: ScriptedModel(lambda batch: "Sure! Here are the replies:", calls))
+
+    replies = asyncio.run(generate_replies(comments(2)))
+
+    assert replies == {"c0": "Thanks for watching!", "c1": "Thanks for watching!"}
+    assert calls == ["batch", "single", "single"]
+
+
+def test_single_comment_skips_the_batch_prompt(use_model):
+    gemini = fakes.FakeGemini()
+    use_model(gemini)
+
+    assert asyncio.run(generate_replies(comments(1))) == {"c0": "Thanks for watching!"}
+    assert gemini.calls == {"single": 1}
+
+
+def test_comments_no_model_can_answer_are_left_out(use_model):
+    use_model(fakes.FakeGemini(failure_rate=1.0))
+
+    assert asyncio.run(generate_replies(comments(2))) == {}
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import comment_pages
+from comment_pages import InvalidCursor, decode_cursor, encode_cursor, list_comments
+
+T0 = datetime(2026, 3, 1, 12, 0, 0)
+
+
+def comment(comment_id, published_at, **fields):
+    return {"_id": comment_id, "user_id": "user-1", "channel_id": "UC1", "video_id": "v1",
+            "text": comment_id, "status": "pending", "published_at": published_at, **fields}
+
+
+async def all_pages(limit, between_pages=None):
+    ids, cursor, page = [], None, 0
+    while True:
+        result = await list_comments("user-1", "UC1", cursor=cursor, limit=limit)
+        ids += [item["id"] for item in result["items"]]
+        cursor = result["nextCursor"]
+        if cursor is None:
+            return ids
+        page += 1
+        if between_pages:
+            await between_pages(page)
+
+
+def test_cursor_round_trips():
+    cursor = encode_cursor({"_id": "Ugx-abc_123", "published_at": T0})
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (T0, "Ugx-abc_123")
+
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", encode_cursor({"_id": "x", "published_at": T0})[:-4]])
+def test_decode_rejects_bad_cursors(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_pages_break_ties_on_id(db):
+    # Several comments share a timestamp; none is skipped or repeated at a page edge.
+    comments = [comment(f"c{index:02d}", T0 - timedelta(minutes=index // 3)) for index in range(10)]
+
+    async def run():
+        await db.comments.insert_many(comments)
+        return await all_pages(limit=4)
+
+    expected = [doc["_id"] for doc in sorted(comments, key=lambda doc: (doc["published_at"], doc["_id"]), reverse=True)]
+    assert asyncio.run(run()) == expected
+
+
+def test_pages_do_not_shift_when_newer_comments_arrive(db):
+    comments = [comment(f"c{index:02d}", T0 - timedelta(minutes=index)) for index in range(9)]
+
+    async def insert_newer(page):
+        await db.comments.insert_many([
+            comment(f"new{page}", T0 + timedelta(minutes=page)),
+            comment(f"tie{page}", T0),
+        ])
+
+    async def run():
+        await db.comments.insert_many(comments)
+        return await all_pages(limit=3, between_pages=insert_newer)
+
+    assert asyncio.run(run()) == [f"c{index:02d}" for index in range(9)]
+
+
+def test_page_size_is_clamped(db, monkeypatch):
+    monkeypatch.setattr(comment_pages, "COMMENTS_PAGE_MAX_LIMIT", 2)
+
+    async def run():
+        await db.comments.insert_many([comment(f"c{index}", T0 - timedelta(minutes=index)) for index in range(3)])
+        return await list_comments("user-1", "UC1", limit=50), await list_comments("user-1", "UC1", limit=0)
+
+    big, small = asyncio.run(run())
+
+    assert len(big["items"]) == 2 and big["nextCursor"]
+    assert len(small["items"]) == 1
+
+
+def test_author_filter_pages_through_one_authors_comments(db):
+    comments = [
+        comment(f"c{index:02d}", T0 - timedelta(minutes=index), author_name="Fan" if index % 2 else "Other")
+        for index in range(10)
+    ]
+
+    async def run():
+        await comment_pages.ensure_indexes()
+        await db.comments.insert_many(comments)
+        first = await list_comments("user-1", "UC1", author="Fan", limit=3)
+        second = await list_comments("user-1", "UC1", author="Fan", cursor=first["nextCursor"], limit=3)
+        return first, second, await db.comments.index_information()
+
+    first, second, indexes = asyncio.run(run())
+
+    assert [item["id"] for item in first["items"] + second["items"]] == ["c01", "c03", "c05", "c07", "c09"]
+    assert second["nextCursor"] is None
+    assert indexes["user_channel_author_feed_idx"]["key"] == [
+        ("user_id", 1), ("channel_id", 1), ("author_name", 1), ("published_at", -1), ("_id", -1)
+    ]
@@ -0,0 +1,39 @@
+import logging
+
+import log
+from log import RateLimitFilter
+
+
+def record(level=logging.INFO, msg="sweep.video_scanned", user_id=None):
+    record = logging.LogRecord("commentflow.sweeper", level, __file__, 1, msg, None, None)
+    record.fields = {"user_id": user_id} if user_id else {}
+    return record
+
+
+def test_info_is_limited_per_event_and_user():
+    limiter = RateLimitFilter(per_minute=2)
+
+    assert [limiter.filter(record(user_id="a")) for _ in range(3)] == [True, True, False]
+    assert limiter.filter(record(user_id="b"))
+    assert limiter.filter(record(msg="sweep.done", user_id="a"))
+
+
+def test_warnings_and_errors_are_never_dropped():
+    limiter = RateLimitFilter(per_minute=1)
+
+    assert all(limiter.filter(record(logging.WARNING)) for _ in range(5))
+    assert all(limiter.filter(record(logging.ERROR)) for _ in range(5))
+
+
+def test_next_record_reports_how_many_were_suppressed(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(log.time, "monotonic", lambda: clock[0])
+    limiter = RateLimitFilter(per_minute=1)
+
+    assert limiter.filter(record())
+    assert not limiter.filter(record())
+    assert not limiter.filter(record())
+    clock[0] += 60
+    passed = record()
+    assert limiter.filter(passed)
+    assert passed.fields["suppressed"] == 2
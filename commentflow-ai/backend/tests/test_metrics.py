@@ -0,0 +1,32 @@
+import asyncio
+
+import main
+import metrics
+
+
+def test_metrics_are_not_served_on_the_api():
+    assert "/metrics" not in {getattr(route, "path", None) for route in main.app.routes}
+
+
+def test_metrics_listener_serves_the_metrics_page(db):
+    metrics.SWEEP_DURATION.observe(1.5, kind="full")
+
+    async def run():
+        server = await main.start_metrics_server(0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return server.sockets[0].getsockname()[0], response.decode("utf-8")
+        finally:
+            server.close()
+
+    host, response = asyncio.run(run())
+
+    assert host == "127.0.0.1"
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert 'sweep_duration_seconds_count{kind="full"}' in response
+    assert "user_id" not in response
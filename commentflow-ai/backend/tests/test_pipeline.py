@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from pipeline import StageFailed, run_pipeline
+
+
+async def source(count):
+    for item in range(count):
+        yield item
+
+
+def test_failed_items_are_dropped_and_the_run_fails_after_draining():
+    handled = []
+
+    async def double(item, emit):
+        if item == 3:
+            raise ValueError("bad item")
+        await emit(item * 2)
+
+    async def collect(item, emit):
+        handled.append(item)
+
+    with pytest.raises(StageFailed) as failed:
+        asyncio.run(run_pipeline(source(10), [(double, 2), (collect, 1)], queue_size=1))
+
+    assert sorted(handled) == [0, 2, 4, 8, 10, 12, 14, 16, 18]
+    assert failed.value.failures == {"double": 1}
+    assert str(failed.value.error) == "bad item"
+
+
+def test_clean_run_returns_normally():
+    handled = []
+
+    async def collect(item, emit):
+        handled.append(item)
+
+    asyncio.run(run_pipeline(source(5), [(collect, 3)]))
+
+    assert sorted(handled) == list(range(5))
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+import quota
+from quota import QUOTA_WRITE_RESERVE_FRACTION, QuotaExhausted, QuotaManager, TokenBucket
+
+
+def test_bucket_starts_full_and_refills_at_its_rate():
+    bucket = TokenBucket(10000, now=0.0)
+    assert bucket.tokens == bucket.capacity
+
+    bucket.take(bucket.capacity)
+    assert bucket.wait_time(50, True, 0.0) == pytest.approx(50 / bucket.rate)
+    assert bucket.wait_time(50, True, 50 / bucket.rate) == 0.0
+    # Refill never exceeds the burst capacity.
+    bucket._refill(10 ** 9)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_reads_leave_a_reserve_for_writes():
+    bucket = TokenBucket(10000, now=0.0)
+    reserve = bucket.capacity * QUOTA_WRITE_RESERVE_FRACTION
+    bucket.take(bucket.capacity - reserve)
+
+    assert bucket.wait_time(1, False, 0.0) > 0
+    assert bucket.wait_time(50, True, 0.0) == 0.0
+
+
+def test_clock_going_backwards_does_not_drain_the_bucket():
+    bucket = TokenBucket(10000, now=100.0)
+    bucket.take(10)
+    bucket._refill(50.0)
+
+    assert bucket.tokens == bucket.capacity - 10
+    assert bucket.updated == 100.0
+
+
+def test_rate_limit_block_keeps_tokens():
+    bucket = TokenBucket(10000, now=0.0)
+    bucket.block(0.0, 30)
+
+    assert bucket.wait_time(1, True, 10.0) == pytest.approx(20.0)
+    assert bucket.wait_time(1, True, 30.0) == 0.0
+    assert bucket.tokens == bucket.capacity
+
+
+def test_daily_quota_block_drains_tokens():
+    bucket = TokenBucket(10000, now=0.0)
+    bucket.block(0.0, 30, drain=True)
+
+    assert bucket.tokens == 0.0
+    assert bucket.wait_time(50, True, 31.0) == pytest.approx(50 / bucket.rate - 31.0)
+
+
+def test_bucket_state_round_trips():
+    bucket = TokenBucket(10000, now=5.0)
+    bucket.take(42)
+    bucket.block(5.0, 60)
+    bucket.failures = 2
+
+    restored = TokenBucket(10000, bucket.state(), now=6.0)
+
+    assert restored.state() == bucket.state()
+
+
+def manager(db, **kwargs):
+    return QuotaManager(db.youtube_quota, db.youtube_quota_usage, **kwargs)
+
+
+def test_calls_spend_a_leased_chunk_locally(db):
+    async def run():
+        quotas = manager(db, lease_units=100)
+        for _ in range(40):
+            await quotas.acquire("project-1", "user-1", "youtube.commentThreads.list", max_wait=0)
+        return await db.youtube_quota.find_one({"_id": "project:project-1"}), quotas
+
+    doc, quotas = asyncio.run(run())
+
+    # One chunk paid for all forty reads.
+    assert doc["tokens"] == pytest.approx(TokenBucket(quota.YOUTUBE_PROJECT_DAILY_QUOTA).capacity - 100, abs=1)
+    assert quotas._leases[("project", "project-1")].units == 60
+
+
+def test_instances_share_one_budget(db, monkeypatch):
+    # A 1000-unit project bursts up to 200 units: four comment inserts.
+    monkeypatch.setattr(quota, "YOUTUBE_PROJECT_DAILY_QUOTA", 1000)
+    cost = quota.quota_cost("youtube.comments.insert")
+
+    async def run():
+        first, second = manager(db), manager(db)
+        await first.acquire("project-1", "user-1", "youtube.comments.insert", max_wait=0, count=2)
+        await second.acquire("project-1", "user-2", "youtube.comments.insert", max_wait=0, count=2)
+        with pytest.raises(QuotaExhausted):
+            await first.acquire("project-1", "user-3", "youtube.comments.insert", max_wait=0)
+        await first.close()
+        return await second.snapshot("project-1", "user-2")
+
+    snapshot = asyncio.run(run())
+
+    assert snapshot["project"]["usedToday"] == 4 * cost
+    assert snapshot["project"]["requestsToday"] == 4
+    assert snapshot["project"]["usedByMethod"] == {"youtube.comments.insert": 4 * cost}
+    assert snapshot["user"]["usedToday"] == 2 * cost
+
+
+def test_exhausted_user_does_not_burn_project_quota(db, monkeypatch):
+    monkeypatch.setattr(quota, "YOUTUBE_USER_DAILY_QUOTA", 500)
+
+    async def run():
+        quotas = manager(db)
+        await quotas.acquire("project-1", "user-1", "youtube.comments.insert", max_wait=0, count=3)
+        with pytest.raises(QuotaExhausted):
+            await quotas.acquire("project-1", "user-1", "youtube.comments.insert", max_wait=0, count=2)
+        # The project units leased for the refused call are still good for another user.
+        await quotas.acquire("project-1", "user-2", "youtube.comments.insert", max_wait=0, count=2)
+        return await quotas.snapshot("project-1", "user-1")
+
+    snapshot = asyncio.run(run())
+
+    assert snapshot["project"]["usedToday"] == 5 * quota.quota_cost("youtube.comments.insert")
+    assert snapshot["project"]["requestsToday"] == 5
+    assert snapshot["user"]["requestsToday"] == 3
+
+
+def test_close_gives_unspent_units_back(db):
+    async def run():
+        quotas = manager(db, lease_units=100)
+        await quotas.acquire("project-1", "user-1", "youtube.commentThreads.list", max_wait=0)
+        await quotas.close()
+        return await db.youtube_quota.find_one({"_id": "project:project-1"})
+
+    doc = asyncio.run(run())
+
+    assert doc["tokens"] == pytest.approx(TokenBucket(quota.YOUTUBE_PROJECT_DAILY_QUOTA).capacity - 1, abs=1)
+
+
+def test_rate_limit_errors_back_off_the_user(db):
+    async def run():
+        quotas = manager(db)
+        handled = await quotas.report_error("project-1", "user-1", ["rateLimitExceeded"])
+        ignored = await quotas.report_error("project-1", "user-1", ["forbidden"])
+        with pytest.raises(QuotaExhausted) as blocked:
+            await quotas.acquire("project-1", "user-1", "youtube.commentThreads.list", max_wait=0)
+        return handled, ignored, blocked.value.retry_after
+
+    handled, ignored, retry_after = asyncio.run(run())
+
+    assert handled and not ignored
+    assert 0 < retry_after <= quota.QUOTA_BACKOFF_SECONDS
+
+
+def test_daily_quota_error_stops_every_instance(db):
+    async def run():
+        first, second = manager(db), manager(db)
+        await second.acquire("project-1", "user-2", "youtube.commentThreads.list", max_wait=0)
+        await first.report_error("project-1", "user-1", ["quotaExceeded"])
+        with pytest.raises(QuotaExhausted) as blocked:
+            await first.acquire("project-1", "user-1", "youtube.commentThreads.list", max_wait=0)
+        # The other instance finds out once its leased units run out.
+        second._leases[("project", "project-1")].units = 0
+        with pytest.raises(QuotaExhausted):
+            await second.acquire("project-1", "user-2", "youtube.commentThreads.list", max_wait=0)
+        return blocked.value.retry_after
+
+    assert asyncio.run(run()) == pytest.approx(quota.seconds_until_reset(), abs=5)
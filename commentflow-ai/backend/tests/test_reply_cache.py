@@ -0,0 +1,64 @@
+from reply_cache import ReplyCache, similarity_key
+
+
+def test_key_ignores_case_markup_and_repeated_emoji():
+    assert similarity_key("<b>Great</b> video 🔥🔥🔥") == similarity_key("great VIDEO!!! 🔥️")
+
+
+def test_key_keeps_script_and_questions():
+    assert similarity_key("part 2 soon") != similarity_key("part 2 soon?")
+    assert similarity_key("చాలా బాగుంది") != similarity_key("chala bagundi")
+    assert similarity_key("this tutorial finally made closures click for me") is None
+
+
+def full_cache(text, pool_size=2, **kwargs):
+    cache = ReplyCache(pool_size=pool_size, **kwargs)
+    for index in range(pool_size):
+        cache.store("UC1", text, f"Thanks! #{index}")
+    return cache
+
+
+def test_near_duplicates_share_an_entry():
+    cache = full_cache("Great video!")
+
+    assert cache.lookup("UC1", "great video bro") in {"Thanks! #0", "Thanks! #1"}
+    assert cache.lookup("UC1", "video was great") in {"Thanks! #0", "Thanks! #1"}
+    assert cache.lookup("UC1", "nice video") is None
+    assert cache.lookup("UC1", "great video?") is None
+    assert cache.lookup("UC2", "great video") is None
+    assert cache.stats("UC1") == {"hits": 2, "misses": 2, "hitRate": 50.0}
+
+
+def test_near_duplicate_replies_fill_the_same_pool():
+    cache = ReplyCache(pool_size=2)
+    cache.store("UC1", "great video", "Thank you!")
+    cache.store("UC1", "great video bro", "Glad you liked it!")
+
+    assert cache.lookup("UC1", "Great video!!") in {"Thank you!", "Glad you liked it!"}
+
+
+def test_pool_must_fill_before_replies_are_reused():
+    cache = ReplyCache(pool_size=3)
+    cache.store("UC1", "first", "Thanks!")
+
+    assert cache.lookup("UC1", "first") is None
+
+
+def test_eviction_and_invalidation_drop_index_entries():
+    cache = ReplyCache(max_entries=1, pool_size=1)
+    cache.store("UC1", "great video", "Thanks!")
+    cache.store("UC1", "first", "You made it!")
+
+    assert cache.lookup("UC1", "great video bro") is None
+    assert cache.lookup("UC1", "first!!") == "You made it!"
+
+    cache.invalidate("UC1")
+    assert cache.lookup("UC1", "first") is None
+    assert not cache._index
+
+
+def test_expired_entries_miss():
+    cache = full_cache("great video", ttl=-1)
+
+    assert cache.lookup("UC1", "great video") is None
+    assert not cache._entries
@@ -0,0 +1,166 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import reply_queue
+from reply_queue import JOB_DEAD, JOB_DONE, JOB_LEASED, JOB_QUEUED, PermanentFailure, ReplyWorkerPool, RetryLater
+
+
+def job(comment_id="c1"):
+    return {
+        "user_id": "user-1",
+        "channel_id": "UC1",
+        "comment_id": comment_id,
+        "video_id": "v1",
+        "text": "Great video!",
+        "published_at": datetime.utcnow(),
+    }
+
+
+def test_enqueue_is_idempotent(db):
+    async def run():
+        first = await reply_queue.enqueue([job(), job("c2")])
+        again = await reply_queue.enqueue([job()])
+        return first, again, await db.reply_jobs.count_documents({})
+
+    assert asyncio.run(run()) == (2, 0, 2)
+
+
+def test_held_jobs_are_leased_only_after_release(db):
+    async def run():
+        await reply_queue.enqueue([job()], hold_seconds=300)
+        before = await reply_queue.lease("worker-a")
+        await reply_queue.release("user-1", "UC1", {"c1": "Thank you!"})
+        after = await reply_queue.lease("worker-a")
+        return before, after
+
+    before, after = asyncio.run(run())
+
+    assert before is None
+    assert after["comment_id"] == "c1"
+    assert after["reply_text"] == "Thank you!"
+
+
+def test_expired_lease_passes_to_another_worker(db):
+    async def run():
+        await reply_queue.enqueue([job()])
+        stale = await reply_queue.lease("worker-a", lease_seconds=0)
+        taken = await reply_queue.lease("worker-b")
+        stale_done = await reply_queue.complete(stale)
+        taken_done = await reply_queue.complete(taken)
+        return stale, taken, stale_done, taken_done, await db.reply_jobs.find_one({})
+
+    stale, taken, stale_done, taken_done, stored = asyncio.run(run())
+
+    assert taken["_id"] == stale["_id"]
+    assert taken["lease_owner"] == "worker-b"
+    assert taken["attempts"] == 2
+    # The worker whose lease ran out can no longer finish the job.
+    assert not stale_done
+    assert taken_done
+    assert stored["status"] == JOB_DONE
+
+
+def test_live_lease_is_not_taken(db):
+    async def run():
+        await reply_queue.enqueue([job()])
+        await reply_queue.lease("worker-a")
+        return await reply_queue.lease("worker-b"), await db.reply_jobs.find_one({})
+
+    other, stored = asyncio.run(run())
+
+    assert other is None
+    assert stored["status"] == JOB_LEASED
+
+
+def test_failing_job_is_dead_lettered_after_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(reply_queue, "retry_delay", lambda attempts: 0)
+    dead = []
+
+    async def handle(job):
+        raise RuntimeError("gemini down")
+
+    async def on_dead(job, error):
+        dead.append((job["_id"], str(error)))
+
+    async def run():
+        pool = ReplyWorkerPool(handle, on_dead=on_dead, max_attempts=3)
+        await reply_queue.enqueue([job()])
+        statuses = []
+        while (leased := await reply_queue.lease(pool.owner)) is not None:
+            await pool.run_job(leased)
+            statuses.append((await db.reply_jobs.find_one({}))["status"])
+        return statuses, await db.reply_jobs.find_one({})
+
+    statuses, stored = asyncio.run(run())
+
+    assert statuses == [JOB_QUEUED, JOB_QUEUED, JOB_DEAD]
+    assert stored["attempts"] == 3
+    assert stored["last_error"] == "gemini down"
+    assert dead == [(stored["_id"], "gemini down")]
+
+
+def test_permanent_failure_is_dead_lettered_at_once(db):
+    async def handle(job):
+        raise PermanentFailure("comment deleted")
+
+    async def run():
+        pool = ReplyWorkerPool(handle, max_attempts=5)
+        await reply_queue.enqueue([job()])
+        await pool.run_job(await reply_queue.lease(pool.owner))
+        return await db.reply_jobs.find_one({})
+
+    stored = asyncio.run(run())
+
+    assert stored["status"] == JOB_DEAD
+    assert stored["attempts"] == 1
+    assert stored["completed_at"] == stored["dead_at"]
+
+
+def test_retry_later_does_not_use_up_an_attempt(db):
+    async def handle(job):
+        raise RetryLater("quota", delay=60)
+
+    async def run():
+        pool = ReplyWorkerPool(handle, max_attempts=1)
+        await reply_queue.enqueue([job()])
+        await pool.run_job(await reply_queue.lease(pool.owner))
+        return await db.reply_jobs.find_one({})
+
+    stored = asyncio.run(run())
+
+    assert stored["status"] == JOB_QUEUED
+    assert stored["attempts"] == 0
+    assert stored["available_at"] > datetime.utcnow() + timedelta(seconds=50)
+
+
+def test_requeue_dead_resets_attempts(db):
+    async def handle(job):
+        raise PermanentFailure("nope")
+
+    async def run():
+        pool = ReplyWorkerPool(handle)
+        await reply_queue.enqueue([job()])
+        await pool.run_job(await reply_queue.lease(pool.owner))
+        requeued = await reply_queue.requeue_dead("user-1", "UC1")
+        return requeued, await reply_queue.queue_stats("user-1", "UC1"), await db.reply_jobs.find_one({})
+
+    requeued, stats, stored = asyncio.run(run())
+
+    assert requeued == 1
+    assert stats == {JOB_QUEUED: 1, JOB_LEASED: 0, JOB_DONE: 0, JOB_DEAD: 0}
+    assert stored["attempts"] == 0
+    # A requeued job must not expire.
+    assert "completed_at" not in stored
+
+
+def test_finished_jobs_expire(db):
+    async def run():
+        await reply_queue.ensure_indexes()
+        await reply_queue.enqueue([job()])
+        await reply_queue.complete(await reply_queue.lease("worker-a"))
+        return await db.reply_jobs.index_information(), await db.reply_jobs.find_one({})
+
+    indexes, stored = asyncio.run(run())
+
+    assert indexes["completed_ttl_idx"]["expireAfterSeconds"] == reply_queue.REPLY_JOB_RETENTION_DAYS * 86400
+    assert stored["completed_at"]
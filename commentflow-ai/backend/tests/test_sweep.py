@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from main import CommentStatus, classify_comment_thread
+
+
+def thread(comment_id="c1", replies=0, likes=3, author_channel="UC-fan"):
+    return {"snippet": {"totalReplyCount": replies, "topLevelComment": {"id": comment_id, "snippet": {
+        "textDisplay": "Great video!",
+        "authorDisplayName": "Fan",
+        "authorChannelId": {"value": author_channel},
+        "publishedAt": "2026-03-01T12:00:00Z",
+        "likeCount": likes,
+    }}}}
+
+
+def stored(status, likes=3):
+    return {"_id": "c1", "status": status, "video_id": "v1", "video_title": "Video", "author_name": "Fan",
+            "author_avatar": None, "text": "Great video!", "published_at": datetime(2026, 3, 1, 12), "like_count": likes}
+
+
+def test_new_comment_is_pending_and_needs_a_reply():
+    record = classify_comment_thread(thread(), None, "v1", "Video", "UC-me")
+
+    assert record["set_fields"]["status"] == CommentStatus.PENDING.value
+    assert record["needs_reply"] and record["changed"]
+
+
+def test_stored_status_is_left_out_of_the_update():
+    # A reply worker may move the comment to REPLIED before the page is written.
+    record = classify_comment_thread(thread(likes=9), stored(CommentStatus.PENDING.value), "v1", "Video", "UC-me")
+
+    assert "status" not in record["set_fields"]
+    assert record["set_fields"]["like_count"] == 9
+    assert record["changed"] and not record["needs_reply"]
+
+
+def test_reply_seen_on_youtube_is_a_transition():
+    record = classify_comment_thread(thread(replies=1), stored(CommentStatus.PENDING.value), "v1", "Video", "UC-me")
+
+    assert record["previous_status"] == CommentStatus.PENDING.value
+    assert record["set_fields"]["status"] == CommentStatus.REPLIED.value
+    assert "replied_at" in record["set_fields"]
+
+
+def test_unchanged_comment_is_not_written():
+    record = classify_comment_thread(thread(), stored(CommentStatus.REPLIED.value), "v1", "Video", "UC-me")
+
+    assert not record["changed"]
+
+
+def test_own_comments_are_ignored():
+    assert classify_comment_thread(thread(author_channel="UC-me"), None, "v1", "Video", "UC-me") is None
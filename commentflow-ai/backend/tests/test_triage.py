@@ -0,0 +1,18 @@
+from triage import DEFAULT_POLICY, score_page
+
+
+def skips(texts, **policy):
+    return [verdict["skip"] for verdict in score_page(texts, {**DEFAULT_POLICY, **policy})]
+
+
+def test_blacklist_matches_whole_words_and_phrases():
+    policy = {"blacklist_words": ["ass", "free money"]}
+
+    assert skips(["Great class today", "what an ASS.", "Get FREE   money now", "money for free"], **policy) == [
+        None, "blacklist", "blacklist", None,
+    ]
+
+
+def test_low_value_comments_are_replied_to_by_default():
+    assert skips(["nice", "🔥🔥"]) == [None, None]
+    assert skips(["nice", "🔥🔥", "nice?"], skip_low_value=True) == ["low_value", "low_value", None]
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import hmac
+
+import websub
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+  <entry>
+    <yt:videoId>own-video</yt:videoId>
+    <yt:channelId>UC-mine</yt:channelId>
+    <title>Feed title</title>
+    <published>2026-01-02T03:04:05+00:00</published>
+  </entry>
+  <entry>
+    <yt:videoId>someone-elses</yt:videoId>
+    <yt:channelId>UC-mine</yt:channelId>
+    <title>Not ours</title>
+  </entry>
+</feed>"""
+
+
+def sign(body, secret, algorithm="sha1"):
+    return f"{algorithm}=" + hmac.new(secret.encode("utf-8"), body, getattr(hashlib, algorithm)).hexdigest()
+
+
+def test_verify_signature_accepts_the_secrets_signature(monkeypatch):
+    monkeypatch.setattr(websub, "WEBSUB_SECRET", "s3cret")
+
+    assert websub.verify_signature(FEED, sign(FEED, "s3cret"))
+    assert websub.verify_signature(FEED, sign(FEED, "s3cret", "sha256"))
+
+
+def test_verify_signature_rejects_bad_signatures(monkeypatch):
+    monkeypatch.setattr(websub, "WEBSUB_SECRET", "s3cret")
+
+    assert not websub.verify_signature(FEED, sign(FEED, "other"))
+    assert not websub.verify_signature(FEED + b" ", sign(FEED, "s3cret"))
+    assert not websub.verify_signature(FEED, sign(FEED, "s3cret", "md5"))
+    assert not websub.verify_signature(FEED, None)
+    assert not websub.verify_signature(FEED, "garbage")
+
+
+def test_verify_signature_rejects_everything_without_a_secret(monkeypatch):
+    monkeypatch.setattr(websub, "WEBSUB_SECRET", None)
+
+    assert not websub.verify_signature(FEED, sign(FEED, ""))
+    assert not websub.verify_signature(FEED, None)
+
+
+class VideosList:
+    def __init__(self, response):
+        self.methodId = "youtube.videos.list"
+        self.response = response
+
+
+class StubClient:
+    # Answers videos().list with the videos YouTube knows, whatever IDs were asked for.
+    def __init__(self, items):
+        self.items = items
+        self.service = self
+        self.calls = []
+
+    def videos(self):
+        return self
+
+    def list(self, **params):
+        self.calls.append(params)
+        ids = params["id"].split(",")
+        return VideosList({"items": [item for item in self.items if item["id"] in ids]})
+
+    async def execute(self, request):
+        return request.response
+
+
+def test_ingest_ignores_videos_of_other_channels(db, monkeypatch):
+    client = StubClient([
+        {"id": "own-video", "snippet": {"channelId": "UC-mine", "title": "Real title", "publishedAt": "2026-01-02T03:04:05Z"}},
+        {"id": "someone-elses", "snippet": {"channelId": "UC-other", "title": "Not ours"}},
+    ])
+    monkeypatch.setattr(websub.youtube_clients, "get", lambda user_id, creds: client)
+
+    async def run():
+        await db.users.insert_one({"_id": "user-1", "youtube_channel": {"id": "UC-mine"}, "google_credentials": "{}"})
+        queued = await websub.ingest(websub.parse_feed(FEED))
+        user = await db.users.find_one({"_id": "user-1"})
+        return queued, user
+
+    queued, user = asyncio.run(run())
+
+    assert queued == 1
+    assert user["sweep_targets"] == ["own-video"]
+    assert client.calls[0]["id"] == "own-video,someone-elses"
@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import httplib2
+import httpx
+from google.oauth2.credentials import Credentials
+
+import fakes
+import youtube_batch
+import youtube_client
+from youtube_batch import _parse_batch_response, _retryable, _serialize, execute_batch
+
+
+def batch_response(parts, boundary="batch_test"):
+    body = "".join(
+        f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-item{index}>\r\n\r\n"
+        f"HTTP/1.1 {status} X\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n{payload}\r\n"
+        for index, status, payload in parts
+    ) + f"--{boundary}--\r\n"
+    return httpx.Response(
+        200, headers={"content-type": f"multipart/mixed; boundary={boundary}"}, content=body.encode("utf-8")
+    )
+
+
+def test_parse_keeps_non_ascii_bodies_byte_for_byte():
+    text = "नमस्ते 🔥 great, చాలా బాగుంది"
+    payload = json.dumps({"items": [{"text": text}]}, ensure_ascii=False)
+    parsed = _parse_batch_response(batch_response([(0, 200, payload)]), 1)
+
+    resp, content = parsed[0]
+    assert resp.status == 200
+    assert content == payload.encode("utf-8")
+    assert json.loads(content)["items"][0]["text"] == text
+
+
+def test_parse_matches_parts_by_content_id_and_fails_missing_ones():
+    parsed = _parse_batch_response(batch_response([(2, 200, "{}"), (0, 404, "")]), 3)
+
+    assert [resp.status for resp, _ in parsed] == [404, 500, 200]
+    # A part the server never answered is retried like a server error.
+    error = youtube_batch.HttpError(parsed[1][0], parsed[1][1], uri="x")
+    assert _retryable(error)
+
+
+def test_serialize_round_trips_a_json_body():
+    service = youtube_client.get_service()
+    request = service.comments().insert(part="snippet", body={"snippet": {"textOriginal": "धन्यवाद 🙏"}})
+
+    head, _, body = _serialize(request).partition("\r\n\r\n")
+    assert head.startswith("POST /youtube/v3/comments?")
+    assert f"Content-Length: {len(body.encode('utf-8'))}" in head
+    assert json.loads(body)["snippet"]["textOriginal"] == "धन्यवाद 🙏"
+
+
+def test_execute_batch_returns_non_ascii_comments_from_the_fake_api(db, monkeypatch):
+    youtube = fakes.FakeYouTube(channels=1, videos_per_channel=3, comments_per_video=len(fakes.COMMENT_TEXTS))
+    monkeypatch.setattr(youtube_client, "_async_http", httpx.AsyncClient(transport=fakes.FakeYouTubeTransport(youtube)))
+    monkeypatch.setattr(youtube_batch, "YOUTUBE_HTTP_TRANSPORT", "httpx")
+    client = youtube_client.YouTubeClient("user-1", Credentials.from_authorized_user_info(fakes.bench_credentials(0)))
+    requests = [
+        client.service.commentThreads().list(part="snippet", videoId=youtube.video_id(0, video), maxResults=100)
+        for video in range(3)
+    ]
+
+    results = asyncio.run(execute_batch(client, requests))
+
+    assert youtube.calls["batch.POST"] == 1
+    texts = {
+        item["snippet"]["topLevelComment"]["snippet"]["textOriginal"]
+        for result in results
+        for item in result["items"]
+    }
+    assert set(fakes.COMMENT_TEXTS) - {text for text in fakes.COMMENT_TEXTS if "{" in text} <= texts
+
+
+def test_execute_batch_resends_only_failed_parts(db, monkeypatch):
+    youtube = fakes.FakeYouTube(channels=1, videos_per_channel=4, comments_per_video=2)
+    transport = fakes.FakeYouTubeTransport(youtube)
+    failed_once = set()
+    request_video = youtube.request
+
+    def flaky(token, method, uri, body):
+        # The first request for each odd video fails with a 503.
+        video = next((video for video in ("c0v1", "c0v3") if f"id={video}&" in uri), None)
+        if video and video not in failed_once:
+            failed_once.add(video)
+            return 503, {"error": {"code": 503, "message": "backend error", "errors": [{"reason": "backendError"}]}}
+        return request_video(token, method, uri, body)
+
+    monkeypatch.setattr(youtube, "request", flaky)
+    monkeypatch.setattr(youtube_client, "_async_http", httpx.AsyncClient(transport=transport))
+    monkeypatch.setattr(youtube_batch, "YOUTUBE_HTTP_TRANSPORT", "httpx")
+    monkeypatch.setattr(youtube_batch, "YOUTUBE_BATCH_RETRY_SECONDS", 0)
+    client = youtube_client.YouTubeClient("user-1", Credentials.from_authorized_user_info(fakes.bench_credentials(0)))
+    requests = [
+        client.service.videos().list(part="statistics", id=youtube.video_id(0, video)) for video in range(4)
+    ]
+
+    results = asyncio.run(execute_batch(client, requests))
+
+    assert [result["items"][0]["id"] for result in results] == [youtube.video_id(0, video) for video in range(4)]
+    assert youtube.calls["batch.POST"] == 2
+    assert youtube.batched_calls == 6
+
+
+def test_retryable_distinguishes_rate_limits_from_permanent_errors():
+    def error(status, reason):
+        content = json.dumps({"error": {"errors": [{"reason": reason}]}}).encode("utf-8")
+        return youtube_batch.HttpError(httplib2.Response({"status": str(status)}), content, uri="x")
+
+    assert _retryable(error(403, "rateLimitExceeded"))
+    assert _retryable(error(429, "tooManyRequests"))
+    assert _retryable(error(503, "backendError"))
+    assert not _retryable(error(403, "forbidden"))
+    assert not _retryable(error(404, "videoNotFound"))
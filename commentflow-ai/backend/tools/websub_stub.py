@@ -0,0 +1,95 @@
+"""Local stand-in for the WebSub hub: posts sample YouTube upload notifications.
+
+Sends the same Atom payload and X-Hub-Signature that the Google hub sends, so the
+webhook and targeted sweeps can be exercised locally. The server only accepts
+notifications signed with its WEBSUB_SECRET, and only for videos of the channel.
+
+    python tools/websub_stub.py --channel UCxxxx --video abc123 --secret s3cret
+    python tools/websub_stub.py --channel UCxxxx --video abc123 --video def456 --secret s3cret
+    python tools/websub_stub.py --channel UCxxxx --verify     # hub verification request
+"""
+import argparse
+import hashlib
+import hmac
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+FEED_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+  <link rel="hub" href="https://pubsubhubbub.appspot.com"/>
+  <link rel="self" href="https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"/>
+  <title>YouTube video feed</title>
+  <updated>{now}</updated>
+{entries}
+</feed>
+"""
+
+ENTRY_TEMPLATE = """  <entry>
+    <id>yt:video:{video_id}</id>
+    <yt:videoId>{video_id}</yt:videoId>
+    <yt:channelId>{channel_id}</yt:channelId>
+    <title>{title}</title>
+    <link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>
+    <author>
+      <name>Stub channel</name>
+      <uri>https://www.youtube.com/channel/{channel_id}</uri>
+    </author>
+    <published>{now}</published>
+    <updated>{now}</updated>
+  </entry>"""
+
+
+def build_feed(channel_id, video_ids):
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+    entries = "\n".join(
+        ENTRY_TEMPLATE.format(video_id=video_id, channel_id=channel_id, title=f"Stub upload {video_id}", now=now)
+        for video_id in video_ids
+    )
+    return FEED_TEMPLATE.format(channel_id=channel_id, now=now, entries=entries).encode("utf-8")
+
+
+def post_feed(url, body, secret=None):
+    headers = {"Content-Type": "application/atom+xml"}
+    if secret:
+        headers["X-Hub-Signature"] = "sha1=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha1).hexdigest()
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+def verify(url, channel_id):
+    challenge = uuid.uuid4().hex
+    query = urllib.parse.urlencode({
+        "hub.mode": "subscribe",
+        "hub.topic": f"https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}",
+        "hub.challenge": challenge,
+        "hub.lease_seconds": "432000",
+    })
+    with urllib.request.urlopen(f"{url}?{query}") as response:
+        echoed = response.read().decode("utf-8")
+    return response.status, echoed == challenge
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000/webhooks/youtube")
+    parser.add_argument("--channel", required=True)
+    parser.add_argument("--video", action="append", default=[])
+    parser.add_argument("--secret", help="sign the payload like the hub does (the server's WEBSUB_SECRET)")
+    parser.add_argument("--verify", action="store_true", help="send a subscription verification request instead")
+    args = parser.parse_args()
+
+    if args.verify:
+        status, ok = verify(args.url, args.channel)
+        print(f"verification: HTTP {status}, challenge {'echoed' if ok else 'NOT echoed'}")
+        return
+    if not args.video:
+        parser.error("--video is required unless --verify is given")
+    status = post_feed(args.url, build_feed(args.channel, args.video), args.secret)
+    print(f"notification for {len(args.video)} video(s): HTTP {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import html
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+import zlib
+from collections import Counter
+
+from database import db
+
+# Local pre-reply triage.
+#
+# Runs over each page of new comments before any Gemini call or reply insert. Every
+# comment gets a spam and a toxicity score from hashed word and bigram features (two
+# fixed-size weight tables, seeded below and optionally extended from
+# TRIAGE_WEIGHTS_PATH) plus rule features for links, contact details, shouting and
+# repeated text, a script guess for language filtering, and a low-value check for
+# comments that may need no reply ("first", emoji-only). The channel's policy, stored
+# in db.channel_settings, decides which of these skip the comment; a skipped comment
+# is stored with status "skipped" and the reason, and never reaches Gemini.
+# Low-value comments are still replied to unless the channel opts in to skipping
+# them: short comments are what the reply cache answers cheaply.
+
+TRIAGE_ENABLED = os.getenv("TRIAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+TRIAGE_HASH_BITS = int(os.getenv("TRIAGE_HASH_BITS", "18"))
+TRIAGE_WEIGHTS_PATH = os.getenv("TRIAGE_WEIGHTS_PATH")
+TRIAGE_POLICY_TTL_SECONDS = float(os.getenv("TRIAGE_POLICY_TTL_SECONDS", "60"))
+# The same text this many times in one video scan is treated as a bot repeat.
+TRIAGE_REPEAT_LIMIT = int(os.getenv("TRIAGE_REPEAT_LIMIT", "3"))
+
+DEFAULT_POLICY = {
+    "enabled": True,
+    "spam_filter_enabled": True,
+    "spam_threshold": 0.8,
+    "toxicity_threshold": 0.8,
+    "skip_low_value": False,
+    "blacklist_words": [],
+    # Unicode scripts to reply to ("latin", "telugu", ...); empty means all.
+    "allowed_scripts": [],
+}
+
+SPAM_BIAS = -3.0
+TOXICITY_BIAS = -3.0
+
+SEED_WEIGHTS = {
+    "spam": {
+        "my channel": 2.0, "check out": 1.2, "sub4sub": 4.5, "sub 4 sub": 4.5, "whatsapp": 2.5,
+        "telegram": 2.5, "crypto": 1.5, "bitcoin": 1.5, "forex": 2.0, "investment": 1.2, "profit": 1.2,
+        "giveaway": 1.5, "winner": 1.5, "congratulations": 1.2, "claim": 1.2, "prize": 1.5, "free": 0.6,
+        "click": 1.0, "dm": 1.0, "inbox": 1.0, "earn": 1.0, "onlyfans": 3.0, "promo": 1.2, "follow me": 2.0,
+        "visit": 0.8, "link": 1.0, "bio": 0.8, "cheap": 1.0, "discount": 1.0, "text me": 2.0, "message me": 2.0,
+    },
+    "toxicity": {
+        "idiot": 2.0, "stupid": 1.5, "dumb": 1.5, "moron": 2.0, "loser": 1.5, "trash": 1.2, "garbage": 1.2,
+        "hate": 1.0, "shut up": 2.0, "ugly": 1.0, "pathetic": 1.5, "disgusting": 1.5, "kys": 4.0,
+        "kill yourself": 4.0, "worst": 0.6,
+    },
+}
+
+LOW_VALUE_WORDS = {
+    "first", "1st", "early", "nice", "wow", "cool", "lol", "lmao", "great", "awesome", "super", "good",
+    "love", "ok", "okay", "hi", "hello", "hey", "yes", "no", "ya", "bro", "fire", "best", "op",
+}
+
+LINK_PATTERN = re.compile(r"https?://|www\.|\b[\w-]+\.(?:com|net|org|ly|io|me|xyz|info|site|shop|link)\b", re.IGNORECASE)
+CONTACT_PATTERN = re.compile(r"\+?\d[\d\s().-]{8,}\d|@\w{3,}")
+TAG_PATTERN = re.compile(r"<[^>]+>")
+SEPARATOR_PATTERN = re.compile(r"[\s!-/:-@\[-`{-~]+")
+
+_policies = {}
+
+
+def _bucket(term):
+    return zlib.crc32(term.encode("utf-8")) & ((1 << TRIAGE_HASH_BITS) - 1)
+
+
+def _build_tables():
+    weights = {name: dict(terms) for name, terms in SEED_WEIGHTS.items()}
+    if TRIAGE_WEIGHTS_PATH:
+        # {"spam": {term: weight}, "toxicity": {...}}, e.g. from a model trained offline.
+        with open(TRIAGE_WEIGHTS_PATH) as f:
+            for name, terms in json.load(f).items():
+                weights.setdefault(name, {}).update(terms)
+    tables = {}
+    for name, terms in weights.items():
+        table = [0.0] * (1 << TRIAGE_HASH_BITS)
+        for term, weight in terms.items():
+            table[_bucket(" ".join(words_of(term)))] += weight
+        tables[name] = table
+    return tables
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def plain_text(text):
+    # textDisplay is HTML: links are <a> tags and line breaks <br>.
+    return html.unescape(TAG_PATTERN.sub(" ", text or ""))
+
+
+def words_of(text):
+    # Lowercased words; combining marks stay, so Indic words are not split apart.
+    words = []
+    for token in SEPARATOR_PATTERN.split(text.lower()):
+        word = "".join(char for char in token if char.isalnum() or unicodedata.category(char).startswith("M"))
+        if word and any(char.isalnum() for char in word):
+            words.append(word)
+    return words
+
+
+def fingerprint(words):
+    return zlib.crc32(" ".join(words).encode("utf-8"))
+
+
+def detect_script(text):
+    # The dominant Unicode script of the letters, e.g. "latin", "devanagari", "telugu".
+    scripts = Counter(
+        unicodedata.name(char, "").split(" ", 1)[0].lower() for char in text if char.isalpha()
+    )
+    scripts.pop("", None)
+    return scripts.most_common(1)[0][0] if scripts else None
+
+
+def _contains(words, phrase):
+    size = len(phrase)
+    return any(tuple(words[start:start + size]) == phrase for start in range(len(words) - size + 1))
+
+
+def _features(text):
+    words = words_of(text)
+    buckets = [_bucket(word) for word in words]
+    buckets += [_bucket(f"{first} {second}") for first, second in zip(words, words[1:])]
+    return words, buckets
+
+
+_tables = _build_tables()
+
+
+def score_page(texts, policy, seen=None):
+    # Scores a page of comment texts in one pass and returns one verdict per text:
+    # {"skip": reason or None, "spam": score, "toxicity": score, "script": script}.
+    # `seen` counts text fingerprints across the pages of one scan, for bot repeats.
+    seen = seen if seen is not None else Counter()
+    spam_table, toxicity_table = _tables["spam"], _tables["toxicity"]
+    # Blacklisted words and phrases match whole words, so "ass" does not match "class".
+    blacklist = [phrase for phrase in (tuple(words_of(entry)) for entry in policy.get("blacklist_words") or []) if phrase]
+    allowed_scripts = set(policy.get("allowed_scripts") or [])
+
+    parsed = []
+    for text in texts:
+        text = plain_text(text)
+        words, buckets = _features(text)
+        parsed.append((text, words, buckets))
+        if words:
+            seen[fingerprint(words)] += 1
+
+    verdicts = []
+    for text, words, buckets in parsed:
+        spam = SPAM_BIAS + sum(spam_table[bucket] for bucket in buckets)
+        toxicity = TOXICITY_BIAS + sum(toxicity_table[bucket] for bucket in buckets)
+        if LINK_PATTERN.search(text):
+            spam += 3.0
+        if CONTACT_PATTERN.search(text):
+            spam += 2.0
+        if words and seen[fingerprint(words)] >= TRIAGE_REPEAT_LIMIT:
+            spam += 3.0
+        letters = [char for char in text if char.isalpha()]
+        if len(letters) >= 10 and sum(char.isupper() for char in letters) / len(letters) > 0.7:
+            toxicity += 1.0
+        verdict = {
+            "skip": None,
+            "spam": round(_sigmoid(spam), 3),
+            "toxicity": round(_sigmoid(toxicity), 3),
+            "script": detect_script(text),
+        }
+        if any(_contains(words, phrase) for phrase in blacklist):
+            verdict["skip"] = "blacklist"
+        elif policy.get("spam_filter_enabled", True) and verdict["spam"] >= policy["spam_threshold"]:
+            verdict["skip"] = "spam"
+        elif verdict["toxicity"] >= policy["toxicity_threshold"]:
+            verdict["skip"] = "toxic"
+        elif allowed_scripts and verdict["script"] and verdict["script"] not in allowed_scripts:
+            verdict["skip"] = "language"
+        elif policy.get("skip_low_value", False) and (
+            not words or ("?" not in text and len(words) <= 2 and all(word in LOW_VALUE_WORDS for word in words))
+        ):
+            verdict["skip"] = "low_value"
+        verdicts.append(verdict)
+    return verdicts
+
+
+def _settings_key(user_id, channel_id):
+    return f"{user_id}:{channel_id}"
+
+
+async def get_policy(user_id, channel_id):
+    # The channel's triage policy, cached for TRIAGE_POLICY_TTL_SECONDS per process.
+    key = _settings_key(user_id, channel_id)
+    cached = _policies.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    doc = await db.channel_settings.find_one({"_id": key}, {"triage": 1}) or {}
+    policy = {**DEFAULT_POLICY, **doc.get("triage", {})}
+    _policies[key] = (policy, time.monotonic() + TRIAGE_POLICY_TTL_SECONDS)
+    return policy
+
+
+async def save_policy(user_id, channel_id, changes):
+    key = _settings_key(user_id, channel_id)
+    await db.channel_settings.update_one(
+        {"_id": key},
+        {"$set": {"user_id": user_id, "channel_id": channel_id, **{f"triage.{name}": value for name, value in changes.items()}}},
+        upsert=True,
+    )
+    _policies.pop(key, None)
+    return await get_policy(user_id, channel_id)
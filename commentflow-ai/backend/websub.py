@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+import sync_state
+from database import db
+from log import get_logger
+from sync_state import parse_youtube_time
+from youtube_client import get_async_http, youtube_clients
+
+# YouTube upload notifications over PubSubHubbub (WebSub).
+#
+# Each connected channel is subscribed to its uploads feed at the Google hub; the hub
+# POSTs an Atom entry to our callback when a video is published or updated. The entry
+# is matched to the users who connected that channel and, once videos.list confirms
+# the video is really that channel's, the video is flagged in its sync state and
+# queued as a sweep target, so it is scanned within a scheduler tick instead of
+# waiting for the next poll. Subscriptions expire and are renewed by the sweeper.
+#
+# Notifications are only accepted signed with WEBSUB_SECRET: without both it and
+# WEBSUB_CALLBACK_URL set, nothing is subscribed and the webhook refuses every
+# request, leaving the sweep to polling alone.
+
+WEBSUB_HUB_URL = os.getenv("WEBSUB_HUB_URL", "https://pubsubhubbub.appspot.com/subscribe")
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL")  # e.g. https://api.example.com/webhooks/youtube
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET")
+WEBSUB_LEASE_SECONDS = int(os.getenv("WEBSUB_LEASE_SECONDS", str(5 * 24 * 3600)))
+# Renew a subscription once less than this much of its lease is left.
+WEBSUB_RENEW_BEFORE_SECONDS = float(os.getenv("WEBSUB_RENEW_BEFORE_SECONDS", str(24 * 3600)))
+WEBSUB_ENABLED = bool(WEBSUB_CALLBACK_URL and WEBSUB_SECRET)
+
+# videos().list accepts up to 50 IDs per call.
+VIDEOS_PER_LIST = 50
+
+log = get_logger("websub")
+
+if WEBSUB_CALLBACK_URL and not WEBSUB_SECRET:
+    log.warning("websub.disabled", reason="WEBSUB_SECRET is not set")
+
+TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+
+_NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+
+def topic_url(channel_id):
+    return TOPIC_URL.format(channel_id=channel_id)
+
+
+def channel_from_topic(topic):
+    prefix = TOPIC_URL.format(channel_id="")
+    return topic[len(prefix):] if topic and topic.startswith(prefix) else None
+
+
+def verify_signature(body, signature_header):
+    # The hub signs each notification with the subscription secret: "sha1=<hex>".
+    # Unsigned notifications are never trusted, so without a secret nothing verifies.
+    if not WEBSUB_SECRET:
+        return False
+    if not signature_header or "=" not in signature_header:
+        return False
+    algorithm, signature = signature_header.split("=", 1)
+    if algorithm not in ("sha1", "sha256", "sha384", "sha512"):
+        return False
+    expected = hmac.new(WEBSUB_SECRET.encode("utf-8"), body, getattr(hashlib, algorithm)).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def parse_feed(body):
+    # Returns one dict per video entry; deleted-entry notifications carry no video
+    # entry and are ignored.
+    root = ET.fromstring(body)
+    entries = []
+    for entry in root.findall("atom:entry", _NS):
+        video_id = entry.findtext("yt:videoId", namespaces=_NS)
+        channel_id = entry.findtext("yt:channelId", namespaces=_NS)
+        if not video_id or not channel_id:
+            continue
+        published = entry.findtext("atom:published", namespaces=_NS)
+        entries.append({
+            "video_id": video_id,
+            "channel_id": channel_id,
+            "title": entry.findtext("atom:title", namespaces=_NS),
+            "published_at": parse_youtube_time(published) if published else datetime.utcnow(),
+        })
+    return entries
+
+
+async def _owned_videos(user, channel_id, entries):
+    # A feed is only as trustworthy as its signature and can name any video, so the
+    # notified videos are looked up with the channel owner's credentials and only the
+    # channel's own are kept, with the title and publish time YouTube reports.
+    client = youtube_clients.get(str(user["_id"]), user["google_credentials"])
+    video_ids = list(dict.fromkeys(entry["video_id"] for entry in entries))
+    owned = {}
+    for start in range(0, len(video_ids), VIDEOS_PER_LIST):
+        chunk = video_ids[start:start + VIDEOS_PER_LIST]
+        response = await client.execute(
+            client.service.videos().list(part="snippet", id=",".join(chunk), maxResults=VIDEOS_PER_LIST)
+        )
+        for item in response.get("items", []):
+            snippet = item.get("snippet", {})
+            if snippet.get("channelId") != channel_id:
+                continue
+            published = snippet.get("publishedAt")
+            owned[item["id"]] = {
+                "video_id": item["id"],
+                "channel_id": channel_id,
+                "title": snippet.get("title"),
+                "published_at": parse_youtube_time(published) if published else datetime.utcnow(),
+            }
+    return list(owned.values())
+
+
+async def ingest(entries):
+    # Flags each notified video of a connected channel and queues it as a sweep target
+    # for every user who connected that channel. Returns the number of (user, video)
+    # targets queued.
+    by_channel = {}
+    for entry in entries:
+        by_channel.setdefault(entry["channel_id"], []).append(entry)
+    queued = 0
+    for channel_id, channel_entries in by_channel.items():
+        users = await db.users.find(
+            {"youtube_channel.id": channel_id, "google_credentials": {"$exists": True}}, {"_id": 1, "google_credentials": 1}
+        ).to_list(length=None)
+        if not users:
+            continue
+        try:
+            videos = await _owned_videos(users[0], channel_id, channel_entries)
+        except Exception as e:
+            # Unverified notifications are dropped; the next poll still finds real uploads.
+            log.warning("websub.verify_videos_failed", channel_id=channel_id, error=str(e))
+            continue
+        ignored = len({entry["video_id"] for entry in channel_entries}) - len(videos)
+        if ignored:
+            log.warning("websub.foreign_videos_ignored", channel_id=channel_id, ignored=ignored)
+        for user in users:
+            user_id = str(user["_id"])
+            for video in videos:
+                await sync_state.request_video_scan(
+                    user_id, channel_id, video["video_id"], video["title"], video["published_at"]
+                )
+                await db.users.update_one({"_id": user["_id"]}, {"$addToSet": {"sweep_targets": video["video_id"]}})
+                queued += 1
+    return queued
+
+
+async def is_known_channel(channel_id):
+    return channel_id is not None and await db.users.find_one({"youtube_channel.id": channel_id}, {"_id": 1}) is not None
+
+
+async def subscribe(channel_id, mode="subscribe"):
+    data = {
+        "hub.callback": WEBSUB_CALLBACK_URL,
+        "hub.topic": topic_url(channel_id),
+        "hub.mode": mode,
+        "hub.verify": "async",
+        "hub.lease_seconds": str(WEBSUB_LEASE_SECONDS),
+        "hub.secret": WEBSUB_SECRET,
+    }
+    response = await get_async_http().post(WEBSUB_HUB_URL, data=data, timeout=10)
+    # 202 Accepted: the hub verifies the callback asynchronously.
+    response.raise_for_status()
+
+
+async def ensure_subscription(user_id, channel_id, channel_state):
+    if not WEBSUB_ENABLED:
+        return
+    expires_at = channel_state.get("websub_expires_at")
+    if expires_at and expires_at - datetime.utcnow() > timedelta(seconds=WEBSUB_RENEW_BEFORE_SECONDS):
+        return
+    try:
+        await subscribe(channel_id)
+    except Exception as e:
+        log.warning("websub.subscribe_failed", channel_id=channel_id, error=str(e))
+        return
+    log.info("websub.subscribed", channel_id=channel_id)
+    await sync_state.save_channel_state(
+        user_id, channel_id, websub_expires_at=datetime.utcnow() + timedelta(seconds=WEBSUB_LEASE_SECONDS)
+    )
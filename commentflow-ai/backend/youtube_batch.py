@@ -0,0 +1,260 @@
+import asyncio
+import email.message
+import email.parser
+import os
+import re
+import time
+import urllib.parse
+import uuid
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+
+import metrics
+from log import get_logger
+from quota import RATE_LIMIT_REASONS, QuotaExhausted, youtube_quota
+from youtube_client import YOUTUBE_HTTP_TRANSPORT, error_reasons
+
+# Batched YouTube reads.
+#
+# `execute_batch` sends many API requests as one multipart/mixed call to the batch
+# endpoint. Each request is still charged its own quota, but a sweep over a large
+# channel costs one round trip per YOUTUBE_BATCH_SIZE videos instead of one per
+# video. Responses are unpacked per request, and only the sub-requests that failed
+# with a transient error (5xx, 429, rate limits) are sent again.
+#
+# `video_statistics` coalesces the statistics lookups one user makes within a short
+# window into videos().list calls of up to 50 IDs each, sent as a single batch.
+
+YOUTUBE_BATCH_URI = os.getenv("YOUTUBE_BATCH_URI", "https://youtube.googleapis.com/batch")
+YOUTUBE_BATCH_SIZE = int(os.getenv("YOUTUBE_BATCH_SIZE", "50"))
+YOUTUBE_BATCH_RETRIES = int(os.getenv("YOUTUBE_BATCH_RETRIES", "2"))
+YOUTUBE_BATCH_RETRY_SECONDS = float(os.getenv("YOUTUBE_BATCH_RETRY_SECONDS", "1"))
+YOUTUBE_BATCH_WINDOW_SECONDS = float(os.getenv("YOUTUBE_BATCH_WINDOW_SECONDS", "0.005"))
+
+# videos().list accepts up to 50 IDs per call.
+VIDEOS_PER_LIST = 50
+
+BATCH_METHOD = "youtube.batch"
+
+log = get_logger("youtube")
+
+
+def _serialize(request):
+    # One sub-request in application/http form; the batch call carries the token.
+    parts = urllib.parse.urlsplit(request.uri)
+    target = parts.path + ("?" + parts.query if parts.query else "")
+    lines = [f"{request.method} {target} HTTP/1.1", f"Host: {parts.netloc}"]
+    for key, value in request.headers.items():
+        if key.lower() not in ("content-length", "accept-encoding", "authorization"):
+            lines.append(f"{key}: {value}")
+    body = request.body or ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    if body:
+        lines.append(f"Content-Length: {len(body.encode('utf-8'))}")
+    return "\r\n".join(lines) + "\r\n\r\n" + body
+
+
+def _split_head(data):
+    # (head, body) of an HTTP message or MIME part, split at the first blank line.
+    blank_line = re.search(rb"\r?\n\r?\n", data)
+    return (data[:blank_line.start()], data[blank_line.end():]) if blank_line else (data, b"")
+
+
+def _deserialize(payload):
+    # Bodies stay bytes down to the request's postproc, which decodes the JSON as UTF-8.
+    status_line, _, rest = payload.partition(b"\n")
+    status = status_line.split(b" ", 2)[1].decode("ascii")
+    head, content = _split_head(rest)
+    headers = email.parser.BytesParser().parsebytes(head, headersonly=True)
+    resp = httplib2.Response({**{key.lower(): value for key, value in headers.items()}, "status": status})
+    return resp, content
+
+
+def _parse_batch_response(response, count):
+    # Split on the boundary by hand: the email parser would decode every part as text.
+    message = email.message.Message()
+    message["content-type"] = response.headers["content-type"]
+    delimiter = b"--" + message.get_boundary().encode("ascii")
+    # A part missing from the response is treated like a server error, so it is retried.
+    parsed = [(httplib2.Response({"status": "500"}), b"")] * count
+    for part in response.content.split(delimiter)[1:]:
+        if part.startswith(b"--"):
+            break
+        # The line break before the next delimiter belongs to the delimiter.
+        part = part[2:] if part.startswith(b"\r\n") else part.lstrip(b"\n")
+        part = part[:-2] if part.endswith(b"\r\n") else part.removesuffix(b"\n")
+        head, payload = _split_head(part)
+        headers = email.parser.BytesParser().parsebytes(head, headersonly=True)
+        match = re.search(r"item(\d+)", headers.get("Content-ID", ""))
+        if match and int(match.group(1)) < count:
+            parsed[int(match.group(1))] = _deserialize(payload)
+    return parsed
+
+
+async def _send_batch(client, requests):
+    boundary = "batch_" + uuid.uuid4().hex
+    body = "".join(
+        f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <item{index}>\r\n\r\n{_serialize(request)}\r\n"
+        for index, request in enumerate(requests)
+    ) + f"--{boundary}--\r\n"
+    outcome = "ok"
+    started = time.perf_counter()
+    try:
+        response = await client.send_signed(
+            "POST", YOUTUBE_BATCH_URI, body.encode("utf-8"), {"content-type": f"multipart/mixed; boundary={boundary}"}
+        )
+        outcome = "ok" if response.status_code < 300 else str(response.status_code)
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        metrics.YOUTUBE_REQUEST_DURATION.observe(time.perf_counter() - started, method=BATCH_METHOD)
+        metrics.YOUTUBE_REQUESTS.inc(method=BATCH_METHOD, outcome=outcome)
+    if response.status_code >= 300:
+        resp = httplib2.Response({**response.headers, "status": str(response.status_code)})
+        raise HttpError(resp, response.content, uri=YOUTUBE_BATCH_URI)
+    return _parse_batch_response(response, len(requests))
+
+
+async def _unpack(client, request, resp, content):
+    # Returns what executing `request` on its own would have returned or raised.
+    if resp.status >= 300:
+        error = HttpError(resp, content, uri=request.uri)
+        if resp.status in (403, 429):
+            await youtube_quota.report_error(client.project_id, client.user_id, error_reasons(error))
+        metrics.YOUTUBE_REQUESTS.inc(method=request.methodId, outcome=str(resp.status))
+        return error
+    metrics.YOUTUBE_REQUESTS.inc(method=request.methodId, outcome="ok")
+    try:
+        return request.postproc(resp, content)
+    except Exception as e:
+        return e
+
+
+def _retryable(result):
+    if isinstance(result, httpx.TransportError):
+        return True
+    if not isinstance(result, HttpError):
+        return False
+    status = getattr(result.resp, "status", None)
+    if status == 403:
+        return bool(RATE_LIMIT_REASONS & set(error_reasons(result)))
+    return status == 429 or (status is not None and status >= 500)
+
+
+async def _execute_chunk(client, requests, indexes, results, limiter):
+    for attempt in range(YOUTUBE_BATCH_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(YOUTUBE_BATCH_RETRY_SECONDS * 2 ** (attempt - 1))
+        # Every sub-request is charged like a request of its own, resends included:
+        # all requests of one method at once when the quota allows it right away,
+        # otherwise one by one so that as many as possible still go out.
+        charged = []
+        by_method = {}
+        for index in indexes:
+            by_method.setdefault(requests[index].methodId, []).append(index)
+        for method_id, group in by_method.items():
+            try:
+                await youtube_quota.acquire(client.project_id, client.user_id, method_id, max_wait=0, count=len(group))
+                charged.extend(group)
+                continue
+            except QuotaExhausted:
+                pass
+            for index in group:
+                try:
+                    await youtube_quota.acquire(client.project_id, client.user_id, method_id)
+                    charged.append(index)
+                except QuotaExhausted as e:
+                    results[index] = e
+        charged.sort()
+        if not charged:
+            return
+        try:
+            if limiter is None:
+                responses = await _send_batch(client, [requests[index] for index in charged])
+            else:
+                async with limiter:
+                    responses = await _send_batch(client, [requests[index] for index in charged])
+            for index, (resp, content) in zip(charged, responses):
+                results[index] = await _unpack(client, requests[index], resp, content)
+        except (HttpError, httpx.HTTPError) as e:
+            # The batch call itself failed, and with it every request it carried.
+            for index in charged:
+                results[index] = e
+        indexes = [index for index in charged if _retryable(results[index])]
+        if not indexes or attempt == YOUTUBE_BATCH_RETRIES:
+            return
+        log.info("youtube.batch_retry", user_id=client.user_id, failed=len(indexes), attempt=attempt + 1)
+
+
+async def execute_batch(client, requests, limiter=None):
+    # Returns one result per request, in order: the parsed response, or the exception
+    # the request failed with. A batch call takes one of the user's `limiter` slots.
+    requests = list(requests)
+    if YOUTUBE_HTTP_TRANSPORT == "httplib2" or len(requests) <= 1:
+        return list(await asyncio.gather(
+            *(client.execute(request, limiter) for request in requests), return_exceptions=True
+        ))
+    client.last_used = time.monotonic()
+    results = [None] * len(requests)
+    await asyncio.gather(*(
+        _execute_chunk(client, requests, list(range(start, min(start + YOUTUBE_BATCH_SIZE, len(requests)))), results, limiter)
+        for start in range(0, len(requests), YOUTUBE_BATCH_SIZE)
+    ))
+    return results
+
+
+class VideoStatisticsLoader:
+    def __init__(self, window=YOUTUBE_BATCH_WINDOW_SECONDS):
+        self.window = window
+        self._pending = {}
+        self._flushes = set()
+
+    async def load(self, client, video_ids):
+        # Returns {video_id: statistics} for the requested videos that exist.
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(client)
+        if pending is None:
+            pending = self._pending[client] = {}
+            task = asyncio.create_task(self._flush(client, pending))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        futures = {}
+        for video_id in video_ids:
+            if video_id not in pending:
+                pending[video_id] = loop.create_future()
+            futures[video_id] = pending[video_id]
+        # Shielded, so a caller going away does not cancel a lookup others share.
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()))
+        return {video_id: statistics for video_id, statistics in zip(futures, results) if statistics is not None}
+
+    async def _flush(self, client, pending):
+        await asyncio.sleep(self.window)
+        if self._pending.get(client) is pending:
+            del self._pending[client]
+        video_ids = list(pending)
+        chunks = [video_ids[start:start + VIDEOS_PER_LIST] for start in range(0, len(video_ids), VIDEOS_PER_LIST)]
+        requests = [
+            client.service.videos().list(part="statistics", id=",".join(chunk), maxResults=VIDEOS_PER_LIST)
+            for chunk in chunks
+        ]
+        try:
+            results = await execute_batch(client, requests)
+        except Exception as e:
+            results = [e] * len(chunks)
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, BaseException):
+                for video_id in chunk:
+                    pending[video_id].set_exception(result)
+                    # Mark the error as retrieved even if every waiter has gone away.
+                    pending[video_id].exception()
+                continue
+            statistics = {item["id"]: item.get("statistics", {}) for item in result.get("items", [])}
+            for video_id in chunk:
+                pending[video_id].set_result(statistics.get(video_id))
+
+
+video_statistics = VideoStatisticsLoader()
@@ -0,0 +1,242 @@
+import importlib.util
+import json
+import os
+import time
+from collections import OrderedDict
+
+import httplib2
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MAX_URI_LENGTH, build_http
+
+import metrics
+from credential_manager import credential_manager
+from log import get_logger
+from quota import DAILY_QUOTA_REASONS, RATE_LIMIT_REASONS, QuotaExhausted, youtube_quota
+
+# Cached YouTube client factory.
+#
+# `build("youtube", "v3", ...)` re-parses the discovery document and opens a new
+# transport on every call. Here the discovery document is parsed once into a single
+# shared service object that is only used to construct requests; each user gets a
+# small pool of authorized httplib2 transports that keep their connections alive and
+# share the user's Credentials from `credential_manager`, which renews access tokens
+# shortly before they expire and saves them back to the user document.
+# Every request is charged against the project's and the user's YouTube quota first.
+#
+# Requests are sent by one shared httpx.AsyncClient (HTTP/2 when h2 is installed,
+# keep-alive pool) and signed with the user's credentials, so in-flight calls cost
+# no threads and the sweep cannot starve API handlers of the threadpool. Set
+# YOUTUBE_HTTP_TRANSPORT=httplib2 to execute them on the threadpool with the
+# googleapiclient transports instead.
+
+YOUTUBE_CLIENT_CACHE_SIZE = int(os.getenv("YOUTUBE_CLIENT_CACHE_SIZE", "1000"))
+YOUTUBE_CLIENT_IDLE_SECONDS = float(os.getenv("YOUTUBE_CLIENT_IDLE_SECONDS", "1800"))
+YOUTUBE_CLIENT_POOL_SIZE = int(os.getenv("YOUTUBE_CLIENT_POOL_SIZE", "4"))
+YOUTUBE_HTTP_TRANSPORT = os.getenv("YOUTUBE_HTTP_TRANSPORT", "httpx")  # httpx | httplib2
+YOUTUBE_HTTP_MAX_CONNECTIONS = int(os.getenv("YOUTUBE_HTTP_MAX_CONNECTIONS", "100"))
+YOUTUBE_HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("YOUTUBE_HTTP_KEEPALIVE_CONNECTIONS", "20"))
+YOUTUBE_HTTP_TIMEOUT_SECONDS = float(os.getenv("YOUTUBE_HTTP_TIMEOUT_SECONDS", "30"))
+YOUTUBE_HTTP2 = os.getenv("YOUTUBE_HTTP2", "true").lower() in ("1", "true", "yes")
+
+log = get_logger("youtube")
+
+_service = None
+_async_http = None
+
+
+def get_service():
+    # Requests built from this service must be executed with an explicit `http`;
+    # its own transport carries no credentials.
+    global _service
+    if _service is None:
+        _service = build_from_document(get_static_doc("youtube", "v3"), http=build_http())
+    return _service
+
+
+def build_async_http():
+    http2 = YOUTUBE_HTTP2 and importlib.util.find_spec("h2") is not None
+    if YOUTUBE_HTTP2 and not http2:
+        log.warning("youtube.http2_unavailable", hint="pip install 'httpx[http2]'")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=YOUTUBE_HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(
+            max_connections=YOUTUBE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=YOUTUBE_HTTP_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+
+
+def get_async_http():
+    global _async_http
+    if _async_http is None:
+        _async_http = build_async_http()
+    return _async_http
+
+
+async def close_async_http():
+    global _async_http
+    if _async_http is not None:
+        await _async_http.aclose()
+        _async_http = None
+
+
+def error_reasons(e):
+    try:
+        errors_list = json.loads(e.content.decode("utf-8"))["error"].get("errors", [])
+    except Exception:
+        return []
+    return [err.get("reason") for err in errors_list if isinstance(err, dict) and "reason" in err]
+
+
+def is_quota_error(e):
+    # True for our own limiter giving up and for Google's quota/rate-limit errors.
+    if isinstance(e, QuotaExhausted):
+        return True
+    return isinstance(e, HttpError) and bool((DAILY_QUOTA_REASONS | RATE_LIMIT_REASONS) & set(error_reasons(e)))
+
+
+class YouTubeClient:
+    def __init__(self, user_id, credentials, pool_size=YOUTUBE_CLIENT_POOL_SIZE):
+        self.service = get_service()
+        self.user_id = user_id
+        self.credentials = credentials
+        # Quota is tracked per Google project, i.e. per OAuth client.
+        self.project_id = credentials.client_id
+        self.pool_size = pool_size
+        self.last_used = time.monotonic()
+        self._idle = []
+
+    def _checkout(self):
+        # httplib2 transports are not thread-safe, so each in-flight request holds
+        # one exclusively; idle ones are kept for connection reuse.
+        if self._idle:
+            return self._idle.pop()
+        return AuthorizedHttp(self.credentials, http=build_http())
+
+    def _checkin(self, http):
+        if len(self._idle) < self.pool_size:
+            self._idle.append(http)
+        else:
+            http.close()
+
+    async def execute(self, request, limiter=None):
+        self.last_used = time.monotonic()
+        # Waiting for quota happens before taking one of the user's request slots.
+        await youtube_quota.acquire(self.project_id, self.user_id, request.methodId)
+        await credential_manager.ensure_fresh(self.user_id, self.credentials)
+        if limiter is None:
+            return await self._execute(request)
+        async with limiter:
+            return await self._execute(request)
+
+    async def send_signed(self, method, uri, body=None, headers=None):
+        # Sends one HTTP request with the user's access token on the shared async client.
+        headers = dict(headers or {})
+        for attempt in range(2):
+            await credential_manager.ensure_fresh(self.user_id, self.credentials)
+            token = self.credentials.token
+            self.credentials.apply(headers)
+            response = await get_async_http().request(method, uri, content=body, headers=headers)
+            # A token revoked or expired early: refresh once and resend.
+            if response.status_code != 401 or attempt:
+                return response
+            await credential_manager.refresh(self.user_id, self.credentials, stale_token=token)
+
+    async def _send(self, request):
+        # Same request as HttpRequest.execute() would send, without blocking a thread.
+        method, uri, body = request.method, request.uri, request.body
+        headers = {key: value for key, value in request.headers.items() if key.lower() != "content-length"}
+        if len(uri) > MAX_URI_LENGTH and method == "GET":
+            method = "POST"
+            headers["x-http-method-override"] = "GET"
+            headers["content-type"] = "application/x-www-form-urlencoded"
+            uri, body = uri.split("?", 1)
+        response = await self.send_signed(method, uri, body, headers)
+        resp = httplib2.Response({**response.headers, "status": str(response.status_code)})
+        if response.status_code >= 300:
+            raise HttpError(resp, response.content, uri=request.uri)
+        return request.postproc(resp, response.content)
+
+    async def _execute(self, request):
+        if YOUTUBE_HTTP_TRANSPORT == "httplib2":
+            return await self._execute_on_thread(request)
+        return await self._observe(request, self._send(request))
+
+    async def _execute_on_thread(self, request):
+        http = self._checkout()
+        try:
+            return await self._observe(request, run_in_threadpool(request.execute, http=http))
+        finally:
+            self._checkin(http)
+
+    async def _observe(self, request, call):
+        outcome = "ok"
+        started = time.perf_counter()
+        try:
+            return await call
+        except HttpError as e:
+            outcome = str(getattr(e.resp, "status", "error"))
+            if getattr(e.resp, "status", None) in (403, 429):
+                await youtube_quota.report_error(self.project_id, self.user_id, error_reasons(e))
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            metrics.YOUTUBE_REQUEST_DURATION.observe(time.perf_counter() - started, method=request.methodId)
+            metrics.YOUTUBE_REQUESTS.inc(method=request.methodId, outcome=outcome)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class YouTubeClientFactory:
+    def __init__(self, max_clients=YOUTUBE_CLIENT_CACHE_SIZE, idle_ttl=YOUTUBE_CLIENT_IDLE_SECONDS):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self._clients = OrderedDict()
+
+    def get(self, user_id, creds_json):
+        self.evict_idle()
+        # A reconnect stores new credentials; the cached client must not outlive them.
+        credentials = credential_manager.get(user_id, creds_json)
+        client = self._clients.get(user_id)
+        if client is not None and client.credentials is credentials:
+            self._clients.move_to_end(user_id)
+            client.last_used = time.monotonic()
+            return client
+        if client is not None:
+            client.close()
+
+        client = YouTubeClient(user_id, credentials)
+        self._clients[user_id] = client
+        while len(self._clients) > self.max_clients:
+            _, evicted = self._clients.popitem(last=False)
+            evicted.close()
+        return client
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are kept in least-recently-used order, so stop at the first fresh one.
+        while self._clients:
+            user_id, client = next(iter(self._clients.items()))
+            if client.last_used >= cutoff:
+                break
+            self._clients.pop(user_id)
+            client.close()
+
+    def invalidate(self, user_id):
+        credential_manager.invalidate(user_id)
+        client = self._clients.pop(user_id, None)
+        if client is not None:
+            client.close()
+
+
+youtube_clients = YouTubeClientFactory()